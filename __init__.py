@@ -1,2 +1,10 @@
 from .db import DB
-from .gui import PWSM
+from .importer import CSVImporter
+
+
+def __getattr__(name):
+    # The GUI pulls in tkinter, customtkinter and tkintermapview, load it only when it is used
+    if name == "PWSM":
+        from .gui import PWSM
+        return PWSM
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
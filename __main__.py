@@ -1,6 +1,15 @@
-from pwms import PWSM, DB
+import sys
+
+from pwms import DB
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "cli":
+        from pwms.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[2:]))
+
+    from pwms import PWSM
+
     database = DB()
     database.init_tables()
     
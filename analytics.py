@@ -0,0 +1,107 @@
+from operator import itemgetter
+
+from .db import DB, PORT_SUMMARY, WAREHOUSE_SUMMARY, Tables
+
+# Columns the fleet views may be sorted by, fill_ratio descending is "closest to full"
+SORT_COLUMNS = (
+    "id", "capacity", "total_items", "capacity_remaining",
+    "fill_ratio", "total_value", "in_transit_items", "in_transit_share",
+)
+
+# Items per warehouse that are on a shipping which has not arrived at its port yet
+IN_TRANSIT = f"""
+    SELECT inv.warehouse_id AS warehouse_id, SUM(inv.quantity) AS in_transit
+    FROM {Tables.INVENTORY} inv
+    WHERE inv.inventory_id IN (
+        SELECT inventory_id FROM {Tables.SHIPPINGS} WHERE NOT IFNULL(arrived_at_port, 0))
+    GROUP BY inv.warehouse_id
+"""
+
+WAREHOUSE_UTILIZATION = f"""
+    WITH transit AS ({IN_TRANSIT})
+    SELECT
+        w.warehouse_id AS id,
+        w.name AS warehouse_name,
+        w.port_id AS connected_port,
+        w.capacity AS capacity,
+        s.total_items AS total_items,
+        w.capacity - s.total_items AS capacity_remaining,
+        CAST(s.total_items AS REAL) / NULLIF(w.capacity, 0) AS fill_ratio,
+        s.total_value AS total_value,
+        IFNULL(t.in_transit, 0) AS in_transit_items,
+        IFNULL(CAST(t.in_transit AS REAL) / NULLIF(s.total_items, 0), 0.0) AS in_transit_share
+    FROM {Tables.WAREHOUSES} w
+    JOIN {WAREHOUSE_SUMMARY} s ON s.warehouse_id = w.warehouse_id
+    LEFT JOIN transit t ON t.warehouse_id = w.warehouse_id
+"""
+
+PORT_UTILIZATION = f"""
+    WITH transit AS ({IN_TRANSIT})
+    SELECT
+        p.port_id AS id,
+        p.name AS port_name,
+        p.country AS country,
+        ps.total_warehouses AS total_warehouses,
+        ps.total_warehouse_capacity AS capacity,
+        IFNULL(SUM(s.total_items), 0) AS total_items,
+        ps.total_warehouse_capacity - IFNULL(SUM(s.total_items), 0) AS capacity_remaining,
+        CAST(SUM(s.total_items) AS REAL) / NULLIF(ps.total_warehouse_capacity, 0) AS fill_ratio,
+        IFNULL(SUM(s.total_value), 0.0) AS total_value,
+        IFNULL(SUM(t.in_transit), 0) AS in_transit_items,
+        IFNULL(CAST(SUM(t.in_transit) AS REAL) / NULLIF(SUM(s.total_items), 0), 0.0) AS in_transit_share
+    FROM {Tables.PORTS} p
+    JOIN {PORT_SUMMARY} ps ON ps.port_id = p.port_id
+    LEFT JOIN {Tables.WAREHOUSES} w ON w.port_id = p.port_id
+    LEFT JOIN {WAREHOUSE_SUMMARY} s ON s.warehouse_id = w.warehouse_id
+    LEFT JOIN transit t ON t.warehouse_id = w.warehouse_id
+    GROUP BY p.port_id
+"""
+
+
+def _utilization(db: DB, query: str, sort: str, descending: bool,
+                 limit: int | None) -> tuple[list[str], list[tuple]]:
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by {sort!r}, expected one of {', '.join(SORT_COLUMNS)}")
+
+    columns, rows = db.select_rows(query)
+
+    # Sorting the plain tuples here is cheaper than an ORDER BY carrying every column,
+    # ties are kept in id order and rows without a value (no capacity) go last
+    index = columns.index(sort)
+    rows.sort(key=itemgetter(0))
+    present = [row for row in rows if row[index] is not None]
+    present.sort(key=itemgetter(index), reverse=descending)
+    rows = present + [row for row in rows if row[index] is None]
+
+    if limit is not None:
+        rows = rows[:limit]
+    return columns, rows
+
+
+def warehouse_utilization(db: DB, sort: str = "fill_ratio", descending: bool = True,
+                          limit: int | None = None) -> tuple[list[str], list[tuple]]:
+    """
+    Fill ratio, remaining capacity, inventory value and in-transit share of every warehouse
+    Computed in one grouped query over the summary tables, by default closest to full first
+    Returns (columns, rows) like DB.select_rows
+    """
+    return _utilization(db, WAREHOUSE_UTILIZATION, sort, descending, limit)
+
+
+def port_utilization(db: DB, sort: str = "fill_ratio", descending: bool = True,
+                     limit: int | None = None) -> tuple[list[str], list[tuple]]:
+    """
+    The warehouse figures rolled up per port
+    """
+    return _utilization(db, PORT_UTILIZATION, sort, descending, limit)
+
+
+def fleet_overview(db: DB, sort: str = "fill_ratio",
+                   descending: bool = True) -> dict[str, tuple[list[str], list[tuple]]]:
+    """
+    Both views at once, safe to run on a worker thread
+    """
+    return {
+        Tables.WAREHOUSES: warehouse_utilization(db, sort, descending),
+        Tables.PORTS: port_utilization(db, sort, descending),
+    }
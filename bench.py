@@ -0,0 +1,342 @@
+"""
+Benchmarks for the DB layer
+
+    python -m pwms.bench --scale 100k --out bench.json
+    python -m pwms.bench --scale 100k --compare bench.json
+
+The data generator is deterministic for a given scale and seed, so results
+of two runs can be compared to catch regressions.
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3 as sql
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .analytics import port_utilization, warehouse_utilization
+from .db import DB, EVENT_STATUSES, Tables
+
+# Number of inventory rows per scale, the other tables are sized from it
+SCALES = {
+    "1k": 1_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+BATCH_SIZE = 100_000
+CATEGORIES = ["Construction", "Electronics", "Food", "Raw Materials", "Chemicals", "Textiles", "Machinery"]
+
+# Mean time increase that counts as a regression in compare
+REGRESSION_THRESHOLD = 1.25
+
+
+def table_sizes(inventory_rows: int) -> dict[str, int]:
+    ports = max(5, inventory_rows // 2_000)
+    return {
+        Tables.PORTS: ports,
+        Tables.WAREHOUSES: ports * 8,
+        Tables.ITEMS: max(10, inventory_rows // 100),
+        Tables.INVENTORY: inventory_rows,
+        Tables.SHIPPINGS: max(1, inventory_rows // 10),
+    }
+
+
+def generate(db: DB, inventory_rows: int, seed: int = 0, report=print) -> dict[str, int]:
+    """
+    Fill an empty database with ports -> warehouses -> inventory -> shippings
+    Every port gets a cluster of warehouses close to it, inventory is spread
+    over all warehouses and a tenth of the inventory is being shipped
+    """
+    rnd = random.Random(seed)
+    sizes = table_sizes(inventory_rows)
+
+    ports = []
+    for port_id in range(1, sizes[Tables.PORTS] + 1):
+        lat, lon = rnd.uniform(-60, 70), rnd.uniform(-180, 180)
+        ports.append((port_id, f"Port {port_id}", lat, lon, f"Country {port_id % 150}", rnd.randint(100_000, 1_000_000)))
+    _insert_many(db, Tables.PORTS, ["port_id", "name", "latitude", "longitude", "country", "capacity"], ports)
+
+    warehouses = []
+    for warehouse_id in range(1, sizes[Tables.WAREHOUSES] + 1):
+        port = ports[(warehouse_id - 1) % len(ports)]
+        lat = min(max(port[2] + rnd.uniform(-1, 1), -85), 85)
+        lon = min(max(port[3] + rnd.uniform(-1, 1), -180), 180)
+        warehouses.append((warehouse_id, f"Warehouse {warehouse_id}", lat, lon,
+                           rnd.randint(50_000, 500_000), port[0]))
+    _insert_many(db, Tables.WAREHOUSES, ["warehouse_id", "name", "latitude", "longitude", "capacity", "port_id"],
+                 warehouses)
+
+    items = [
+        (item_id, f"Item {item_id}", rnd.choice(CATEGORIES), round(rnd.uniform(1, 5_000), 2))
+        for item_id in range(1, sizes[Tables.ITEMS] + 1)
+    ]
+    _insert_many(db, Tables.ITEMS, ["item_id", "name", "category", "unit_price"], items)
+
+    n_warehouses = sizes[Tables.WAREHOUSES]
+    n_items = sizes[Tables.ITEMS]
+    inventory = (
+        (inventory_id, rnd.randint(1, n_warehouses), rnd.randint(1, n_items), rnd.randint(1, 500))
+        for inventory_id in range(1, inventory_rows + 1)
+    )
+    _insert_many(db, Tables.INVENTORY, ["inventory_id", "warehouse_id", "item_id", "quantity"], inventory)
+
+    n_ports = sizes[Tables.PORTS]
+    shippings = (
+        (shipping_id, rnd.randint(1, n_ports), rnd.randint(1, n_ports), rnd.randint(1, inventory_rows),
+         rnd.random() < 0.5, rnd.random() < 0.25)
+        for shipping_id in range(1, sizes[Tables.SHIPPINGS] + 1)
+    )
+    _insert_many(db, Tables.SHIPPINGS,
+                 ["shipping_id", "from_port", "into_port", "inventory_id", "arrived_at_port", "loaded_to_truck"],
+                 shippings)
+
+    db.clear_cache()
+    if report:
+        report("GENERATED: " + ", ".join(f"{t} {n}" for t, n in sizes.items()))
+    return sizes
+
+
+def _insert_many(db: DB, table_name: str, columns: list[str], rows):
+    query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    rows = iter(rows)
+    while True:
+        batch = [row for _, row in zip(range(BATCH_SIZE), rows)]
+        if not batch:
+            break
+        with db.db:
+            db.cursor.executemany(query, batch)
+
+
+class Benchmark:
+    """
+    Times the public DB methods against a generated database
+    """
+
+    def __init__(self, db: DB, sizes: dict[str, int], seed: int = 0, repeat: int = 200):
+        self.db = db
+        self.sizes = sizes
+        self.rnd = random.Random(seed + 1)
+        self.repeat = repeat
+        self.results: dict[str, dict] = {}
+
+    def run(self) -> dict[str, dict]:
+        self.__run_reads()
+        self.__run_writes()
+        return self.results
+
+    def measure(self, name: str, func, args_list: list[tuple]):
+        times = []
+        for args in args_list:
+            start = time.perf_counter()
+            func(*args)
+            times.append((time.perf_counter() - start) * 1000)
+
+        times.sort()
+        self.results[name] = {
+            "calls": len(times),
+            "total_ms": sum(times),
+            "mean_ms": statistics.fmean(times),
+            "p50_ms": times[len(times) // 2],
+            "p95_ms": times[min(len(times) - 1, int(len(times) * 0.95))],
+            "max_ms": times[-1],
+        }
+
+    def __ids(self, table_name: str, n: int | None = None) -> list[tuple[int]]:
+        return [(self.rnd.randint(1, self.sizes[table_name]),) for _ in range(n or self.repeat)]
+
+    def __positions(self, n: int | None = None) -> list[tuple[float, float]]:
+        return [(self.rnd.uniform(-60, 70), self.rnd.uniform(-180, 180)) for _ in range(n or self.repeat)]
+
+    def __run_reads(self):
+        db = self.db
+        # Full table reads are expensive on large scales, run them once
+        for table in Tables.as_list():
+            table_name = Tables.get(table)
+            self.measure(f"get_table_data_all[{table_name}]", db.get_table_data_all, [(table_name,)])
+            self.measure(f"get_table_page[{table_name}]", db.get_table_page,
+                         [(table_name, id) for (id,) in self.__ids(table_name)])
+
+        self.measure("get_port_data", db.get_port_data, self.__ids(Tables.PORTS))
+        self.measure("get_warehouse_data", db.get_warehouse_data, self.__ids(Tables.WAREHOUSES))
+        self.measure("get_shipping_locations", db.get_shipping_locations, self.__ids(Tables.SHIPPINGS))
+
+        for table_name, names in [
+            (Tables.PORTS, ["get_port_relations", "get_port_info"]),
+            (Tables.WAREHOUSES, ["get_warehouse_relations", "get_warehouse_info"]),
+            (Tables.ITEMS, ["get_item_relations", "get_item_info"]),
+            (Tables.INVENTORY, ["get_inventory_relations", "get_inventory_info", "get_shipping_status"]),
+            (Tables.SHIPPINGS, ["get_shipping_info", "get_shipping_events"]),
+        ]:
+            for name in names:
+                self.measure(name, getattr(db, name), self.__ids(table_name))
+
+        self.measure("sites_in_bbox", db.sites_in_bbox,
+                     [(lat, lon, lat + 2, lon + 2) for lat, lon in self.__positions()])
+        self.measure("sites_within", db.sites_within,
+                     [(lat, lon, 100) for lat, lon in self.__positions()])
+        self.measure("nearest_sites", db.nearest_sites,
+                     [(lat, lon, 5) for lat, lon in self.__positions()])
+        self.measure("nearest_port", db.nearest_port, self.__positions())
+        self.measure("nearest_warehouses", db.nearest_warehouses, self.__ids(Tables.PORTS))
+
+        # A prefix of the id as typed into the search box, and a misspelled name
+        self.measure("search[prefix]", db.search,
+                     [(f"warehouse {str(id)[:2]}",) for id, in self.__ids(Tables.WAREHOUSES)])
+        self.measure("search[fuzzy]", db.search, [(f"warehuose {id}",) for id, in self.__ids(Tables.WAREHOUSES)])
+
+        # Whole fleet in one query, run once like the full table reads
+        self.measure("warehouse_utilization", warehouse_utilization, [(db,)])
+        self.measure("port_utilization", port_utilization, [(db,)])
+
+    def __run_writes(self):
+        db = self.db
+        n = self.repeat
+        lat_lon = self.__positions(n)
+
+        self.measure("insert_port_data", db.insert_port_data,
+                     [(f"Bench port {i}", lat + 1e-6 * i, lon) for i, (lat, lon) in enumerate(lat_lon)])
+        port_ids = self.__new_ids(Tables.PORTS, "port_id", n)
+
+        self.measure("insert_warehouse_data", db.insert_warehouse_data,
+                     [(f"Bench warehouse {i}", lat - 1e-6 * i, lon, 1000, port_ids[i])
+                      for i, (lat, lon) in enumerate(lat_lon)])
+        warehouse_ids = self.__new_ids(Tables.WAREHOUSES, "warehouse_id", n)
+
+        self.measure("insert_item_data", db.insert_item_data,
+                     [(f"Bench item {i}", "Bench", 10.0) for i in range(n)])
+        item_ids = self.__new_ids(Tables.ITEMS, "item_id", n)
+
+        self.measure("insert_inventory_data", db.insert_inventory_data,
+                     [(warehouse_ids[i], item_ids[i], 10) for i in range(n)])
+        inventory_ids = self.__new_ids(Tables.INVENTORY, "inventory_id", n)
+
+        self.measure("insert_shippings_data", db.insert_shippings_data,
+                     [(port_ids[i], port_ids[-i - 1], inventory_ids[i], False, False) for i in range(n)])
+        shipping_ids = self.__new_ids(Tables.SHIPPINGS, "shipping_id", n)
+
+        self.measure("update_quantities", db.update_quantities, [({id: 20 for id in inventory_ids},)])
+        self.measure("update_prices", db.update_prices, [({id: 20.0 for id in item_ids},)])
+
+        # The lifecycle of every benchmark shipping, one event at a time and as one scanner batch
+        self.measure("add_event", db.add_event, [(id, "departed") for id in shipping_ids])
+        self.measure("add_events", db.add_events, [([(id, status, None) for id in shipping_ids
+                                                     for status in EVENT_STATUSES[1:]],)])
+
+        # Remove the benchmark rows again, children first, half one by one and half in one batch
+        for table_name, ids in [(Tables.SHIPPINGS, shipping_ids), (Tables.INVENTORY, inventory_ids),
+                                (Tables.ITEMS, item_ids), (Tables.WAREHOUSES, warehouse_ids),
+                                (Tables.PORTS, port_ids)]:
+            half = len(ids) // 2
+            self.measure(f"delete_row[{table_name}]", db.delete_row, [(table_name, id) for id in ids[:half]])
+            self.measure(f"delete_rows[{table_name}]", db.delete_rows, [(table_name, ids[half:])])
+
+    def __new_ids(self, table_name: str, pk: str, n: int) -> list[int]:
+        rows = self.db.select(f"SELECT {pk} FROM {table_name} ORDER BY {pk} DESC LIMIT ?", (n,))
+        return [row[pk] for row in reversed(rows)]
+
+
+def run(scale: str, seed: int = 0, repeat: int = 200, path: str | Path | None = None,
+        cache: bool = False, report=print) -> dict:
+    """
+    Generate a database of the given scale and benchmark it
+    The query cache is off by default so the queries themselves are measured
+    """
+    if path is None:
+        path = Path(tempfile.mkdtemp(prefix="pwms-bench-")) / "bench.db"
+
+    db = DB(path, cache_size=256 if cache else 0)
+    db.init_tables()
+
+    start = time.perf_counter()
+    sizes = generate(db, SCALES[scale], seed, report)
+    generate_seconds = time.perf_counter() - start
+
+    results = Benchmark(db, sizes, seed, repeat).run()
+    db.close()
+
+    return {
+        "meta": {
+            "scale": scale,
+            "seed": seed,
+            "repeat": repeat,
+            "cache": cache,
+            "sizes": sizes,
+            "generate_seconds": generate_seconds,
+            "python": platform.python_version(),
+            "sqlite": sql.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> list[dict]:
+    """
+    Methods whose mean time grew by more than threshold compared to baseline
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if old is None or old["mean_ms"] <= 0:
+            continue
+        ratio = result["mean_ms"] / old["mean_ms"]
+        if ratio > threshold:
+            regressions.append({
+                "name": name,
+                "baseline_ms": old["mean_ms"],
+                "current_ms": result["mean_ms"],
+                "ratio": ratio,
+            })
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'method':<40} {'calls':>6} {'mean ms':>10} {'p95 ms':>10} {'max ms':>10}"]
+    for name, r in results["results"].items():
+        lines.append(f"{name:<40} {r['calls']:>6} {r['mean_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['max_ms']:>10.3f}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="pwms.bench", description="Benchmark the pwms DB layer")
+    add_arguments(parser)
+    return run_command(parser.parse_args(argv))
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--scale", choices=SCALES, default="1k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=200, help="calls per method")
+    # Not --db, which the CLI already uses for the database to work on
+    parser.add_argument("--bench-db", help="database file to generate into (default: a temporary file)")
+    parser.add_argument("--cache", action="store_true", help="benchmark with the query cache enabled")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+
+
+def run_command(args: argparse.Namespace) -> int:
+    results = run(args.scale, args.seed, args.repeat, args.bench_db, args.cache)
+    print(format_results(results))
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2))
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        regressions = compare(baseline, results, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION: {r['name']} {r['baseline_ms']:.3f} ms -> {r['current_ms']:.3f} ms ({r['ratio']:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
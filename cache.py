@@ -0,0 +1,104 @@
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+# Entities with a generation of their own, past that the epoch is bumped instead
+MAX_GENERATIONS = 65_536
+
+
+class QueryCache:
+    """
+    LRU cache for query results
+
+    Every entry belongs to an entity (table, id) so all results about one
+    entity can be invalidated together when it changes.
+
+    Each entity also has a generation, bumped by invalidate and clear. A
+    reader takes it before running its query and hands it to put, which
+    drops the value if the entity was invalidated in the meantime. Once
+    more than MAX_GENERATIONS entities were invalidated their counters are
+    dropped and the epoch is bumped, which only costs the puts of reads
+    running at that moment.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.entries: OrderedDict[tuple, object] = OrderedDict()
+        self.by_entity: dict[tuple[str, int], set[tuple]] = {}
+        self.generations: dict[tuple[str, int], int] = {}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, entity: tuple[str, int], name: str):
+        """
+        Returns the cached value or _MISSING
+        """
+        key = (*entity, name)
+        with self.lock:
+            value = self.entries.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return value
+
+    def generation(self, entity: tuple[str, int]) -> tuple[int, int]:
+        with self.lock:
+            return self.epoch, self.generations.get(entity, 0)
+
+    def put(self, entity: tuple[str, int], name: str, value, generation: tuple[int, int] | None = None):
+        key = (*entity, name)
+        with self.lock:
+            if generation is not None and generation != (self.epoch, self.generations.get(entity, 0)):
+                # Invalidated while the value was read, it may already be stale
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.by_entity.setdefault(entity, set()).add(key)
+
+            while len(self.entries) > self.size:
+                old_key, _ = self.entries.popitem(last=False)
+                self.__unlink(old_key)
+                self.evictions += 1
+
+    def invalidate(self, table: str, id: int | None):
+        if id is None:
+            return
+        with self.lock:
+            self.generations[(table, id)] = self.generations.get((table, id), 0) + 1
+            if len(self.generations) > MAX_GENERATIONS:
+                self.generations.clear()
+                self.epoch += 1
+            for key in self.by_entity.pop((table, id), ()):
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_entity.clear()
+            self.generations.clear()
+            self.epoch += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __unlink(self, key: tuple):
+        entity = key[:2]
+        keys = self.by_entity.get(entity)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_entity[entity]
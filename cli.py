@@ -0,0 +1,266 @@
+"""
+Headless command line interface, nothing here imports Tk or the map
+
+    python -m pwms cli import ./data
+    python -m pwms cli export Warehouses warehouses.parquet
+    python -m pwms cli export get_port_relations port_1.csv --id 1
+    python -m pwms cli query "SELECT * FROM Ports WHERE country = ?" India
+    python -m pwms cli info Warehouses 3
+    python -m pwms cli search "chennai port"
+    python -m pwms cli check
+    python -m pwms cli events scans.csv
+    python -m pwms cli routes --speed 16
+    python -m pwms cli bench --scale 100k
+    python -m pwms cli serve --port 8080
+"""
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+
+from .db import DB, DB_PATH, INDEXED_QUERIES, SEARCH_LIMIT, VIEWS, QueryPlanError, Tables
+
+FETCH_SIZE = 10_000
+
+def table_name(value: str) -> str:
+    """
+    Accepts a table name (Ports) or its Tables key (PORTS), in any case
+    """
+    try:
+        return Tables.lookup(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from None
+
+
+def open_db(args: argparse.Namespace) -> DB:
+    db = DB(args.db, cache_size=0)
+    db.init_tables()
+    return db
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    from .importer import CSVImporter
+
+    path = Path(args.path)
+    if args.table and not path.is_file():
+        print(f"--table needs a CSV file, {path} is not one", file=sys.stderr)
+        return 2
+    if not args.table and not path.is_dir():
+        print(f"{path} is not a directory, use --table to import a single file", file=sys.stderr)
+        return 2
+
+    db = open_db(args)
+    importer = CSVImporter(db, batch_size=args.batch_size, strict=args.strict)
+    if args.table:
+        importer.import_file(args.table, path)
+    else:
+        importer.import_dir(path)
+    db.close()
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    from .export import Exporter
+
+    db = open_db(args)
+    exporter = Exporter(db, fetch_size=args.fetch_size, report=lambda msg: print(msg, file=sys.stderr))
+    if args.source in INDEXED_QUERIES:
+        if args.id is None:
+            print(f"{args.source} needs --id", file=sys.stderr)
+            return 2
+        exporter.export_view(args.source, args.id, args.output, args.format)
+    else:
+        exporter.export_table(table_name(args.source), args.output, args.format)
+    db.close()
+    return 0
+
+
+def cmd_query(args: argparse.Namespace) -> int:
+    db = open_db(args)
+    # A read-only connection, scripted queries cannot change the data
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(args.sql, args.params)
+        columns = [col[0] for col in cursor.description or ()]
+
+        if args.json:
+            while batch := cursor.fetchmany(FETCH_SIZE):
+                sys.stdout.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in batch)
+        else:
+            writer = csv.writer(sys.stdout)
+            writer.writerow(columns)
+            while batch := cursor.fetchmany(FETCH_SIZE):
+                writer.writerows(batch)
+        cursor.close()
+    db.close()
+    return 0
+
+
+def cmd_info(args: argparse.Namespace) -> int:
+    db = open_db(args)
+    info, relations = VIEWS[args.table]
+    result = {"info": getattr(db, info)(args.id)}
+    if relations:
+        result["relations"] = getattr(db, relations)(args.id)
+    print(json.dumps(result, indent=2))
+    db.close()
+    return 0
+
+
+def cmd_search(args: argparse.Namespace) -> int:
+    db = open_db(args)
+    rows = db.search(args.text, tuple(args.table) or None, args.limit, not args.exact)
+    sys.stdout.writelines(json.dumps(row) + "\n" for row in rows)
+    db.close()
+    return 0
+
+
+def cmd_check(args: argparse.Namespace) -> int:
+    db = open_db(args)
+    print(f"schema version {db.schema_version()}")
+
+    status = 0
+    try:
+        db.check_query_plans()
+        print("query plans: ok")
+    except QueryPlanError as e:
+        print(f"query plans: {e}")
+        status = 1
+
+    mismatches = db.check_summaries()
+    if mismatches and args.rebuild:
+        db.rebuild_summaries()
+        print(f"summaries: rebuilt, {len(mismatches)} rows were off")
+    elif mismatches:
+        for m in mismatches[:20]:
+            print(f"summaries: {m['table']} {m['id']} expected {m['expected']} got {m['actual']}")
+        print(f"summaries: {len(mismatches)} rows differ, run with --rebuild to repair")
+        status = 1
+    else:
+        print("summaries: ok")
+    db.close()
+    return status
+
+
+def cmd_events(args: argparse.Namespace) -> int:
+    from itertools import islice
+
+    db = open_db(args)
+    with open(args.file, newline="", encoding="utf-8") as f:
+        rows = ((int(r["shipping_id"]), r["status"], float(r["ts"]) if r.get("ts") else None)
+                for r in csv.DictReader(f))
+        total, seconds = 0, 0.0
+        while batch := list(islice(rows, args.batch_size)):
+            result = db.add_events(batch)
+            total += result["rows"]
+            seconds += result["seconds"]
+    print(f"IMPORTED: {total} events from {args.file} ({seconds:.2f}s)", file=sys.stderr)
+    db.close()
+    return 0
+
+
+def cmd_routes(args: argparse.Namespace) -> int:
+    try:
+        from .routing import RouteEngine
+    except ImportError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    db = open_db(args)
+    columns, rows = RouteEngine(db, speed_knots=args.speed).shipping_routes(args.ids or None)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(columns)
+    writer.writerows(rows)
+    db.close()
+    return 0
+
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    from . import bench
+
+    return bench.run_command(args)
+
+
+def cmd_serve(args: argparse.Namespace) -> int:
+    from .server import serve
+
+    serve(args.db, args.host, args.port, args.readers)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="pwms cli", description="Headless access to the pwms database")
+    parser.add_argument("--db", default=str(DB_PATH), help=f"database file (default: {DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="import CSV files")
+    p.add_argument("path", help="directory with the CSV files, or one file with --table")
+    p.add_argument("--table", type=table_name, help="import a single CSV file into this table")
+    p.add_argument("--batch-size", type=int, default=50_000)
+    p.add_argument("--strict", action="store_true", help="fail on rows with unknown foreign keys")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser("export", help="export a table or an info/relations view")
+    p.add_argument("source", help=f"a table or one of {', '.join(INDEXED_QUERIES)}")
+    p.add_argument("output", help="output file, the format follows the suffix (.csv, .jsonl, .parquet)")
+    p.add_argument("--id", type=int, help="id for an info/relations view")
+    p.add_argument("--format", choices=["csv", "jsonl", "parquet"])
+    p.add_argument("--fetch-size", type=int, default=FETCH_SIZE)
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser("query", help="run a read-only SQL query and print the rows as CSV")
+    p.add_argument("sql")
+    p.add_argument("params", nargs="*", help="values for the ? placeholders")
+    p.add_argument("--json", action="store_true", help="print JSON Lines instead of CSV")
+    p.set_defaults(func=cmd_query)
+
+    p = commands.add_parser("info", help="print the info and relations of one row as JSON")
+    p.add_argument("table", type=table_name)
+    p.add_argument("id", type=int)
+    p.set_defaults(func=cmd_info)
+
+    p = commands.add_parser("search", help="search ports, warehouses and items by name, prints JSON Lines")
+    p.add_argument("text")
+    p.add_argument("--table", type=table_name, action="append", default=[], help="only search this table, repeatable")
+    p.add_argument("--limit", type=int, default=SEARCH_LIMIT)
+    p.add_argument("--exact", action="store_true", help="only prefix matches, no spelling correction")
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser("check", help="check query plans and summary tables")
+    p.add_argument("--rebuild", action="store_true", help="rebuild the summary tables if they are off")
+    p.set_defaults(func=cmd_check)
+
+    p = commands.add_parser("events", help="append shipment events from a CSV file (shipping_id,status,ts)")
+    p.add_argument("file")
+    p.add_argument("--batch-size", type=int, default=10_000, help="events per transaction")
+    p.set_defaults(func=cmd_events)
+
+    p = commands.add_parser("routes", help="print the sea distance and sailing time of shippings as CSV, needs numpy")
+    p.add_argument("ids", nargs="*", type=int, help="shipping ids, all shippings by default")
+    p.add_argument("--speed", type=float, default=14.0, help="speed in knots (default: 14)")
+    p.set_defaults(func=cmd_routes)
+
+    p = commands.add_parser("bench", help="run the DB benchmarks")
+    # bench imports nothing heavy, its options are defined there
+    from .bench import add_arguments
+    add_arguments(p)
+    p.set_defaults(func=cmd_bench)
+
+    p = commands.add_parser("serve", help="serve the database as an HTTP/JSON API")
+    p.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 for every interface")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--readers", type=int, default=4, help="read-only connections serving GET requests")
+    p.set_defaults(func=cmd_serve)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+import queue
+import sqlite3 as sql
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+READERS = 4
+# Prepared statements kept per connection, enough for every query of DB
+STATEMENT_CACHE = 256
+
+# Applied to every connection, the journal mode is set once by the writer
+PRAGMAS = {
+    "foreign_keys": "ON",
+    "synchronous": "NORMAL",    # safe with WAL, skips the fsync on every commit
+    "cache_size": -64_000,      # 64 MB page cache per connection
+    "mmap_size": 268_435_456,   # 256 MB memory mapped I/O
+    "temp_store": "MEMORY",
+    "busy_timeout": 5_000,
+}
+
+
+class ConnectionManager:
+    """
+    One writer connection and a pool of read-only connections to the same database
+
+    The database runs in WAL mode so readers never block the writer and the
+    writer never blocks readers. Readers are opened lazily up to the pool
+    size and handed out with reader(). Writes are not locked here: DB only
+    writes from the thread that created it (the Tk thread of the GUI, the
+    single writer thread of the server), other threads read through the
+    pool. writer_factory is the sqlite3.Connection subclass of the writer.
+    """
+
+    def __init__(self, path: str | Path, readers: int = READERS, row_factory=None, configure=None,
+                 writer_factory: type[sql.Connection] = sql.Connection):
+        self.path = Path(path)
+        self.row_factory = row_factory
+        self.configure = configure
+        self.writer_factory = writer_factory
+
+        self.writer = self.__connect(readonly=False)
+        self.writer.execute("PRAGMA journal_mode = WAL")
+
+        self.size = readers
+        self.pool: queue.Queue[sql.Connection] = queue.Queue()
+        self.opened: list[sql.Connection] = []
+        self.lock = threading.Lock()
+
+    def __connect(self, readonly: bool) -> sql.Connection:
+        if readonly:
+            conn = sql.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE)
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sql.connect(self.path, check_same_thread=False, cached_statements=STATEMENT_CACHE,
+                               factory=self.writer_factory)
+
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.configure is not None:
+            self.configure(conn)
+        return conn
+
+    @contextmanager
+    def reader(self, timeout: float | None = None):
+        """
+        Check out a read-only connection, blocks while all of them are in use
+        """
+        try:
+            conn = self.pool.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                conn = None
+                if len(self.opened) < self.size:
+                    conn = self.__connect(readonly=True)
+                    self.opened.append(conn)
+            if conn is None:
+                conn = self.pool.get(timeout=timeout)
+
+        try:
+            yield conn
+        finally:
+            self.pool.put(conn)
+
+    def pragmas(self, conn: sql.Connection | None = None) -> dict:
+        cursor = (conn or self.writer).cursor()
+        cursor.row_factory = None
+        names = ["journal_mode", *PRAGMAS]
+        return {name: cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in names}
+
+    def close(self):
+        with self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened.clear()
+        self.writer.close()
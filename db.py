@@ -1,8 +1,26 @@
+import functools
+import json
+import math
+import re
+import sys
+import unicodedata
+from difflib import SequenceMatcher
 import sqlite3 as sql
+import threading
+import time
+from contextlib import contextmanager
 
 from pathlib import Path
 
+from .cache import _MISSING, QueryCache
+from .connection import READERS, ConnectionManager
+from .geo import EARTH_RADIUS_KM, bbox_around, haversine_km
+from .profiling import SLOW_QUERY_MS, ProfiledConnection, Profiler
+from .schema import SchemaCatalog, TableSchema
+
 DB_PATH = Path(__file__).parent / "database" / "pwms.db"
+PAGE_SIZE = 200
+CACHE_SIZE = 256
 
 
 class Tables:
@@ -28,6 +46,468 @@ class Tables:
                 return v
         return ""
 
+    @staticmethod
+    def lookup(value: str) -> str:
+        """
+        Table from its name (Ports) or key (PORTS) in any case
+        """
+        for key in Tables.as_list():
+            if value.upper() == key or value.lower() == Tables.get(key).lower():
+                return Tables.get(key)
+        raise ValueError(
+            f"unknown table {value!r}, expected one of: {', '.join(Tables.get(k) for k in Tables.as_list())}")
+
+
+# table -> primary key
+PRIMARY_KEYS = {
+    Tables.PORTS: "port_id",
+    Tables.WAREHOUSES: "warehouse_id",
+    Tables.ITEMS: "item_id",
+    Tables.INVENTORY: "inventory_id",
+    Tables.SHIPPINGS: "shipping_id",
+}
+
+# table -> (R*Tree index table, primary key) for the spatial queries
+SPATIAL_INDEXES = {
+    Tables.PORTS: ("PortsIndex", "port_id"),
+    Tables.WAREHOUSES: ("WarehousesIndex", "warehouse_id"),
+}
+
+
+def spatial_index_statements(table: str) -> list[str]:
+    """
+    R*Tree over the latitude/longitude of table kept in sync by triggers
+    """
+    index, pk = SPATIAL_INDEXES[table]
+    insert = f"""INSERT INTO {index} ({pk}, min_lat, max_lat, min_lon, max_lon)
+                 SELECT NEW.{pk}, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                 WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;"""
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING rtree({pk}, min_lat, max_lat, min_lon, max_lon)",
+        f"""INSERT INTO {index} ({pk}, min_lat, max_lat, min_lon, max_lon)
+            SELECT {pk}, latitude, latitude, longitude, longitude FROM {table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN
+                {insert}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM {index} WHERE {pk} = OLD.{pk};
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {pk}, latitude, longitude ON {table} BEGIN
+                DELETE FROM {index} WHERE {pk} = OLD.{pk};
+                {insert}
+            END""",
+    ]
+
+
+# Aggregates of get_warehouse_info / get_port_info kept up to date by triggers
+WAREHOUSE_SUMMARY = "WarehouseSummary"
+PORT_SUMMARY = "PortSummary"
+
+# Fresh aggregates, used to fill the summary tables and to check them
+WAREHOUSE_AGGREGATES = f"""
+    SELECT
+        w.warehouse_id AS warehouse_id,
+        IFNULL(SUM(i.quantity), 0) AS total_items,
+        IFNULL(SUM(i.quantity * it.unit_price), 0.0) AS total_value
+    FROM {Tables.WAREHOUSES} w
+    LEFT JOIN {Tables.INVENTORY} i ON w.warehouse_id = i.warehouse_id
+    LEFT JOIN {Tables.ITEMS} it ON i.item_id = it.item_id
+    GROUP BY w.warehouse_id
+"""
+PORT_AGGREGATES = f"""
+    SELECT
+        p.port_id AS port_id,
+        COUNT(w.warehouse_id) AS total_warehouses,
+        IFNULL(SUM(w.capacity), 0) AS total_warehouse_capacity
+    FROM {Tables.PORTS} p
+    LEFT JOIN {Tables.WAREHOUSES} w ON p.port_id = w.port_id
+    GROUP BY p.port_id
+"""
+
+
+def summary_statements() -> list[str]:
+    """
+    Summary tables of warehouse stock and port capacity, filled from the
+    current data and maintained incrementally by triggers
+    """
+    def stock(row: str, sign: str) -> str:
+        # Add (or remove) one inventory row to the summary of its warehouse
+        return f"""UPDATE {WAREHOUSE_SUMMARY} SET
+                       total_items = total_items {sign} IFNULL({row}.quantity, 0),
+                       total_value = total_value {sign} IFNULL({row}.quantity * (
+                           SELECT unit_price FROM {Tables.ITEMS} WHERE item_id = {row}.item_id), 0)
+                   WHERE warehouse_id = {row}.warehouse_id;"""
+
+    def warehouse(row: str, sign: str) -> str:
+        # Add (or remove) one warehouse to the summary of its port
+        return f"""UPDATE {PORT_SUMMARY} SET
+                       total_warehouses = total_warehouses {sign} 1,
+                       total_warehouse_capacity = total_warehouse_capacity {sign} IFNULL({row}.capacity, 0)
+                   WHERE port_id = {row}.port_id;"""
+
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {WAREHOUSE_SUMMARY} (
+                warehouse_id integer PRIMARY KEY,
+                total_items integer NOT NULL DEFAULT 0,
+                total_value double NOT NULL DEFAULT 0
+            )""",
+        f"""CREATE TABLE IF NOT EXISTS {PORT_SUMMARY} (
+                port_id integer PRIMARY KEY,
+                total_warehouses integer NOT NULL DEFAULT 0,
+                total_warehouse_capacity integer NOT NULL DEFAULT 0
+            )""",
+        f"INSERT OR REPLACE INTO {WAREHOUSE_SUMMARY} {WAREHOUSE_AGGREGATES}",
+        f"INSERT OR REPLACE INTO {PORT_SUMMARY} {PORT_AGGREGATES}",
+
+        f"""CREATE TRIGGER IF NOT EXISTS {PORT_SUMMARY}_port_insert AFTER INSERT ON {Tables.PORTS} BEGIN
+                INSERT OR IGNORE INTO {PORT_SUMMARY} (port_id) VALUES (NEW.port_id);
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {PORT_SUMMARY}_port_delete AFTER DELETE ON {Tables.PORTS} BEGIN
+                DELETE FROM {PORT_SUMMARY} WHERE port_id = OLD.port_id;
+            END""",
+
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_warehouse_insert AFTER INSERT ON {Tables.WAREHOUSES} BEGIN
+                INSERT OR IGNORE INTO {WAREHOUSE_SUMMARY} (warehouse_id) VALUES (NEW.warehouse_id);
+                {warehouse("NEW", "+")}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_warehouse_delete AFTER DELETE ON {Tables.WAREHOUSES} BEGIN
+                DELETE FROM {WAREHOUSE_SUMMARY} WHERE warehouse_id = OLD.warehouse_id;
+                {warehouse("OLD", "-")}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_warehouse_update AFTER UPDATE OF port_id, capacity ON {Tables.WAREHOUSES} BEGIN
+                {warehouse("OLD", "-")}
+                {warehouse("NEW", "+")}
+            END""",
+
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_inventory_insert AFTER INSERT ON {Tables.INVENTORY} BEGIN
+                {stock("NEW", "+")}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_inventory_delete AFTER DELETE ON {Tables.INVENTORY} BEGIN
+                {stock("OLD", "-")}
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_inventory_update AFTER UPDATE OF warehouse_id, item_id, quantity ON {Tables.INVENTORY} BEGIN
+                {stock("OLD", "-")}
+                {stock("NEW", "+")}
+            END""",
+
+        # A price change moves the value of every warehouse stocking the item
+        f"""CREATE TRIGGER IF NOT EXISTS {WAREHOUSE_SUMMARY}_price_update AFTER UPDATE OF unit_price ON {Tables.ITEMS} BEGIN
+                UPDATE {WAREHOUSE_SUMMARY} SET
+                    total_value = total_value + (IFNULL(NEW.unit_price, 0) - IFNULL(OLD.unit_price, 0)) * (
+                        SELECT IFNULL(SUM(quantity), 0) FROM {Tables.INVENTORY}
+                        WHERE item_id = NEW.item_id AND warehouse_id = {WAREHOUSE_SUMMARY}.warehouse_id)
+                WHERE warehouse_id IN (SELECT warehouse_id FROM {Tables.INVENTORY} WHERE item_id = NEW.item_id);
+            END""",
+    ]
+
+
+# Append-only lifecycle history of shippings and the latest status of each one
+SHIPMENT_EVENTS = "ShipmentEvents"
+SHIPMENT_STATUS = "ShipmentStatus"
+EVENT_STATUSES = ("departed", "arrived", "unloaded", "loaded_to_truck", "delivered")
+
+# Latest event of every shipping, ties on ts go to the later event
+STATUS_PROJECTION = f"""
+    SELECT shipping_id, status, ts, events FROM (
+        SELECT
+            shipping_id, status, ts,
+            COUNT(*) OVER (PARTITION BY shipping_id) AS events,
+            ROW_NUMBER() OVER (PARTITION BY shipping_id ORDER BY ts DESC, event_id DESC) AS latest
+        FROM {SHIPMENT_EVENTS})
+    WHERE latest = 1
+"""
+
+
+# The arrived_at_port/loaded_to_truck flags were written as 1/0 as well as 'true'/'false'
+TRUE_FLAGS = (1, "1", "true", "True")
+
+
+def flag_set(column: str) -> str:
+    """
+    SQL condition for a set arrived_at_port/loaded_to_truck flag, in either spelling
+    """
+    return f"IFNULL({column}, 0) IN ({', '.join(map(repr, TRUE_FLAGS))})"
+
+
+def event_statements() -> list[str]:
+    """
+    Event log, its indexes and the status projection kept up to date by triggers
+    The old arrived_at_port/loaded_to_truck flags become the first events and
+    follow the log from then on
+    """
+    statuses = ", ".join(f"'{status}'" for status in EVENT_STATUSES)
+
+    return [
+        f"""CREATE TABLE IF NOT EXISTS {SHIPMENT_EVENTS} (
+                event_id integer PRIMARY KEY,
+                shipping_id integer NOT NULL REFERENCES {Tables.SHIPPINGS}(shipping_id),
+                status text NOT NULL CHECK (status IN ({statuses})),
+                ts double NOT NULL
+            )""",
+        f"""CREATE TABLE IF NOT EXISTS {SHIPMENT_STATUS} (
+                shipping_id integer PRIMARY KEY,
+                status text NOT NULL,
+                ts double NOT NULL,
+                events integer NOT NULL DEFAULT 0
+            )""",
+        f"CREATE INDEX IF NOT EXISTS idx_shipment_events_shipping ON {SHIPMENT_EVENTS} (shipping_id, ts)",
+        f"CREATE INDEX IF NOT EXISTS idx_shipment_events_status ON {SHIPMENT_EVENTS} (status, ts)",
+
+        f"""CREATE TRIGGER IF NOT EXISTS {SHIPMENT_EVENTS}_insert AFTER INSERT ON {SHIPMENT_EVENTS} BEGIN
+                INSERT INTO {SHIPMENT_STATUS} (shipping_id, status, ts, events)
+                VALUES (NEW.shipping_id, NEW.status, NEW.ts, 1)
+                ON CONFLICT (shipping_id) DO UPDATE SET
+                    status = CASE WHEN excluded.ts >= ts THEN excluded.status ELSE status END,
+                    ts = MAX(ts, excluded.ts),
+                    events = events + 1;
+                UPDATE {Tables.SHIPPINGS} SET
+                    arrived_at_port = 1,
+                    loaded_to_truck = CASE WHEN NEW.status IN ('loaded_to_truck', 'delivered') THEN 1 ELSE loaded_to_truck END
+                WHERE shipping_id = NEW.shipping_id AND NEW.status != 'departed';
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SHIPMENT_EVENTS}_no_update BEFORE UPDATE ON {SHIPMENT_EVENTS} BEGIN
+                SELECT RAISE(ABORT, '{SHIPMENT_EVENTS} is append-only');
+            END""",
+        # Events only go away together with their shipping
+        f"""CREATE TRIGGER IF NOT EXISTS {SHIPMENT_EVENTS}_no_delete BEFORE DELETE ON {SHIPMENT_EVENTS}
+            WHEN EXISTS (SELECT 1 FROM {Tables.SHIPPINGS} WHERE shipping_id = OLD.shipping_id) BEGIN
+                SELECT RAISE(ABORT, '{SHIPMENT_EVENTS} is append-only');
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {SHIPMENT_EVENTS}_shipping_delete AFTER DELETE ON {Tables.SHIPPINGS} BEGIN
+                DELETE FROM {SHIPMENT_EVENTS} WHERE shipping_id = OLD.shipping_id;
+                DELETE FROM {SHIPMENT_STATUS} WHERE shipping_id = OLD.shipping_id;
+            END""",
+
+        f"""INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts)
+            SELECT shipping_id, 'arrived', CAST(strftime('%s', 'now') AS REAL) FROM {Tables.SHIPPINGS}
+            WHERE {flag_set("arrived_at_port")} OR {flag_set("loaded_to_truck")}
+            ORDER BY shipping_id""",
+        f"""INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts)
+            SELECT shipping_id, 'loaded_to_truck', CAST(strftime('%s', 'now') AS REAL) FROM {Tables.SHIPPINGS}
+            WHERE {flag_set("loaded_to_truck")}
+            ORDER BY shipping_id""",
+    ]
+
+
+def flag_event_statements() -> list[str]:
+    """
+    Shippings inserted with their flags set get the matching events in the
+    same transaction, so the status projection agrees with the row. Shippings
+    inserted that way since the event log was added are backfilled.
+    """
+    now = "CAST(strftime('%s', 'now') AS REAL)"
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {Tables.SHIPPINGS}_flag_events AFTER INSERT ON {Tables.SHIPPINGS}
+            WHEN {flag_set("NEW.arrived_at_port")} OR {flag_set("NEW.loaded_to_truck")} BEGIN
+                INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts) VALUES (NEW.shipping_id, 'arrived', {now});
+                INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts)
+                SELECT NEW.shipping_id, 'loaded_to_truck', {now} WHERE {flag_set("NEW.loaded_to_truck")};
+            END""",
+
+        f"""INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts)
+            SELECT shipping_id, 'arrived', {now} FROM {Tables.SHIPPINGS} s
+            WHERE ({flag_set("arrived_at_port")} OR {flag_set("loaded_to_truck")})
+            AND NOT EXISTS (SELECT 1 FROM {SHIPMENT_EVENTS} e WHERE e.shipping_id = s.shipping_id)
+            ORDER BY shipping_id""",
+        f"""INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts)
+            SELECT shipping_id, 'loaded_to_truck', {now} FROM {Tables.SHIPPINGS} s
+            WHERE {flag_set("loaded_to_truck")}
+            AND NOT EXISTS (SELECT 1 FROM {SHIPMENT_EVENTS} e
+                            WHERE e.shipping_id = s.shipping_id AND e.status != 'arrived')
+            ORDER BY shipping_id""",
+    ]
+
+
+# Full-text search over names. The rowid of the index encodes the row as
+# id * SEARCH_KINDS + kind, so a row is found again without a lookup table.
+SEARCH_INDEX = "SearchIndex"
+# Every word in the index, for correcting misspelled words
+SEARCH_TERMS = "SearchTerms"
+SEARCH_KINDS = 4
+SEARCH_LIMIT = 20
+# Rows fetched per wanted result, scored and sorted in Python
+SEARCH_CANDIDATES = 10
+# Indexed words a misspelled word may be corrected to, they have to start with the same letters
+SEARCH_FUZZY_TERMS = 5
+SEARCH_FUZZY_PREFIX = 2
+# Corrections and fuzzy rows scoring lower than this are dropped
+SEARCH_MIN_SCORE = 0.75
+# table -> (kind, name column, detail column)
+SEARCHABLE = {
+    Tables.PORTS: (1, "name", "country"),
+    Tables.WAREHOUSES: (2, "name", None),
+    Tables.ITEMS: (3, "name", "category"),
+}
+
+
+def search_statements() -> list[str]:
+    """
+    Word/prefix index over the searchable columns, filled from the current
+    data and kept in sync by triggers, and its vocabulary
+    """
+    statements = [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX} USING fts5(
+                name, detail, tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')""",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TERMS} USING fts5vocab({SEARCH_INDEX}, row)",
+    ]
+    for table, (kind, name, detail) in SEARCHABLE.items():
+        pk = PRIMARY_KEYS[table]
+        columns = f"{name}, {detail}" if detail else name
+
+        def values(row: str = "") -> str:
+            return f"{row}{pk} * {SEARCH_KINDS} + {kind}, {row}{name}, " + (f"{row}{detail}" if detail else "NULL")
+
+        insert = f"INSERT INTO {SEARCH_INDEX} (rowid, name, detail) VALUES ({values('NEW.')});"
+        delete = f"DELETE FROM {SEARCH_INDEX} WHERE rowid = OLD.{pk} * {SEARCH_KINDS} + {kind};"
+        statements += [
+            f"INSERT INTO {SEARCH_INDEX} (rowid, name, detail) SELECT {values()} FROM {table}",
+            f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_{table}_insert AFTER INSERT ON {table} BEGIN
+                    {insert}
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_{table}_delete AFTER DELETE ON {table} BEGIN
+                    {delete}
+                END""",
+            f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX}_{table}_update AFTER UPDATE OF {columns} ON {table} BEGIN
+                    {delete}
+                    {insert}
+                END""",
+        ]
+    return statements
+
+
+# Schema migrations, applied in order and tracked through PRAGMA user_version.
+# The tables created by DB.init_tables are never altered here.
+MIGRATIONS = [
+    # 1: secondary (and covering) indexes on foreign-key and lookup columns
+    [
+        f"CREATE INDEX IF NOT EXISTS idx_warehouses_port ON {Tables.WAREHOUSES} (port_id, capacity, name)",
+        f"CREATE INDEX IF NOT EXISTS idx_inventory_warehouse ON {Tables.INVENTORY} (warehouse_id, item_id, quantity)",
+        f"CREATE INDEX IF NOT EXISTS idx_inventory_item ON {Tables.INVENTORY} (item_id, warehouse_id, quantity)",
+        f"CREATE INDEX IF NOT EXISTS idx_shippings_inventory ON {Tables.SHIPPINGS} (inventory_id)",
+        f"CREATE INDEX IF NOT EXISTS idx_shippings_from_port ON {Tables.SHIPPINGS} (from_port)",
+        f"CREATE INDEX IF NOT EXISTS idx_shippings_into_port ON {Tables.SHIPPINGS} (into_port)",
+    ],
+    # 2: spatial indexes on the positions of ports and warehouses
+    spatial_index_statements(Tables.PORTS) + spatial_index_statements(Tables.WAREHOUSES),
+    # 3: materialized warehouse and port aggregates
+    summary_statements(),
+    # 4: shipping status per inventory row answered from the index alone
+    [
+        f"""CREATE INDEX IF NOT EXISTS idx_shippings_status
+            ON {Tables.SHIPPINGS} (inventory_id, arrived_at_port, loaded_to_truck)""",
+        "DROP INDEX IF EXISTS idx_shippings_inventory",
+    ],
+    # 5: shipment event log with the current status of every shipping
+    event_statements(),
+    # 6: full-text search over ports, warehouses and items
+    search_statements(),
+    # 7: events from the flags of newly inserted shippings
+    flag_event_statements(),
+]
+
+def table_statements(table: str) -> dict[str, str]:
+    """
+    Point lookup, delete and keyset pages of table by its primary key
+    """
+    pk = PRIMARY_KEYS[table]
+    return {
+        f"{table}.row": f"SELECT * FROM {table} WHERE {pk} = ?",
+        f"{table}.rows": f"SELECT * FROM {table} WHERE {pk} IN (SELECT value FROM json_each(?))",
+        f"{table}.delete": f"DELETE FROM {table} WHERE {pk} = ?",
+        f"{table}.first_page": f"SELECT * FROM {table} ORDER BY {pk} LIMIT ?",
+        f"{table}.page_after": f"SELECT * FROM {table} WHERE {pk} > ? ORDER BY {pk} LIMIT ?",
+        f"{table}.page_before": f"""SELECT * FROM (
+                                        SELECT * FROM {table} WHERE {pk} < ? ORDER BY {pk} DESC LIMIT ?)
+                                    ORDER BY {pk}""",
+    }
+
+
+# Named, parameterized statements. The SQL text of a name never changes so
+# every connection parses it once and reuses it from its statement cache.
+STATEMENTS = {
+    **{name: query for table in PRIMARY_KEYS for name, query in table_statements(table).items()},
+    "shipping_locations": f"""
+        SELECT p1.latitude AS "l1", p1.longitude AS "l2", p2.latitude AS "l3", p2.longitude AS "l4"
+        FROM {Tables.SHIPPINGS} s
+        JOIN {Tables.PORTS} p1 ON s.from_port = p1.port_id
+        JOIN {Tables.PORTS} p2 ON s.into_port = p2.port_id
+        WHERE s.shipping_id = ?""",
+    "warehouse_port": f"SELECT port_id FROM {Tables.WAREHOUSES} WHERE warehouse_id = ?",
+    "inventory_warehouse": f"SELECT warehouse_id FROM {Tables.INVENTORY} WHERE inventory_id = ?",
+    "inventory_shippings": f"SELECT shipping_id FROM {Tables.SHIPPINGS} WHERE inventory_id = ?",
+    "warehouse_shippings.delete": f"""
+        DELETE FROM {Tables.SHIPPINGS}
+        WHERE inventory_id IN (SELECT inventory_id FROM {Tables.INVENTORY} WHERE warehouse_id = ?)""",
+    "warehouse_inventory.delete": f"DELETE FROM {Tables.INVENTORY} WHERE warehouse_id = ?",
+    "quantity.update": f"UPDATE {Tables.INVENTORY} SET quantity = ? WHERE inventory_id = ?",
+    "unit_price.update": f"UPDATE {Tables.ITEMS} SET unit_price = ? WHERE item_id = ?",
+    "event.insert": f"INSERT INTO {SHIPMENT_EVENTS} (shipping_id, status, ts) VALUES (?, ?, ?)",
+    "shipping_events": f"""
+        SELECT event_id, status, ts FROM {SHIPMENT_EVENTS}
+        WHERE shipping_id = ? ORDER BY ts, event_id""",
+    "events_by_status": f"""
+        SELECT event_id, shipping_id, status, ts FROM {SHIPMENT_EVENTS}
+        WHERE status = ? AND ts >= ? ORDER BY ts, event_id LIMIT ?""",
+    # No ORDER BY rank, ranking every match is slow for short prefixes. LIMIT stops at the
+    # first matches in rowid order, search() scores those.
+    "search": f"""
+        SELECT rowid, name, detail FROM {SEARCH_INDEX}
+        WHERE {SEARCH_INDEX} MATCH ? AND rowid % {SEARCH_KINDS} IN (SELECT value FROM json_each(?))
+        LIMIT ?""",
+    "search.terms": f"""
+        SELECT term FROM {SEARCH_TERMS}
+        WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?""",
+}
+
+
+def search_words(text: str) -> list[str]:
+    """
+    Words of text the way the index tokenizes them, lower case without diacritics
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c)))
+
+
+@functools.lru_cache(maxsize=4096)
+def word_similarity(word: str, target: str) -> float:
+    """
+    SequenceMatcher ratio of two words, computed directly when word prefixes target
+    Candidate rows share most of their words, so the ratios are cached
+    """
+    if target.startswith(word):
+        return 2 * len(word) / (len(word) + len(target))
+    return SequenceMatcher(None, word, target).ratio()
+
+
+def similarity(words: list[str], text: str) -> float:
+    """
+    How well words match text, 1.0 when every word is found in it
+    Each word is scored against its closest word in text, so typos still score high
+    """
+    targets = search_words(text)
+    if not words or not targets:
+        return 0.0
+    return sum(max(word_similarity(word, target) for target in targets) for word in words) / len(words)
+
+# DB methods whose queries must be answered through indexes
+INDEXED_QUERIES = [
+    "get_port_relations", "get_port_info",
+    "get_warehouse_relations", "get_warehouse_info",
+    "get_item_relations", "get_item_info",
+    "get_inventory_relations", "get_inventory_info",
+    "get_shipping_info", "get_shipping_status", "get_shipping_events",
+]
+
+# table -> (info method, relations method) of the views shown for one row
+VIEWS = {
+    Tables.PORTS: ("get_port_info", "get_port_relations"),
+    Tables.WAREHOUSES: ("get_warehouse_info", "get_warehouse_relations"),
+    Tables.ITEMS: ("get_item_info", "get_item_relations"),
+    Tables.INVENTORY: ("get_inventory_info", "get_inventory_relations"),
+    Tables.SHIPPINGS: ("get_shipping_info", "get_shipping_events"),
+}
+
 
 def dict_factory(cursor, row):
     d = {}
@@ -35,16 +515,70 @@ def dict_factory(cursor, row):
         d[col[0]] = row[idx]
     return d
 
-class DB:
+
+def cached(table_name: str):
+    """
+    Cache the result of an info/relations method of DB keyed by (table_name, id)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, id: int):
+            if self.cache is None:
+                return func(self, id)
+
+            value = self.cache.get((table_name, id), func.__name__)
+            if value is _MISSING:
+                generation = self.cache.generation((table_name, id))
+                value = func(self, id)
+                self.cache.put((table_name, id), func.__name__, value, generation)
+            return value
+        return wrapper
+    return decorator
+
+
+class QueryPlanError(Exception):
+    """
+    An info/relations query scans a table or a whole index instead of searching it
+    """
+
+
+class QueryCapture:
+    """
+    Stands in for DB to collect the queries of a method without running them
+    """
+    statements = STATEMENTS
 
     def __init__(self):
-        if not DB_PATH.parent.is_dir():
-            DB_PATH.parent.mkdir(parents=True)
-        self.db = sql.connect(DB_PATH)
-        self.db.row_factory = dict_factory
-        self.db.execute("PRAGMA foreign_keys = ON;")
+        self.queries: list[tuple[str, tuple]] = []
+
+    def select(self, query: str, params: tuple = None, empty_row: bool = True, name: str | None = None) -> list[dict]:
+        self.queries.append((query, params or ()))
+        return []
+
+
+class DB:
+    statements = STATEMENTS
+
+    def __init__(self, path: str | Path | None = None, cache_size: int = CACHE_SIZE, readers: int = READERS,
+                 slow_ms: float | None = SLOW_QUERY_MS):
+        """
+        Queries slower than slow_ms are logged with their plan, None turns that off
+        """
+        path = Path(path or DB_PATH)
+        if not path.parent.is_dir():
+            path.parent.mkdir(parents=True)
+        self.path = path
+        self.profiler = Profiler(slow_ms, self.__explain_plan)
+
+        # Reads from other threads than this one use the read-only pool
+        self.owner = threading.get_ident()
+        self.connections = ConnectionManager(path, readers, dict_factory, self.__configure, ProfiledConnection)
+        self.db = self.connections.writer
+        self.db.profiler = self.profiler
 
         self.cursor = self.db.cursor()
+        self.cache = QueryCache(cache_size) if cache_size else None
+        self.schema = SchemaCatalog(lambda query: self.select(query, empty_row=False, name="schema"))
 
     def init_tables(self):
         self.cursor.execute(f'''
@@ -108,43 +642,267 @@ class DB:
             );
         ''')
         self.db.commit()
+        self.migrate()
+
+    def __configure(self, conn: sql.Connection):
+        conn.create_function("haversine_km", 4, haversine_km, deterministic=True)
+
+    @contextmanager
+    def reader(self):
+        """
+        Read-only connection from the pool for background work
+        """
+        with self.connections.reader() as conn:
+            yield conn
+
+    def close(self):
+        self.connections.close()
+
+    def schema_version(self) -> int:
+        return self.db.execute("PRAGMA user_version").fetchone()["user_version"]
+
+    def migrate(self):
+        """
+        Bring an existing database up to date by applying every migration
+        newer than its user_version, each one in its own transaction
+        """
+        current = self.schema_version()
+        for version, statements in enumerate(MIGRATIONS[current:], start=current + 1):
+            self.cursor.execute("BEGIN")
+            try:
+                for statement in statements:
+                    self.cursor.execute(statement)
+                self.cursor.execute(f"PRAGMA user_version = {version}")
+            except Exception:
+                self.db.rollback()
+                raise
+            self.db.commit()
+        # init_tables ends here too, the catalog sees the tables it created
+        self.schema.refresh()
+
+    #
+    # Query plan checks
+    #
+    def explain(self, query: str, params: tuple = None) -> list[str]:
+        rows = self.db.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        return [row["detail"] for row in rows]
+
+    def __explain_plan(self, query: str, params: tuple = None) -> list[str]:
+        # Slow queries are logged from any thread, a reader can explain them on each
+        with self.connections.reader() as conn:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        return [row["detail"] for row in rows]
+
+    def view_query(self, name: str, id: int) -> tuple[str, tuple]:
+        """
+        The query and parameters the info/relations method name runs for id, without running it
+        """
+        if name not in INDEXED_QUERIES:
+            raise ValueError(f"{name} is not an info/relations view")
+
+        # Run the undecorated method against a stand-in whose select only records the query,
+        # this DB is left untouched so other threads can keep using it
+        capture = QueryCapture()
+        getattr(DB, name).__wrapped__(capture, id)
+        return capture.queries[0]
+
+    def check_query_plans(self, sample_id: int = 1) -> dict[str, list[str]]:
+        """
+        Check that none of the info/relations queries scans a table or a whole index
+        Returns the query plan of every checked method, raises QueryPlanError otherwise
+        """
+        captured = [self.view_query(name, sample_id) for name in INDEXED_QUERIES]
+
+        plans = {}
+        failed = []
+        for name, (query, params) in zip(INDEXED_QUERIES, captured):
+            plans[name] = self.explain(query, params)
+            scans = [d for d in plans[name] if d.startswith("SCAN")]
+            if scans:
+                failed.append(f"{name}: {', '.join(scans)}")
+
+        if failed:
+            raise QueryPlanError("Queries scanning instead of searching:\n" + "\n".join(failed))
+        return plans
+
+    #
+    # Summary tables
+    #
+    def check_summaries(self, tolerance: float = 1e-6) -> list[dict]:
+        """
+        Recompute the warehouse and port aggregates and the shipment status from
+        scratch and compare them with the stored tables, returns one dict per differing row
+        """
+        checks = [
+            (WAREHOUSE_SUMMARY, WAREHOUSE_AGGREGATES, "warehouse_id"),
+            (PORT_SUMMARY, PORT_AGGREGATES, "port_id"),
+            (SHIPMENT_STATUS, STATUS_PROJECTION, "shipping_id"),
+        ]
+        mismatches = []
+        for table, aggregates, key in checks:
+            fresh = {row[key]: row for row in self.select(aggregates, empty_row=False)}
+            stored = {row[key]: row for row in self.select(f"SELECT * FROM {table}", empty_row=False)}
+
+            for id in fresh.keys() | stored.keys():
+                expected, actual = fresh.get(id), stored.get(id)
+                if expected is None or actual is None or any(
+                        expected[c] != actual[c] if isinstance(expected[c], str)
+                        else not math.isclose(expected[c], actual[c], rel_tol=tolerance, abs_tol=tolerance)
+                        for c in expected):
+                    mismatches.append({"table": table, "id": id, "expected": expected, "actual": actual})
+        return mismatches
+
+    def rebuild_summaries(self):
+        """
+        Refill the summary tables from the current data
+        """
+        with self.db:
+            self.cursor.execute(f"DELETE FROM {WAREHOUSE_SUMMARY}")
+            self.cursor.execute(f"DELETE FROM {PORT_SUMMARY}")
+            self.cursor.execute(f"DELETE FROM {SHIPMENT_STATUS}")
+            self.cursor.execute(f"INSERT INTO {WAREHOUSE_SUMMARY} {WAREHOUSE_AGGREGATES}")
+            self.cursor.execute(f"INSERT INTO {PORT_SUMMARY} {PORT_AGGREGATES}")
+            self.cursor.execute(f"INSERT INTO {SHIPMENT_STATUS} {STATUS_PROJECTION}")
+        self.clear_cache()
 
     #
     # Select functions
     #
-    def select(self, query: str, params: tuple = None) -> list[dict]:
-        if params:
-            rows = self.cursor.execute(query, params).fetchall()
-            
+    def select(self, query: str, params: tuple = None, empty_row: bool = True, name: str | None = None) -> list[dict]:
+        """
+        Run query and fetch all rows
+        An empty result is returned as one row of None values unless empty_row is False
+        The profiler counts it under name, by default the name of the calling method
+        """
+        # Timed from the execute on, waiting for a free reader is not part of the query
+        if threading.get_ident() != self.owner:
+            with self.connections.reader() as conn:
+                start = time.perf_counter()
+                cursor = conn.execute(query, params or ())
+                rows = cursor.fetchall()
         else:
-            rows = self.cursor.execute(query).fetchall()
-        
-        if not rows and self.cursor.description:
-            return [{col[0]: None for col in self.cursor.description}]
+            start = time.perf_counter()
+            cursor = self.cursor
+            rows = cursor.execute(query, params or ()).fetchall()
+        self.profiler.record(name or sys._getframe(1).f_code.co_name, time.perf_counter() - start, len(rows),
+                             query, params)
+
+        if not rows and empty_row and cursor.description:
+            return [{col[0]: None for col in cursor.description}]
         return rows
 
+    def select_rows(self, query: str, params: tuple = None,
+                    name: str | None = None) -> tuple[list[str], list[tuple]]:
+        """
+        Run query and fetch all rows as plain tuples sharing one list of column names
+        Much cheaper than select for large results, an empty result has no rows
+        """
+        if threading.get_ident() != self.owner:
+            with self.connections.reader() as conn:
+                start = time.perf_counter()
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                rows = cursor.execute(query, params or ()).fetchall()
+        else:
+            start = time.perf_counter()
+            cursor = self.db.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(query, params or ()).fetchall()
+        self.profiler.record(name or sys._getframe(1).f_code.co_name, time.perf_counter() - start, len(rows),
+                             query, params)
+
+        return [col[0] for col in cursor.description], rows
+
+    def select_named(self, name: str, params: tuple = None, empty_row: bool = True) -> list[dict]:
+        """
+        Run the registered statement name, see STATEMENTS
+        """
+        return self.select(self.statements[name], params, empty_row, name)
+
+    def select_named_rows(self, name: str, params: tuple = None) -> tuple[list[str], list[tuple]]:
+        return self.select_rows(self.statements[name], params, name)
+
+    def execute_named(self, name: str, params: tuple = None) -> sql.Cursor:
+        """
+        Run the registered statement name on the writer, the caller commits
+        """
+        return self.execute(self.statements[name], params, name)
+
+    def execute(self, query: str, params: tuple = None, name: str | None = None) -> sql.Cursor:
+        """
+        Run a write on the writer, the caller commits
+        The profiler counts it under name, by default the name of the calling method
+        """
+        start = time.perf_counter()
+        cursor = self.cursor.execute(query, params or ())
+        self.profiler.record(name or sys._getframe(1).f_code.co_name, time.perf_counter() - start,
+                             max(cursor.rowcount, 0), query, params)
+        return cursor
+
+    def execute_many(self, name: str, params: list[tuple]) -> sql.Cursor:
+        """
+        Run the registered statement name once per params on the writer, the caller commits
+        """
+        start = time.perf_counter()
+        cursor = self.cursor.executemany(self.statements[name], params)
+        # One plan for all of them, explaining it needs a single set of parameters
+        self.profiler.record(name, time.perf_counter() - start, max(cursor.rowcount, 0),
+                             self.statements[name], params[0] if params else None)
+        return cursor
+
+    def get_schema(self, table_name: str) -> TableSchema:
+        """
+        Columns, types, primary key and foreign keys of a table from the schema catalog
+        """
+        return self.schema.table(table_name)
+
     def get_column_names(self, table_name: str) -> list[str]:
-        res = self.select(f'''SELECT * FROM {table_name}''')
-        return list(res[0].keys())
+        return list(self.schema.table(table_name).columns)
 
     def get_table_data_all(self, table_name: str) -> list[dict]:
         return self.select(f'''SELECT * FROM {table_name}''')
 
+    def get_primary_key(self, table_name: str) -> str:
+        pk = self.schema.table(table_name).primary_key
+        if pk is None:
+            raise ValueError(f"{table_name} has no primary key")
+        return pk
+
+    def get_table_page(self, table_name: str, after_id: int | None = None,
+                       before_id: int | None = None, limit: int = PAGE_SIZE) -> list[dict]:
+        """
+        Keyset pagination over the primary key
+        Returns up to limit rows after after_id (or before before_id) in ascending order
+        """
+        return self.select_named(*self.__page_statement(table_name, after_id, before_id, limit))
+
+    def get_table_page_rows(self, table_name: str, after_id: int | None = None,
+                            before_id: int | None = None,
+                            limit: int = PAGE_SIZE) -> tuple[list[str], list[tuple]]:
+        """
+        get_table_page as (columns, rows), see select_rows
+        """
+        return self.select_named_rows(*self.__page_statement(table_name, after_id, before_id, limit))
+
+    def __page_statement(self, table_name: str, after_id: int | None, before_id: int | None,
+                         limit: int) -> tuple[str, tuple]:
+        if table_name not in PRIMARY_KEYS:
+            raise ValueError(f"{table_name} is not a table")
+
+        if before_id is not None:
+            return f"{table_name}.page_before", (before_id, limit)
+        if after_id is not None:
+            return f"{table_name}.page_after", (after_id, limit)
+        return f"{table_name}.first_page", (limit,)
+
     def get_port_data(self, port_id: int) -> dict:
-        return self.select(f'''SELECT * FROM {Tables.PORTS} WHERE port_id = {port_id}''')[0]
+        return self.select_named(f"{Tables.PORTS}.row", (port_id,))[0]
 
     def get_warehouse_data(self, warehouse_id: int) -> dict:
-        return self.select(f'''SELECT * FROM {Tables.WAREHOUSES} WHERE warehouse_id ={warehouse_id}''')[0]
+        return self.select_named(f"{Tables.WAREHOUSES}.row", (warehouse_id,))[0]
 
     def get_shipping_locations(self, shipping_id: int) -> list[tuple[float, float]]:
-        res = self.select(f"""
-        SELECT 
-        p1.latitude as "l1", p1.longitude as "l2", p2.latitude as "l3", p2.longitude as "l4" 
-        FROM {Tables.SHIPPINGS} s
-        JOIN {Tables.PORTS} p1 ON s.from_port = p1.port_id
-        JOIN {Tables.PORTS} p2 ON s.into_port = p2.port_id
-        WHERE shipping_id = {shipping_id}
-        """)[0]
+        res = self.select_named("shipping_locations", (shipping_id,))[0]
 
         return [(float(res["l1"]), float(res["l2"])), (float(res["l3"]), float(res["l4"]))]
 
@@ -152,50 +910,330 @@ class DB:
     # Insert functions
     #
     def insert_port_data(self, name: str, latitude: float, longitude: float,
-                         country: str = "India", capacity: int = 1000):
-        self.cursor.execute(f'''
+                         country: str = "India", capacity: int = 1000) -> int:
+        self.execute(f'''
             INSERT INTO {Tables.PORTS} (name, latitude, longitude, country, capacity) VALUES (?, ?, ?, ?, ?)
                             ''', (name, latitude, longitude, country, capacity))
         self.db.commit()
+        id = self.cursor.lastrowid
+        self.invalidate(Tables.PORTS, {"port_id": id})
+        return id
 
     def insert_warehouse_data(self, name: str, latitude: float, longitude: float,
-                              capacity: int = 1000, port_id: int | None = None):
-        self.cursor.execute(f'''
+                              capacity: int = 1000, port_id: int | None = None) -> int:
+        self.execute(f'''
             INSERT INTO {Tables.WAREHOUSES} (name, latitude, longitude, capacity, port_id) VALUES (?, ?, ?, ?, ?)
                             ''', (name, latitude, longitude, capacity, port_id))
         self.db.commit()
+        id = self.cursor.lastrowid
+        self.invalidate(Tables.WAREHOUSES, {"warehouse_id": id, "port_id": port_id})
+        return id
 
-    def insert_item_data(self, name: str, category: str | None, unit_price: float):
-        self.cursor.execute(f'''
+    def insert_item_data(self, name: str, category: str | None, unit_price: float) -> int:
+        self.execute(f'''
             INSERT INTO {Tables.ITEMS} (name, category, unit_price) VALUES (?, ?, ?)
                             ''', (name, category, unit_price))
         self.db.commit()
+        id = self.cursor.lastrowid
+        self.invalidate(Tables.ITEMS, {"item_id": id})
+        return id
 
-    def insert_inventory_data(self, warehouse_id: int, item_id: int, quantity: int):
-        self.cursor.execute(f'''
+    def insert_inventory_data(self, warehouse_id: int, item_id: int, quantity: int) -> int:
+        self.execute(f'''
             INSERT INTO {Tables.INVENTORY} (warehouse_id, item_id, quantity) VALUES(?, ?, ?)
                             ''', (warehouse_id, item_id, quantity))
         self.db.commit()
+        id = self.cursor.lastrowid
+        self.invalidate(Tables.INVENTORY, {"inventory_id": id, "warehouse_id": warehouse_id, "item_id": item_id})
+        return id
 
-    def insert_shippings_data(self, from_port: int, into_port: int, inventory_id: int, arrived_at_port: bool, loaded_to_truck: bool):
-        self.cursor.execute(f'''
+    def insert_shippings_data(self, from_port: int, into_port: int, inventory_id: int, arrived_at_port: bool, loaded_to_truck: bool) -> int:
+        self.execute(f'''
             INSERT INTO {Tables.SHIPPINGS} (from_port, into_port, inventory_id, arrived_at_port, loaded_to_truck) VALUES(?, ?, ?, ?, ?)
                             ''', (from_port, into_port, inventory_id, arrived_at_port, loaded_to_truck))
         self.db.commit()
+        id = self.cursor.lastrowid
+        self.invalidate(Tables.SHIPPINGS, {"shipping_id": id, "inventory_id": inventory_id})
+        return id
 
     #
     # Delete function
     #
     def delete_row(self, table_name: str, id: int):
-        id_coloumn = self.get_column_names(table_name)[0]
-        print("DELETING: ", table_name, id, id_coloumn)
-        self.cursor.execute(
-            f'''delete from {table_name} WHERE {id_coloumn} = {id}''')
+        row = self.select_named(f"{table_name}.row", (id,))[0]
+        self.execute_named(f"{table_name}.delete", (id,))
         self.db.commit()
+        self.invalidate(table_name, row)
+
+    #
+    # Update function
+    #
+    def update_row(self, table_name: str, id: int, values: dict) -> int:
+        """
+        Set the given columns of one row, returns the number of changed rows (0 or 1)
+        """
+        pk = self.get_primary_key(table_name)
+        columns = self.get_column_names(table_name)
+        unknown = [col for col in values if col not in columns or col == pk]
+        if unknown:
+            raise ValueError(f"Cannot update {', '.join(unknown)} of {table_name}")
+        if not values:
+            return 0
+
+        old = self.select_named(f"{table_name}.row", (id,))[0]
+        assignments = ", ".join(f"{col} = ?" for col in values)
+        self.execute(f"UPDATE {table_name} SET {assignments} WHERE {pk} = ?", (*values.values(), id))
+        self.db.commit()
+        if not self.cursor.rowcount:
+            return 0
+
+        if table_name in (Tables.INVENTORY, Tables.SHIPPINGS):
+            # Both the old and the new warehouse/item/port see the change
+            self.invalidate(table_name, old)
+            self.invalidate(table_name, {**old, **values})
+        else:
+            # Names and prices of ports, warehouses and items show up in the views of many rows
+            self.clear_cache()
+        return 1
+
+    #
+    # Batch functions, each runs in one transaction and returns the affected rows and elapsed time
+    #
+    def delete_rows(self, table_name: str, ids: list[int]) -> dict:
+        """
+        Delete every id of table_name, nothing is deleted if one of them fails
+        """
+        start = time.perf_counter()
+        ids = list(ids)
+        rows = self.select_named(f"{table_name}.rows", (json.dumps(ids),), empty_row=False)
+        with self.db:
+            deleted = self.execute_many(f"{table_name}.delete", [(id,) for id in ids]).rowcount
+        self.__invalidate_rows(table_name, rows)
+        return {"rows": deleted, "seconds": time.perf_counter() - start}
+
+    def delete_warehouses_cascade(self, warehouse_ids: list[int]) -> dict:
+        """
+        Delete warehouses together with their inventory and its shippings
+        """
+        start = time.perf_counter()
+        params = [(id,) for id in warehouse_ids]
+        deleted = {}
+        with self.db:
+            for table, name in [
+                (Tables.SHIPPINGS, "warehouse_shippings.delete"),
+                (Tables.INVENTORY, "warehouse_inventory.delete"),
+                (Tables.WAREHOUSES, f"{Tables.WAREHOUSES}.delete"),
+            ]:
+                deleted[table] = self.execute_many(name, params).rowcount
+        # Views of ports, items and inventory rows change all over, start over
+        self.clear_cache()
+        return {"rows": sum(deleted.values()), "deleted": deleted, "seconds": time.perf_counter() - start}
+
+    def update_quantities(self, quantities: dict[int, int]) -> dict:
+        """
+        Set the quantity of inventory rows, quantities maps inventory_id -> quantity
+        """
+        start = time.perf_counter()
+        with self.db:
+            updated = self.execute_many("quantity.update", [(q, id) for id, q in quantities.items()]).rowcount
+        rows = self.select_named(f"{Tables.INVENTORY}.rows", (json.dumps(list(quantities)),), empty_row=False)
+        self.__invalidate_rows(Tables.INVENTORY, rows)
+        return {"rows": updated, "seconds": time.perf_counter() - start}
+
+    def update_prices(self, prices: dict[int, float]) -> dict:
+        """
+        Set the unit price of items, prices maps item_id -> unit_price
+        """
+        start = time.perf_counter()
+        with self.db:
+            updated = self.execute_many("unit_price.update", [(p, id) for id, p in prices.items()]).rowcount
+        # The value of every warehouse stocking one of the items changed
+        self.clear_cache()
+        return {"rows": updated, "seconds": time.perf_counter() - start}
+
+    #
+    # Shipment events
+    #
+    def add_event(self, shipping_id: int, status: str, ts: float | None = None) -> int:
+        """
+        Append one event to the history of a shipping, ts is a unix timestamp and defaults to now
+        """
+        self.__check_statuses([status])
+        self.execute_named("event.insert", (shipping_id, status, time.time() if ts is None else ts))
+        self.db.commit()
+        id = self.cursor.lastrowid
+        self.__invalidate_shippings([shipping_id])
+        return id
+
+    def add_events(self, events: list[tuple[int, str, float | None]]) -> dict:
+        """
+        Append (shipping_id, status, ts) events in one transaction, nothing is written if one of them fails
+        Scanners should send their events in batches, one transaction per event is far slower
+        """
+        start = time.perf_counter()
+        now = time.time()
+        params = [(shipping_id, status, now if ts is None else ts) for shipping_id, status, ts in events]
+        self.__check_statuses(status for _, status, _ in params)
+
+        with self.db:
+            added = self.execute_many("event.insert", params).rowcount
+        self.__invalidate_shippings({shipping_id for shipping_id, _, _ in params})
+        return {"rows": added, "seconds": time.perf_counter() - start}
+
+    def __check_statuses(self, statuses):
+        unknown = set(statuses) - set(EVENT_STATUSES)
+        if unknown:
+            raise ValueError(f"Unknown shipment status {', '.join(map(repr, sorted(unknown)))}, "
+                             f"expected one of {', '.join(EVENT_STATUSES)}")
+
+    def __invalidate_shippings(self, shipping_ids):
+        if self.cache is None:
+            return
+        rows = self.select_named(f"{Tables.SHIPPINGS}.rows", (json.dumps(list(shipping_ids)),), empty_row=False)
+        self.__invalidate_rows(Tables.SHIPPINGS, rows)
+
+    def get_events_by_status(self, status: str, since: float = 0.0, limit: int = PAGE_SIZE) -> list[dict]:
+        """
+        Events of one status from since on, oldest first
+        """
+        return self.select_named("events_by_status", (status, since, limit), empty_row=False)
+
+    #
+    # Search
+    #
+    def search(self, text: str, tables: tuple[str, ...] | None = None,
+               limit: int = SEARCH_LIMIT, fuzzy: bool = True) -> list[dict]:
+        """
+        Ports, warehouses and items whose name (or country/category) matches text
+        Every word of text matches as a word prefix. If nothing matches and fuzzy is set,
+        misspelled words are corrected to the closest indexed words.
+        Rows have table, id, name, detail, match ("prefix" or "fuzzy") and score, best first
+        """
+        unknown = set(tables or ()) - set(SEARCHABLE)
+        if unknown:
+            raise ValueError(f"Cannot search {', '.join(sorted(unknown))}, "
+                             f"expected one of {', '.join(SEARCHABLE)}")
+        words = search_words(text)
+        if not words or limit <= 0:
+            return []
+        kinds = {SEARCHABLE[table][0]: table for table in (tables or SEARCHABLE)}
+
+        # Quoted words cannot be read as FTS5 operators
+        rows = self.__search(" ".join(f'"{word}"*' for word in words), kinds, limit, "prefix", words)
+        if rows or not fuzzy:
+            return rows
+
+        corrections = {word: self.__corrections(word) for word in words}
+        if not any(corrections.values()):
+            # The same query again would not find anything either
+            return []
+        groups = []
+        for word in words:
+            options = [f'"{word}"*'] + [f'"{term}"' for term in corrections[word]]
+            groups.append(f"({' OR '.join(options)})")
+        rows = self.__search(" AND ".join(groups), kinds, limit, "fuzzy", words)
+        return [row for row in rows if row["score"] >= SEARCH_MIN_SCORE]
+
+    def __corrections(self, word: str) -> list[str]:
+        """
+        Indexed words close to word, starting with the same letters and about as long
+        """
+        if len(word) <= SEARCH_FUZZY_PREFIX:
+            return []
+        start = word[:SEARCH_FUZZY_PREFIX]
+        end = start[:-1] + chr(ord(start[-1]) + 1)
+        terms = self.select_named("search.terms", (start, end, len(word) - 2, len(word) + 2), empty_row=False)
+
+        scored = []
+        for row in terms:
+            if row["term"] == word:
+                # Already matched as a prefix
+                continue
+            matcher = SequenceMatcher(None, word, row["term"])
+            if matcher.real_quick_ratio() >= SEARCH_MIN_SCORE and (score := matcher.ratio()) >= SEARCH_MIN_SCORE:
+                scored.append((score, row["term"]))
+        scored.sort(reverse=True)
+        return [term for _, term in scored[:SEARCH_FUZZY_TERMS]]
+
+    def __search(self, match: str, kinds: dict[int, str], limit: int, kind: str, words: list[str]) -> list[dict]:
+        rows = self.select_named("search", (match, json.dumps(list(kinds)), limit * SEARCH_CANDIDATES),
+                                 empty_row=False)
+        rows = [{
+            "table": kinds[row["rowid"] % SEARCH_KINDS],
+            "id": row["rowid"] // SEARCH_KINDS,
+            "name": row["name"],
+            "detail": row["detail"],
+            "match": kind,
+            "score": round(similarity(words, f"{row['name'] or ''} {row['detail'] or ''}"), 3),
+        } for row in rows]
+        rows.sort(key=lambda row: row["score"], reverse=True)
+        return rows[:limit]
+
+    #
+    # Cache invalidation
+    #
+    def related_entities(self, table_name: str, row: dict) -> list[tuple[str, int]]:
+        """
+        (table, id) of every entity whose info/relations views include row
+        """
+        if table_name == Tables.PORTS:
+            return [(Tables.PORTS, row["port_id"])]
+
+        if table_name == Tables.WAREHOUSES:
+            return [(Tables.WAREHOUSES, row["warehouse_id"]), (Tables.PORTS, row["port_id"])]
+
+        if table_name == Tables.ITEMS:
+            return [(Tables.ITEMS, row["item_id"])]
+
+        if table_name == Tables.INVENTORY:
+            port = self.select_named("warehouse_port", (row["warehouse_id"],))[0]
+            # get_shipping_info shows the quantity and warehouse of its inventory row
+            shippings = self.select_named("inventory_shippings", (row["inventory_id"],), empty_row=False)
+            return [
+                (Tables.INVENTORY, row["inventory_id"]),
+                (Tables.WAREHOUSES, row["warehouse_id"]),
+                (Tables.ITEMS, row["item_id"]),
+                (Tables.PORTS, port["port_id"]),
+                *((Tables.SHIPPINGS, shipping["shipping_id"]) for shipping in shippings),
+            ]
+
+        if table_name == Tables.SHIPPINGS:
+            inventory = self.select_named("inventory_warehouse", (row["inventory_id"],))[0]
+            return [
+                (Tables.SHIPPINGS, row["shipping_id"]),
+                (Tables.INVENTORY, row["inventory_id"]),
+                (Tables.WAREHOUSES, inventory["warehouse_id"]),
+            ]
+
+        return []
+
+    def invalidate(self, table_name: str, row: dict):
+        """
+        Drop the cached views affected by an insert or delete of row
+        """
+        if self.cache is None:
+            return
+        for table, id in self.related_entities(table_name, row):
+            self.cache.invalidate(table, id)
+
+    def __invalidate_rows(self, table_name: str, rows: list[dict]):
+        if self.cache is None:
+            return
+        if len(rows) > self.cache.size:
+            # More rows than cached entries, starting over is cheaper than looking up their entities
+            self.cache.clear()
+            return
+        for row in rows:
+            self.invalidate(table_name, row)
+
+    def clear_cache(self):
+        if self.cache is not None:
+            self.cache.clear()
 
     #
     # Info functions
     #
+    @cached(Tables.PORTS)
     def get_port_relations(self, port_id: int) -> list[dict]:
         query = f"""
             SELECT 
@@ -207,21 +1245,22 @@ class DB:
         """
         return self.select(query,(port_id,))
 
+    @cached(Tables.PORTS)
     def get_port_info(self, port_id: int) -> list[dict]:
         query = f"""
             SELECT 
                 p.port_id as "id",
                 p.name AS port_name,
                 p.country,
-                COUNT(w.warehouse_id) AS total_warehouses,
-                SUM(w.capacity) AS total_warehouse_capacity
+                IFNULL(s.total_warehouses, 0) AS total_warehouses,
+                CASE WHEN s.total_warehouses > 0 THEN s.total_warehouse_capacity END AS total_warehouse_capacity
             FROM {Tables.PORTS} p
-            LEFT JOIN {Tables.WAREHOUSES} w ON p.port_id = w.port_id
-            WHERE p.port_id = ?
-            GROUP BY p.port_id;
+            LEFT JOIN {PORT_SUMMARY} s ON p.port_id = s.port_id
+            WHERE p.port_id = ?;
         """
         return self.select(query,(port_id,))
 
+    @cached(Tables.WAREHOUSES)
     def get_warehouse_relations(self, warehouse_id: int) -> list[dict]:
         query = f"""
             SELECT
@@ -232,13 +1271,14 @@ class DB:
                 i.quantity,
                 it.unit_price,
                 (i.quantity * it.unit_price) AS total_value,
-                i.inventory_id IN (SELECT inventory_id FROM {Tables.SHIPPINGS}) AS "is_shipping"
+                EXISTS (SELECT 1 FROM {Tables.SHIPPINGS} sh WHERE sh.inventory_id = i.inventory_id) AS "is_shipping"
             FROM {Tables.INVENTORY} i
             INNER JOIN {Tables.ITEMS} it ON i.item_id = it.item_id
             WHERE i.warehouse_id = ?;
         """
         return self.select(query,(warehouse_id,))
 
+    @cached(Tables.WAREHOUSES)
     def get_warehouse_info(self, warehouse_id: int) -> list[dict]:
         query = f"""
             SELECT
@@ -248,19 +1288,18 @@ class DB:
                 p.name AS port_name,
                 p.country as "country",
                 w.capacity as "capacity",
-                IFNULL(SUM(i.quantity), 0) AS total_items,
-                (w.capacity - IFNULL(SUM(i.quantity), 0)) AS capacity_remaining,
-                IFNULL(SUM(i.quantity * it.unit_price), 0) AS total_value
+                IFNULL(s.total_items, 0) AS total_items,
+                (w.capacity - IFNULL(s.total_items, 0)) AS capacity_remaining,
+                IFNULL(s.total_value, 0) AS total_value
             FROM {Tables.WAREHOUSES} w
             LEFT JOIN {Tables.PORTS} p ON w.port_id = p.port_id
-            LEFT JOIN {Tables.INVENTORY} i ON w.warehouse_id = i.warehouse_id
-            LEFT JOIN {Tables.ITEMS} it ON i.item_id = it.item_id
-            WHERE w.warehouse_id = ?
-            GROUP BY w.warehouse_id;
+            LEFT JOIN {WAREHOUSE_SUMMARY} s ON w.warehouse_id = s.warehouse_id
+            WHERE w.warehouse_id = ?;
         """
         return self.select(query,(warehouse_id,))
 
 
+    @cached(Tables.ITEMS)
     def get_item_relations(self, item_id: int) -> list[dict]:
         query = f"""
             SELECT
@@ -275,6 +1314,7 @@ class DB:
         """
         return self.select(query,(item_id,))
 
+    @cached(Tables.ITEMS)
     def get_item_info(self, item_id: int) -> list[dict]:
         query = f"""
             SELECT
@@ -293,6 +1333,7 @@ class DB:
         return self.select(query,(item_id,))
 
 
+    @cached(Tables.INVENTORY)
     def get_inventory_relations(self, inventory_id: int) -> list[dict]:
         # TODO Implement
         query = f"""
@@ -303,7 +1344,7 @@ class DB:
             inv.quantity,
             i.unit_price,
             i.unit_price * inv.quantity as "total_value",
-            inv.inventory_id IN (SELECT inventory_id FROM {Tables.SHIPPINGS}) AS "being_shipped"
+            EXISTS (SELECT 1 FROM {Tables.SHIPPINGS} sh WHERE sh.inventory_id = inv.inventory_id) AS "being_shipped"
             FROM {Tables.INVENTORY} inv
             JOIN {Tables.ITEMS} i ON i.item_id = inv.item_id
             JOIN {Tables.WAREHOUSES} w on w.warehouse_id = inv.warehouse_id
@@ -312,6 +1353,7 @@ class DB:
         """
         return self.select(query,(inventory_id,))
 
+    @cached(Tables.INVENTORY)
     def get_inventory_info(self, inventory_id: int) -> list[dict]:
         # TODO Implement
         query = f"""
@@ -333,6 +1375,7 @@ class DB:
         return self.select(query,(inventory_id,))
 
 
+    @cached(Tables.SHIPPINGS)
     def get_shipping_info(self, shipping_id: int) -> list[dict]:
         # TODO Implement
         query = f"""
@@ -344,11 +1387,105 @@ class DB:
         sh.into_port AS "destination_port",
         w.warehouse_id AS "destination_warehouse",
         sh.arrived_at_port,
-        sh.loaded_to_truck
+        sh.loaded_to_truck,
+        ss.status,
+        ss.ts AS "status_ts"
         FROM {Tables.SHIPPINGS} sh
         JOIN {Tables.INVENTORY} inv ON inv.inventory_id = sh.inventory_id
         JOIN {Tables.WAREHOUSES} w ON w.warehouse_id = inv.warehouse_id
         JOIN {Tables.ITEMS} i ON i.item_id = inv.item_id
+        LEFT JOIN {SHIPMENT_STATUS} ss ON ss.shipping_id = sh.shipping_id
         WHERE sh.shipping_id = ?;
         """
         return self.select(query,(shipping_id,))
+
+    @cached(Tables.SHIPPINGS)
+    def get_shipping_events(self, shipping_id: int) -> list[dict]:
+        """
+        Lifecycle history of a shipping, oldest event first
+        """
+        return self.select(self.statements["shipping_events"], (shipping_id,))
+
+    @cached(Tables.INVENTORY)
+    def get_shipping_status(self, inventory_id: int) -> list[dict]:
+        """
+        Number of shippings of an inventory row and how many of them arrived or were loaded
+        Read from idx_shippings_status only, however long the shipping history is
+        """
+        query = f"""
+            SELECT
+                ? AS inventory_id,
+                COUNT(*) AS shipments,
+                IFNULL(SUM({flag_set("arrived_at_port")}), 0) AS arrived,
+                IFNULL(SUM({flag_set("loaded_to_truck")}), 0) AS loaded,
+                IFNULL(SUM(NOT {flag_set("arrived_at_port")}), 0) AS in_transit
+            FROM {Tables.SHIPPINGS}
+            WHERE inventory_id = ?;
+        """
+        return self.select(query, (inventory_id, inventory_id))
+
+    #
+    # Spatial functions
+    #
+    def sites_in_bbox(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                      tables: tuple[str, ...] = (Tables.PORTS, Tables.WAREHOUSES),
+                      center: tuple[float, float] | None = None) -> list[dict]:
+        """
+        Ports and warehouses inside the box, min_lon > max_lon for a box crossing the antimeridian
+        Rows have table, id, name, latitude, longitude and distance_km to center (if given)
+        """
+        if min_lon > max_lon:
+            return (self.sites_in_bbox(min_lat, min_lon, max_lat, 180.0, tables, center)
+                    + self.sites_in_bbox(min_lat, -180.0, max_lat, max_lon, tables, center))
+
+        if center is not None:
+            distance, params = "haversine_km(?, ?, t.latitude, t.longitude)", center
+        else:
+            distance, params = "NULL", ()
+
+        rows = []
+        for table in tables:
+            index, pk = SPATIAL_INDEXES[table]
+            rows += self.select(f"""
+                SELECT
+                    '{table}' AS "table",
+                    t.{pk} AS "id",
+                    t.name,
+                    t.latitude,
+                    t.longitude,
+                    {distance} AS distance_km
+                FROM {index} r
+                JOIN {table} t ON t.{pk} = r.{pk}
+                WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ?
+            """, (*params, max_lat, min_lat, max_lon, min_lon), empty_row=False)
+        return rows
+
+    def sites_within(self, latitude: float, longitude: float, km: float,
+                     tables: tuple[str, ...] = (Tables.PORTS, Tables.WAREHOUSES)) -> list[dict]:
+        """
+        Ports and warehouses at most km away, closest first
+        """
+        rows = self.sites_in_bbox(*bbox_around(latitude, longitude, km), tables, (latitude, longitude))
+        rows = [r for r in rows if r["distance_km"] <= km]
+        rows.sort(key=lambda r: r["distance_km"])
+        return rows
+
+    def nearest_sites(self, latitude: float, longitude: float, k: int = 1,
+                      tables: tuple[str, ...] = (Tables.PORTS, Tables.WAREHOUSES)) -> list[dict]:
+        # Grow the search radius until k sites are found or the whole globe is covered
+        km = 50.0
+        while True:
+            rows = self.sites_within(latitude, longitude, km, tables)
+            if len(rows) >= k or km > 2 * math.pi * EARTH_RADIUS_KM:
+                return rows[:k]
+            km *= 4
+
+    def nearest_port(self, latitude: float, longitude: float) -> dict | None:
+        rows = self.nearest_sites(latitude, longitude, 1, (Tables.PORTS,))
+        return rows[0] if rows else None
+
+    def nearest_warehouses(self, port_id: int, k: int = 5) -> list[dict]:
+        port = self.get_port_data(port_id)
+        if port["latitude"] is None:
+            return []
+        return self.nearest_sites(port["latitude"], port["longitude"], k, (Tables.WAREHOUSES,))
@@ -0,0 +1,90 @@
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+
+WORKERS = 4
+POLL_MS = 20
+
+
+class QueryDispatcher:
+    """
+    Runs DB work on worker threads and hands the results back to the Tk thread
+
+    Work is submitted on a channel, submitting again on the same channel
+    cancels the previous call and drops its result if it already runs, so
+    only the answer to the latest request reaches the UI. Results are
+    delivered from an after() loop on the Tk thread.
+    """
+
+    def __init__(self, root, workers: int = WORKERS, on_busy=None):
+        """
+        on_busy(busy: bool) is called on the Tk thread when work starts or all work is done
+        """
+        self.root = root
+        self.on_busy = on_busy
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="pwms-query")
+
+        self.results: queue.Queue = queue.Queue()
+        self.generations: dict[str, int] = {}
+        self.futures: dict[str, Future] = {}
+        self.running = 0
+
+        self.root.after(POLL_MS, self.__poll)
+
+    def submit(self, channel: str | None, func, *args, on_done=None, on_error=None) -> Future:
+        """
+        Run func(*args) on a worker, on_done(result) or on_error(exception) run on the Tk thread
+        A channel of None is never cancelled
+        """
+        generation = None
+        if channel is not None:
+            self.cancel(channel)
+            generation = self.generations[channel]
+
+        future = self.executor.submit(func, *args)
+        if channel is not None:
+            self.futures[channel] = future
+
+        self.running += 1
+        if self.running == 1 and self.on_busy:
+            self.on_busy(True)
+
+        future.add_done_callback(
+            lambda f: self.results.put((channel, generation, f, on_done, on_error)))
+        return future
+
+    def cancel(self, channel: str):
+        """
+        Drop the pending result of channel
+        """
+        self.generations[channel] = self.generations.get(channel, 0) + 1
+        if future := self.futures.pop(channel, None):
+            future.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __poll(self):
+        while True:
+            try:
+                channel, generation, future, on_done, on_error = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.running -= 1
+            if self.running == 0 and self.on_busy:
+                self.on_busy(False)
+
+            if future.cancelled() or (channel is not None and generation != self.generations.get(channel)):
+                continue
+            if channel is not None and self.futures.get(channel) is future:
+                del self.futures[channel]
+
+            if (err := future.exception()) is not None:
+                if on_error:
+                    on_error(err)
+                else:
+                    self.root.report_callback_exception(type(err), err, err.__traceback__)
+            elif on_done:
+                on_done(future.result())
+
+        self.root.after(POLL_MS, self.__poll)
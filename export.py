@@ -0,0 +1,211 @@
+import csv
+import json
+import time
+from pathlib import Path
+
+from .db import DB, INDEXED_QUERIES, PRIMARY_KEYS, TRUE_FLAGS
+
+FETCH_SIZE = 10_000
+FORMATS = ("csv", "jsonl", "parquet")
+
+# Declared SQLite column types -> Arrow type names, anything else is exported as a string
+ARROW_TYPES = {
+    "integer": "int64",
+    "double": "float64",
+    "real": "float64",
+    "boolean": "bool_",
+    "text": "string",
+}
+
+
+def widest_type(storage_classes: set[str]) -> str:
+    """
+    Arrow type name holding every SQLite storage class a column had, typeof() values
+    """
+    classes = storage_classes - {"null"}
+    if classes == {"integer"}:
+        return "int64"
+    if classes and classes <= {"integer", "real"}:
+        return "float64"
+    return "string"
+
+
+def format_of(path: str | Path) -> str:
+    """
+    Export format from the file suffix
+    """
+    suffix = Path(path).suffix.lstrip(".").lower()
+    if suffix in ("json", "ndjson"):
+        suffix = "jsonl"
+    if suffix not in FORMATS:
+        raise ValueError(f"Cannot export to {path}, use one of: {', '.join('.' + f for f in FORMATS)}")
+    return suffix
+
+
+class CSVWriter:
+    """
+    Rows as CSV with a header line, the same layout the importer reads
+    """
+
+    def __init__(self, path: Path, columns: list[str], types: dict[str, str] | None = None):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list[tuple]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLWriter:
+    """
+    One JSON object per line
+    """
+
+    def __init__(self, path: Path, columns: list[str], types: dict[str, str] | None = None):
+        self.file = open(path, "w", encoding="utf-8")
+        self.columns = columns
+
+    def write(self, rows: list[tuple]):
+        self.file.writelines(json.dumps(dict(zip(self.columns, row))) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Columnar Parquet file, every fetched batch becomes one row group
+    Needs pyarrow, which is only imported when a Parquet file is written
+    """
+
+    def __init__(self, path: Path, columns: list[str], types: dict[str, str] | None = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export needs pyarrow, install it with: pip install pyarrow") from e
+
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.columns = columns
+        self.types = types
+        self.writer = None
+
+    def write(self, rows: list[tuple]):
+        data = {col: [row[i] for row in rows] for i, col in enumerate(self.columns)}
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.__schema())
+
+        arrays = []
+        for field, values in zip(self.writer.schema, data.values()):
+            if self.pa.types.is_boolean(field.type):
+                # SQLite keeps booleans as 0/1, older rows as 'true'/'false'
+                values = [None if value is None else value in TRUE_FLAGS for value in values]
+            elif self.pa.types.is_string(field.type):
+                # A text column may still hold numbers, SQLite does not enforce declared types
+                values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+            arrays.append(self.pa.array(values, field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.writer.schema))
+
+    def __schema(self):
+        types = self.types or {}
+        return self.pa.schema([self.pa.field(col, getattr(self.pa, types.get(col, "string"))())
+                               for col in self.columns])
+
+    def close(self):
+        if self.writer is None:
+            # Nothing was fetched, still write a valid empty file
+            self.writer = self.pq.ParquetWriter(self.path, self.__schema())
+        self.writer.close()
+
+
+WRITERS = {
+    "csv": CSVWriter,
+    "jsonl": JSONLWriter,
+    "parquet": ParquetWriter,
+}
+
+
+class Exporter:
+    """
+    Streams tables or info/relations views into CSV, JSON Lines or Parquet files
+
+    Rows are read from a pooled read-only connection with fetchmany in
+    batches of fetch_size and written out batch by batch, so memory use
+    does not grow with the size of the export.
+    """
+
+    def __init__(self, db: DB, fetch_size: int = FETCH_SIZE, report=print):
+        self.db = db
+        self.fetch_size = fetch_size
+        self.report = report
+
+    def export_table(self, table: str, path: str | Path, format: str | None = None) -> dict:
+        """
+        Export a whole table in primary key order
+        Returns rows, seconds and rows_per_sec like CSVImporter.import_file
+        """
+        if table not in PRIMARY_KEYS:
+            raise ValueError(f"{table} is not a table")
+        query = f"SELECT * FROM {table} ORDER BY {PRIMARY_KEYS[table]}"
+        return self.export_query(query, (), path, format, self.__declared_types(table), label=table)
+
+    def export_view(self, view: str, id: int, path: str | Path, format: str | None = None) -> dict:
+        """
+        Export the result of an info/relations method, e.g. export_view("get_port_relations", 1, ...)
+        """
+        if view not in INDEXED_QUERIES:
+            raise ValueError(f"{view} is not one of: {', '.join(INDEXED_QUERIES)}")
+        query, params = self.db.view_query(view, id)
+        return self.export_query(query, params, path, format, label=f"{view}({id})")
+
+    def export_query(self, query: str, params: tuple, path: str | Path, format: str | None = None,
+                     types: dict[str, str] | None = None, label: str = "query") -> dict:
+        path = Path(path)
+        writer_class = WRITERS[format or format_of(path)]
+
+        start = time.perf_counter()
+        rows = 0
+        with self.db.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(query, params)
+            columns = [col[0] for col in cursor.description]
+            if types is None and writer_class is ParquetWriter:
+                # Columns of a view have no declared type, widen over the storage classes of every row
+                types = dict(zip(columns, self.__stored_types(conn, query, params, len(columns))))
+
+            writer = writer_class(path, columns, types)
+            try:
+                while batch := cursor.fetchmany(self.fetch_size):
+                    writer.write(batch)
+                    rows += len(batch)
+            finally:
+                writer.close()
+                cursor.close()
+
+        seconds = time.perf_counter() - start
+        if self.report:
+            self.report(f"EXPORTED: {label} {rows} rows to {path} ({seconds:.2f}s)")
+        return {"rows": rows, "seconds": seconds, "rows_per_sec": rows / seconds if seconds else 0.0}
+
+    def __stored_types(self, conn, query: str, params: tuple, count: int) -> list[str]:
+        aliases = [f"c{i}" for i in range(count)]
+        classes = ", ".join(f"group_concat(DISTINCT typeof({alias}))" for alias in aliases)
+        query = query.strip().rstrip(";")
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute(f"WITH q({', '.join(aliases)}) AS ({query}) SELECT {classes} FROM q", params)
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return [widest_type(set((found or "").split(","))) for found in row]
+
+    def __declared_types(self, table: str) -> dict[str, str]:
+        types = self.db.get_schema(table).types
+        return {col: ARROW_TYPES.get(type, "string") for col, type in types.items()}
@@ -0,0 +1,44 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance between two positions in kilometers
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_around(latitude: float, longitude: float, km: float) -> tuple[float, float, float, float]:
+    """
+    Smallest (min_lat, min_lon, max_lat, max_lon) box containing every position
+    within km of the given one. When the box crosses the antimeridian min_lon > max_lon.
+    """
+    dlat = km / KM_PER_DEGREE
+    min_lat = latitude - dlat
+    max_lat = latitude + dlat
+
+    angle = km / EARTH_RADIUS_KM
+    if min_lat <= -90 or max_lat >= 90 or angle >= math.pi / 2:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    ratio = math.sin(angle) / math.cos(math.radians(latitude))
+    if ratio >= 1:
+        return min_lat, -180.0, max_lat, 180.0
+
+    dlon = math.degrees(math.asin(ratio))
+    min_lon = longitude - dlon
+    max_lon = longitude + dlon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, min_lon, max_lat, max_lon
@@ -1,5 +1,5 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import filedialog, ttk
 import customtkinter as ctk
 import tkintermapview as tmv
 from pathlib import Path
@@ -12,9 +12,17 @@ from typing import get_args, get_origin, Union
 
 from .loader import MapDownloader
 from .db import DB, Tables
+from .markers import MarkerLayer, fetch_sites
+from .dispatcher import QueryDispatcher
+from .analytics import SORT_COLUMNS, port_utilization, warehouse_utilization
 
 MAP_DB_PATH = Path(__file__).parent / "database" / "map.db"
 LARGE_FONT = ("TkTextFont", 20)
+FLEET_ROWS = 500
+# Wait for a pause in typing before searching
+SEARCH_DELAY_MS = 150
+SEARCH_ZOOM = 12
+DIAGNOSTICS_REFRESH_MS = 1000
 
 
 def call_with_types(func, values: dict):
@@ -128,10 +136,12 @@ class AddPopup(PopupBox):
             e[1].destroy()
         self.row_entries.clear()
 
-        cur_table = getattr(Tables, self.table_opt.get())
-        row = self.db.get_table_data_all(cur_table)[0]
-        for i, col in enumerate(list(row.keys())[1:]):
-            self.__add_row(i, col)
+        schema = self.db.get_schema(getattr(Tables, self.table_opt.get()))
+        for i, col in enumerate(schema.insert_columns()):
+            hint = schema.types[col]
+            if col in schema.foreign_keys:
+                hint = "{} of {}".format(*reversed(schema.foreign_keys[col]))
+            self.__add_row(i, col, hint)
 
     def submit(self, *_):
         self.values = {}
@@ -146,11 +156,11 @@ class AddPopup(PopupBox):
         self.wait_window()
         return self.table, self.values
 
-    def __add_row(self, row: int, name: str):
+    def __add_row(self, row: int, name: str, hint: str):
         ctk.CTkLabel(self.data_frame, text=name).grid(
             row=row, column=0, padx=10)
 
-        ptext = f"Enter {name}"
+        ptext = f"Enter {name} ({hint})"
         entry = ctk.CTkEntry(self.data_frame, placeholder_text=ptext)
         entry.grid(row=row, column=1, sticky="nsew", padx=10, pady=10)
         self.row_entries.append((name, entry))
@@ -214,16 +224,190 @@ class ExceptionPopup(PopupBox):
         self.wait_window()
 
 
+class FleetPopup(PopupBox):
+    """
+    Utilization of all warehouses or ports, click a heading to sort by it
+    and double click a row to show it in the main table
+    """
+
+    def __init__(self, root, db: DB, queries: QueryDispatcher, on_select):
+        super().__init__(root, "Fleet Overview", 0.7, 0.6)
+
+        self.db = db
+        self.queries = queries
+        self.on_select = on_select
+
+        self.table = Tables.WAREHOUSES
+        self.sort = "fill_ratio"
+        self.descending = True
+
+        self.table_opt = ctk.CTkSegmentedButton(
+            self, values=[Tables.WAREHOUSES, Tables.PORTS], command=self.__on_table_change)
+        self.table_opt.set(self.table)
+        self.table_opt.pack(fill="x", padx=10, pady=5)
+
+        self.view = TableView(self)
+        self.view.pack(fill="both", expand=True)
+        self.view.bind("<Double-1>", self.__on_double_click)
+
+        self.status = ctk.CTkLabel(self, text="")
+        self.status.pack(fill="x", padx=10)
+
+        self.refresh()
+
+    def refresh(self):
+        fetch = warehouse_utilization if self.table == Tables.WAREHOUSES else port_utilization
+        self.status.configure(text="Loading...")
+        self.queries.submit("fleet", fetch, self.db, self.sort, self.descending, FLEET_ROWS,
+                            on_done=self.__show)
+
+    def __show(self, page: tuple[list[str], list[tuple]]):
+        if not self.winfo_exists():
+            return
+
+        self.view.delete_all()
+        headings, rows = page
+        if not rows:
+            self.status.configure(text="No data")
+            return
+
+        self.view.add_headings(headings)
+        for col in headings:
+            if col in SORT_COLUMNS:
+                arrow = (" \u25bc" if self.descending else " \u25b2") if col == self.sort else ""
+                self.view.heading(col, text=col + arrow, command=lambda col=col: self.__sort_by(col))
+
+        for row in rows:
+            self.view.add_row([self.__format(col, value) for col, value in zip(headings, row)])
+
+        order = "descending" if self.descending else "ascending"
+        self.status.configure(text=f"{len(rows)} {self.table} by {self.sort} ({order})")
+
+    def __format(self, column: str, value):
+        if value is None:
+            return ""
+        if column in ("fill_ratio", "in_transit_share"):
+            return f"{value:.1%}"
+        if column == "total_value":
+            return f"{value:,.2f}"
+        return value
+
+    def __sort_by(self, column: str):
+        if column == self.sort:
+            self.descending = not self.descending
+        else:
+            self.sort = column
+            self.descending = True
+        self.refresh()
+
+    def __on_table_change(self, table: str):
+        self.table = table
+        self.refresh()
+
+    def __on_double_click(self, *_):
+        if self.view.selection():
+            self.on_select(self.table, int(self.view.get_selected_item()[0]))
+
+    def run(self):
+        self.wait_window()
+        self.queries.cancel("fleet")
+
+
+class DiagnosticsPopup(PopupBox):
+    """
+    Live query profile of the database, slowest total time first
+    """
+
+    def __init__(self, root, db: DB):
+        super().__init__(root, "Diagnostics", 0.7, 0.6)
+        self.db = db
+
+        self.view = TableView(self)
+        self.view.pack(fill="both", expand=True)
+
+        buttons = ctk.CTkFrame(self)
+        buttons.pack(fill="x", padx=10, pady=5)
+        ctk.CTkButton(buttons, text="Reset", command=self.__reset).pack(side="left", padx=5)
+        ctk.CTkButton(buttons, text="Save JSON", command=self.__save).pack(side="left", padx=5)
+        self.status = ctk.CTkLabel(buttons, text="")
+        self.status.pack(side="left", fill="x", padx=10)
+
+        self.refresh_after = None
+        self.refresh()
+
+    def refresh(self):
+        # The snapshot is a copy of a few counters, cheap enough for the Tk thread
+        snapshot = self.db.profiler.snapshot()
+        headings = ["query", "calls", "rows", "total_ms", "mean_ms", "p50_ms", "p95_ms", "max_ms"]
+        selected = self.view.get_selected_item()[0] if self.view.selection() else None
+
+        self.view.delete_all()
+        self.view.add_headings(headings)
+        for name, stats in snapshot["queries"].items():
+            item = self.view.add_row([name] + [self.__format(stats[col]) for col in headings[1:]])
+            if name == selected:
+                self.view.selection_set(item)
+
+        slow = f", slower than {snapshot['slow_ms']:g} ms: {snapshot['slow_queries']}" if snapshot["slow_ms"] else ""
+        self.status.configure(text=f"{len(snapshot['queries'])} queries{slow}")
+        self.refresh_after = self.after(DIAGNOSTICS_REFRESH_MS, self.refresh)
+
+    def __format(self, value):
+        return f"{value:,.2f}" if isinstance(value, float) else value
+
+    def __reset(self):
+        self.db.profiler.reset()
+
+    def __save(self):
+        path = filedialog.asksaveasfilename(
+            parent=self, defaultextension=".json", filetypes=[("JSON", "*.json")], initialfile="pwms_profile.json")
+        if path:
+            self.db.profiler.dump(path)
+
+    def run(self):
+        self.wait_window()
+        if self.refresh_after is not None:
+            self.after_cancel(self.refresh_after)
+
+
 class TableView(ttk.Treeview):
+    """
+    Treeview for table data
 
-    def __init__(self, root):
-        super().__init__(root, padding=(10, 10), show="headings", selectmode="browse")
+    With load_pages the view runs in windowed mode: rows are fetched page by
+    page through the given fetch function and at most max_pages pages are
+    kept in the widget, pages are loaded and dropped as the user scrolls.
+    Given a QueryDispatcher the pages are fetched on its workers, otherwise
+    on the Tk thread.
+    """
+
+    def __init__(self, root, max_pages: int = 3, queries: QueryDispatcher | None = None):
+        super().__init__(root, padding=(10, 10), show="headings", selectmode="extended")
 
         self.tag_configure("odd", background="#212224")
         self.tag_configure("even", background="#2f3033")
 
+        self.max_pages = max_pages
+        self.queries = queries
+        self.first_index = 0
+        self.next_index = 0
+
+        self.fetch_page = None
+        self.pages: list[list[str]] = []
+        self.at_start = True
+        self.at_end = True
+        self.loading = False
+        self.configure(yscrollcommand=self.__on_scroll)
+
     def delete_all(self):
+        if self.queries is not None:
+            self.queries.cancel("page")
         self.delete(*self.get_children())
+        self.first_index = 0
+        self.next_index = 0
+        self.fetch_page = None
+        self.pages.clear()
+        self.loading = False
 
     def add_headings(self, headings: list[str]):
         self["columns"] = headings
@@ -231,9 +415,113 @@ class TableView(ttk.Treeview):
             self.heading(col, text=col)
             self.column(col, anchor="center", width=100)
 
-    def add_row(self, row: list):
-        self.insert("", tk.END, values=row, tags="odd" if len(
-            self.get_children()) % 2 else "even")
+    def add_row(self, row: list) -> str:
+        item = self.insert("", tk.END, values=row, tags="odd" if self.next_index % 2 else "even")
+        self.next_index += 1
+        return item
+
+    def load_pages(self, fetch_page, start_after: int | None = None,
+                   page: tuple[list[str], list[tuple]] | None = None):
+        """
+        Switch to windowed mode
+        fetch_page(after_id=None, before_id=None) must return the next page as (columns, rows),
+        page is the already fetched first page if given
+        """
+        if page is None:
+            self.loading = True
+            self.__fetch(lambda page: self.load_pages(fetch_page, start_after, page),
+                         fetch_page, after_id=start_after)
+            return
+
+        self.delete_all()
+        self.fetch_page = fetch_page
+        columns, rows = page
+        self.add_headings(columns)
+        self.at_start = start_after is None
+        self.at_end = False
+        self.__append_page(rows)
+
+    def __append_page(self, rows: list[tuple]):
+        if not rows:
+            self.at_end = True
+            return
+
+        self.pages.append([self.add_row(row) for row in rows])
+
+        if len(self.pages) > self.max_pages:
+            dropped = self.pages.pop(0)
+            self.delete(*dropped)
+            self.first_index += len(dropped)
+            self.at_start = False
+
+    def __prepend_page(self, rows: list[tuple]):
+        if not rows:
+            self.at_start = True
+            return
+
+        self.first_index -= len(rows)
+        page = [
+            self.insert("", pos, values=row, tags="odd" if (self.first_index + pos) % 2 else "even")
+            for pos, row in enumerate(rows)
+        ]
+        self.pages.insert(0, page)
+
+        if len(self.pages) > self.max_pages:
+            dropped = self.pages.pop()
+            self.delete(*dropped)
+            self.next_index -= len(dropped)
+            self.at_end = False
+
+    def __on_scroll(self, first: str, last: str):
+        if self.fetch_page is None or self.loading or not self.pages:
+            return
+
+        if float(last) > 0.9 and not self.at_end:
+            self.loading = True
+            self.after_idle(self.__load_next)
+        elif float(first) < 0.1 and not self.at_start:
+            self.loading = True
+            self.after_idle(self.__load_previous)
+
+    def __fetch(self, on_done, fetch_page, **position):
+        """
+        Run fetch_page(**position) and hand its page to on_done on the Tk thread
+        """
+        def done(page):
+            self.loading = False
+            on_done(page)
+
+        def failed(err):
+            self.loading = False
+            self.winfo_toplevel().report_callback_exception(type(err), err, err.__traceback__)
+
+        if self.queries is None:
+            try:
+                page = fetch_page(**position)
+            finally:
+                self.loading = False
+            on_done(page)
+        else:
+            self.queries.submit("page", lambda: fetch_page(**position), on_done=done, on_error=failed)
+
+    def __load_next(self):
+        if not self.pages:
+            # The view was cleared after this load was scheduled
+            return
+        last_id = self.item(self.pages[-1][-1], "values")[0]
+        self.__fetch(lambda page: self.__append_page(page[1]), self.fetch_page, after_id=int(last_id))
+
+    def __load_previous(self):
+        if not self.pages:
+            return
+        top = self.pages[0][0]
+        first_id = self.item(top, "values")[0]
+
+        def prepend(page):
+            self.__prepend_page(page[1])
+            self.see(top)
+
+        self.__fetch(prepend, self.fetch_page, before_id=int(first_id))
 
     def select_by_id(self, id: int):
         for item_id in self.get_children():
@@ -242,11 +530,29 @@ class TableView(ttk.Treeview):
                 self.selection_set(item_id)
                 self.focus(item_id)
                 self.see(item_id)
-                break
+                return
+
+        # Not in the loaded window, start a new window at the row
+        if self.fetch_page is not None:
+            fetch_page = self.fetch_page
+
+            def show(page):
+                self.load_pages(fetch_page, id - 1, page)
+                children = self.get_children()
+                if children and int(self.item(children[0], "values")[0]) == id:
+                    self.selection_set(children[0])
+                    self.focus(children[0])
+                    self.see(children[0])
+
+            self.loading = True
+            self.__fetch(show, fetch_page, after_id=id - 1)
 
     def get_selected_item(self):
         return self.item(self.selection()[0], "values")
 
+    def get_selected_items(self) -> list:
+        return [self.item(item_id, "values") for item_id in self.selection()]
+
 
 class PWSM(ctk.CTk):
 
@@ -256,6 +562,7 @@ class PWSM(ctk.CTk):
         self.report_callback_exception = self.__handle_exception
 
         self.db = db
+        self.routes = self.__init_routes()
 
         width = self.winfo_screenwidth()
         height = self.winfo_screenheight()
@@ -264,7 +571,6 @@ class PWSM(ctk.CTk):
         self.title("Ports and Warehouses Management System")
 
         self.loader = MapDownloader()
-        self.loader.download_world()
 
         self.bind("<Control-q>", lambda *_: (self.quit(), self.destroy()))
         self.bind("<Control-Q>", lambda *_: (self.quit(), self.destroy()))
@@ -274,8 +580,22 @@ class PWSM(ctk.CTk):
 
         self.__init_mapview()
         self.__init_controls()
+        # Before the table view, which fetches its pages through it
+        self.queries = QueryDispatcher(self, on_busy=self.__set_busy)
         self.__init_table_view()
 
+        self.queries.submit("sites", fetch_sites, self.db, on_done=self.__on_sites_loaded)
+
+    def __init_routes(self):
+        # Sea distances and ETAs need numpy, without it Shippings are shown as stored
+        try:
+            from .routing import RouteEngine
+        except ImportError as e:
+            if e.name != "numpy":
+                raise
+            return None
+        return RouteEngine(self.db)
+
     def __set_styles(self):
         style = ttk.Style(self)
         style.theme_use('default')
@@ -324,7 +644,7 @@ class PWSM(ctk.CTk):
         self.map.add_right_click_menu_command(
             "Add Warehouse", self.__map_add_warehouse, pass_coords=True)
 
-        self.__load_mapmarkers()
+        self.markers = MarkerLayer(self.map, self.__on_click_mark)
 
     def __init_controls(self):
         self.control_frame = ctk.CTkFrame(self.base_frame)
@@ -335,6 +655,7 @@ class PWSM(ctk.CTk):
         self.control_frame.columnconfigure(0, weight=1)
         self.control_frame.columnconfigure(1, weight=1)
         self.control_frame.columnconfigure(2, weight=1)
+        self.control_frame.columnconfigure(3, weight=1)
 
         self.add_btr = ctk.CTkButton(
             self.control_frame, text="Add Data", command=self.__on_click_add_item)
@@ -348,10 +669,74 @@ class PWSM(ctk.CTk):
             self.control_frame, text="View Info", command=self.__on_click_view_info, state="disabled")
         self.info_btr.grid(row=0, column=2, padx=10, sticky="ew")
 
+        self.fleet_btr = ctk.CTkButton(
+            self.control_frame, text="Fleet Overview", command=self.__on_click_fleet)
+        self.fleet_btr.grid(row=0, column=3, padx=10, sticky="ew")
+
+        self.tile_label = ctk.CTkLabel(self.control_frame, text="")
+        self.tile_label.grid(row=2, column=0, padx=10, sticky="w")
+        self.tile_progress = ctk.CTkProgressBar(self.control_frame)
+        self.tile_progress.set(0)
+        self.tile_progress.grid(row=2, column=1, columnspan=3, padx=10, pady=5, sticky="ew")
+
+        self.busy_bar = ctk.CTkProgressBar(self.control_frame, mode="indeterminate")
+        self.busy_bar.grid(row=3, column=0, columnspan=4, padx=10, pady=5, sticky="ew")
+        self.busy_bar.grid_remove()
+
+        self.status_label = ctk.CTkLabel(self.control_frame, text="")
+        self.status_label.grid(row=4, column=0, columnspan=3, padx=10, sticky="w")
+
+        self.diagnostics_btr = ctk.CTkButton(
+            self.control_frame, text="Diagnostics", command=self.__on_click_diagnostics)
+        self.diagnostics_btr.grid(row=4, column=3, padx=10, pady=5, sticky="ew")
+
+    def __set_busy(self, busy: bool):
+        if busy:
+            self.busy_bar.grid()
+            self.busy_bar.start()
+        else:
+            self.busy_bar.stop()
+            self.busy_bar.grid_remove()
+
+    def __on_sites_loaded(self, sites: dict[str, list[tuple]]):
+        self.markers.load(sites)
+        self.__start_tile_download(sites)
+
+    def __start_tile_download(self, sites: dict[str, list[tuple]]):
+        # World overview plus closer zoom levels around our ports and warehouses
+        positions = [
+            (latitude, longitude)
+            for rows in sites.values()
+            for _, _, latitude, longitude in rows
+        ]
+        tiles = self.loader.world_tiles() + self.loader.tiles_around(positions, 7, 10)
+        self.loader.start(tiles)
+        self.__update_tile_progress()
+
+    def __update_tile_progress(self):
+        done, total = self.loader.progress()
+        if self.loader.is_running():
+            self.tile_label.configure(text=f"Downloading map tiles {done}/{total}")
+            self.tile_progress.set(done / total if total else 0)
+            self.after(500, self.__update_tile_progress)
+        else:
+            self.tile_label.grid_remove()
+            self.tile_progress.grid_remove()
+
     def __init_table_view(self):
         self.table_frame = ctk.CTkFrame(self.control_frame)
         self.table_frame.grid(
-            row=1, column=0, sticky="nsew", columnspan=3, pady=10)
+            row=1, column=0, sticky="nsew", columnspan=4, pady=10)
+
+        # Type to search ports, warehouses and items, Enter or a pick from the list jumps to the row
+        self.search_box = ttk.Combobox(self.table_frame, width=100)
+        self.search_box.bind("<KeyRelease>", self.__on_search_key)
+        self.search_box.bind("<Return>", lambda *_: self.__jump_to_result(0))
+        self.search_box.bind("<<ComboboxSelected>>",
+                             lambda *_: self.__jump_to_result(self.search_box.current()))
+        self.search_box.pack(fill="x", padx=10, pady=(0, 5))
+        self.search_results = []
+        self.search_after = None
 
         self.table_opt = ttk.Combobox(
             self.table_frame, width=100, values=Tables.as_list(), state="readonly")
@@ -360,31 +745,64 @@ class PWSM(ctk.CTk):
                             lambda *_: self.__display_table(Tables.get(self.table_opt.get())))
         self.table_opt.pack(fill="x", padx=10)
 
-        self.table_view = TableView(self.table_frame)
+        self.table_view = TableView(self.table_frame, queries=self.queries)
         self.table_view.pack(fill="both", expand=True)
         self.table_view.bind("<<TreeviewSelect>>", self.__on_table_select)
 
         self.table_info = None
 
+    def __on_search_key(self, event):
+        if event.keysym in ("Return", "Up", "Down", "Escape"):
+            return
+        if self.search_after is not None:
+            self.after_cancel(self.search_after)
+        self.search_after = self.after(SEARCH_DELAY_MS, self.__search)
+
+    def __search(self):
+        self.search_after = None
+        text = self.search_box.get().strip()
+        if not text:
+            self.queries.cancel("search")
+            self.__show_search_results([])
+            return
+        self.queries.submit("search", self.db.search, text, on_done=self.__show_search_results)
+
+    def __show_search_results(self, results: list[dict]):
+        self.search_results = results
+        self.search_box["values"] = [
+            f"{row['name']}{' (' + row['detail'] + ')' if row['detail'] else ''} - {row['table']} {row['id']}"
+            for row in results]
+
+    def __jump_to_result(self, index: int):
+        if not 0 <= index < len(self.search_results):
+            return
+        result = self.search_results[index]
+        self.__display_table(result["table"], result["id"])
+        if result["table"] in (Tables.PORTS, Tables.WAREHOUSES):
+            # Selecting the row centers the map on its marker
+            self.map.set_zoom(SEARCH_ZOOM)
+
     def __add_item(self, table: str, values: dict | None):
         if not values:
             return
 
         if table == Tables.PORTS:
-            call_with_types(self.db.insert_port_data, values)
+            id = call_with_types(self.db.insert_port_data, values)
         elif table == Tables.WAREHOUSES:
-            call_with_types(self.db.insert_warehouse_data, values)
+            id = call_with_types(self.db.insert_warehouse_data, values)
         elif table == Tables.ITEMS:
-            call_with_types(self.db.insert_item_data, values)
+            id = call_with_types(self.db.insert_item_data, values)
         elif table == Tables.INVENTORY:
-            call_with_types(self.db.insert_inventory_data, values)
+            id = call_with_types(self.db.insert_inventory_data, values)
         elif table == Tables.SHIPPINGS:
-            call_with_types(self.db.insert_shippings_data, values)
+            id = call_with_types(self.db.insert_shippings_data, values)
         else:
             raise RuntimeError(f"insert into for {table} is not implemented")
 
         self.__display_table(table)
-        self.__load_mapmarkers()
+        self.__update_marker(table, id)
+        if table == Tables.PORTS and self.routes is not None:
+            self.queries.submit(None, self.routes.sync)
 
     def __on_click_add_item(self):
         self.add_popup = AddPopup(self, self.db)
@@ -392,11 +810,24 @@ class PWSM(ctk.CTk):
         self.__add_item(table, values)
 
     def __on_click_remove_item(self):
-        values = self.table_view.get_selected_item()
-        self.db.delete_row(self.current_table, int(values[0]))
+        ids = [int(values[0]) for values in self.table_view.get_selected_items()]
+        if len(ids) == 1:
+            self.db.delete_row(self.current_table, ids[0])
+        else:
+            result = self.db.delete_rows(self.current_table, ids)
+            self.status_label.configure(text=f"Deleted {result['rows']} rows in {result['seconds']:.3f}s")
+        for id in ids:
+            self.markers.remove(self.current_table, id)
+        if self.current_table == Tables.PORTS and self.routes is not None:
+            self.queries.submit(None, self.routes.sync)
 
         self.__display_table(self.current_table)
-        self.__load_mapmarkers()
+
+    def __on_click_fleet(self):
+        FleetPopup(self, self.db, self.queries, self.__display_table).run()
+
+    def __on_click_diagnostics(self):
+        DiagnosticsPopup(self, self.db).run()
 
     def __on_click_view_info(self):
         if "Info" in self.current_table:
@@ -405,24 +836,25 @@ class PWSM(ctk.CTk):
             return
 
         values = self.table_view.get_selected_item()
-        id = int(values[0])
-
-        if self.current_table == Tables.PORTS:
-            rel_values = self.db.get_port_relations(id)
-            info_values = self.db.get_port_info(id)
-        elif self.current_table == Tables.WAREHOUSES:
-            rel_values = self.db.get_warehouse_relations(id)
-            info_values = self.db.get_warehouse_info(id)
-        elif self.current_table == Tables.ITEMS:
-            rel_values = self.db.get_item_relations(id)
-            info_values = self.db.get_item_info(id)
-        elif self.current_table == Tables.INVENTORY:
-            rel_values = self.db.get_inventory_relations(id)
-            info_values = self.db.get_inventory_info(id)
-        elif self.current_table == Tables.SHIPPINGS:
-            rel_values = None
-            info_values = self.db.get_shipping_info(id)
-        else:
+        self.queries.submit("info", self.__fetch_info, self.current_table, int(values[0]),
+                            on_done=self.__show_info)
+
+    def __fetch_info(self, table: str, id: int):
+        if table == Tables.PORTS:
+            return self.db.get_port_relations(id), self.db.get_port_info(id)
+        elif table == Tables.WAREHOUSES:
+            return self.db.get_warehouse_relations(id), self.db.get_warehouse_info(id)
+        elif table == Tables.ITEMS:
+            return self.db.get_item_relations(id), self.db.get_item_info(id)
+        elif table == Tables.INVENTORY:
+            return self.db.get_inventory_relations(id), self.db.get_inventory_info(id)
+        elif table == Tables.SHIPPINGS:
+            return self.db.get_shipping_events(id), self.db.get_shipping_info(id)
+        return None, None
+
+    def __show_info(self, values):
+        rel_values, info_values = values
+        if info_values is None:
             return
 
         if not self.table_info is None:
@@ -453,6 +885,10 @@ class PWSM(ctk.CTk):
             self.info_btr.configure(text=f"Back", state="normal")
             self.remove_btr.configure(state="disabled")
 
+        elif len(self.table_view.selection()) > 1:
+            self.info_btr.configure(text="View Info", state="disabled")
+            self.remove_btr.configure(state="normal")
+
         elif self.table_view.selection():
             self.info_btr.configure(
                 text=f"{self.current_table} Info", state="normal")
@@ -463,28 +899,39 @@ class PWSM(ctk.CTk):
                 self.map.set_position(float(values[2]), float(values[3]))
 
             if self.current_table == Tables.SHIPPINGS:
-                id = self.table_view.get_selected_item()[0]
-                loc_data = self.db.get_shipping_locations(int(id))
-                self.map.set_path(loc_data)
+                id, from_port, into_port = self.table_view.get_selected_item()[:3]
+                if "None" not in (from_port, into_port):
+                    self.queries.submit("selection", self.__shipping_path, int(id), int(from_port), int(into_port),
+                                        on_done=self.__show_path)
         else:
             self.remove_btr.configure(state="disabled")
             self.info_btr.configure(text="View Info", state="disabled")
 
-    def __on_click_port_mark(self, event, id):
-        self.__display_table(Tables.PORTS)
-        self.table_view.select_by_id(id)
+    def __shipping_path(self, shipping_id: int, from_port: int, into_port: int) -> list[tuple[float, float]]:
+        if self.routes is not None:
+            route = self.routes.route(from_port, into_port)
+            if route is not None:
+                return route["path"]
+        # No sea lanes without numpy, or no route between the ports: a straight line
+        return self.db.get_shipping_locations(shipping_id)
 
-    def __on_click_warehouse_mark(self, event, id):
-        self.__display_table(Tables.WAREHOUSES)
-        self.table_view.select_by_id(id)
+    def __show_path(self, path: list[tuple[float, float]]):
+        if len(path) > 1:
+            self.map.set_path(path)
+
+    def __on_click_mark(self, table, id):
+        self.__display_table(table, id)
 
     def __map_add_item(self, table, coords):
         popup = AddPopup(self, self.db, table)
+        nearest_port = self.db.nearest_port(*coords) if table == Tables.WAREHOUSES else None
         for name, entry in popup.row_entries:
             if name == "latitude":
                 entry.insert(0, coords[0])
             elif name == "longitude":
                 entry.insert(0, coords[1])
+            elif name == "port_id" and nearest_port is not None:
+                entry.insert(0, nearest_port["id"])
         table, values = popup.run()
         self.__add_item(table, values)
 
@@ -494,33 +941,20 @@ class PWSM(ctk.CTk):
     def __map_add_warehouse(self, coords):
         self.__map_add_item(Tables.WAREHOUSES, coords)
 
-    def __load_mapmarkers(self):
-        self.map.delete_all_marker()
-
-        data = self.db.get_table_data_all(Tables.PORTS)
-        for row in data:
-            if row["port_id"] is None:
-                return
-
-            id = row["port_id"]
-            self.map.set_marker(
-                row["latitude"], row["longitude"], text=row["name"],
-                command=lambda x, id=id: self.__on_click_port_mark(x, id))
-
-        data = self.db.get_table_data_all(Tables.WAREHOUSES)
-        for row in data:
-            if row["warehouse_id"] is None:
-                return
-
-            id = row["warehouse_id"]
-            self.map.set_marker(
-                row["latitude"], row["longitude"], text=row["name"],
-                command=lambda x, id=id: self.__on_click_warehouse_mark(x, id),
-                marker_color_circle="darkblue",
-                marker_color_outside="blue"
-            )
+    def __update_marker(self, table: str, id: int):
+        if table == Tables.PORTS:
+            fetch = self.db.get_port_data
+        elif table == Tables.WAREHOUSES:
+            fetch = self.db.get_warehouse_data
+        else:
+            return
+        self.queries.submit(
+            None, fetch, id,
+            on_done=lambda row: self.markers.add(table, id, row["latitude"], row["longitude"], row["name"]))
 
-    def __display_table(self, table_name):
+    def __display_table(self, table_name, select_id: int | None = None):
+        self.queries.cancel("info")
+        self.queries.cancel("selection")
         self.remove_btr.configure(state="disabled")
         self.info_btr.configure(text="View Info", state="disabled")
 
@@ -532,9 +966,21 @@ class PWSM(ctk.CTk):
 
         self.table_opt.set(Tables.rget(table_name))
         self.table_opt.selection_clear()
-
-        port_data = self.db.get_table_data_all(table_name)
-        self.table_view.add_headings(list(port_data[0].keys()))
-
-        for data in port_data:
-            self.table_view.add_row(list(data.values()))
+        # Headings right away from the schema catalog, the first page replaces them when it arrives
+        self.table_view.add_headings(self.db.get_column_names(table_name))
+
+        def fetch_page(after_id=None, before_id=None):
+            page = self.db.get_table_page_rows(table_name, after_id, before_id)
+            if table_name == Tables.SHIPPINGS and self.routes is not None:
+                # Sea distance and sailing time of the whole page in one go
+                return self.routes.annotate(*page)
+            return page
+
+        def show(page):
+            self.table_view.load_pages(fetch_page, start_after, page)
+            if select_id is not None:
+                self.table_view.select_by_id(select_id)
+
+        # Open the window at the selected row
+        start_after = select_id - 1 if select_id is not None else None
+        self.queries.submit("table", fetch_page, start_after, on_done=show)
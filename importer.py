@@ -0,0 +1,125 @@
+import csv
+import time
+from itertools import islice
+from pathlib import Path
+
+from .db import DB, Tables
+
+DATA_DIR = Path(__file__).parent
+
+# Tables are imported in this order so every foreign key can be resolved
+IMPORT_ORDER = [Tables.PORTS, Tables.WAREHOUSES,
+                Tables.ITEMS, Tables.INVENTORY, Tables.SHIPPINGS]
+
+CSV_FILES = {
+    Tables.PORTS: "ports.csv",
+    Tables.WAREHOUSES: "warehouses.csv",
+    Tables.ITEMS: "items.csv",
+    Tables.INVENTORY: "inventory.csv",
+    Tables.SHIPPINGS: "shippings.csv",
+}
+
+BATCH_SIZE = 50_000
+# Keep IN (...) lists well below SQLITE_MAX_VARIABLE_NUMBER
+LOOKUP_CHUNK = 500
+
+
+class CSVImporter:
+    """
+    Streams CSV files shaped like the bundled ports.csv, warehouses.csv,
+    items.csv and inventory.csv into the database.
+
+    Every file is read in chunks of batch_size rows, the foreign keys of a
+    chunk are resolved with indexed lookups and the chunk is written with a
+    single executemany inside one transaction.
+    """
+
+    def __init__(self, db: DB, batch_size: int = BATCH_SIZE, strict: bool = False, report=print):
+        self.db = db
+        self.batch_size = batch_size
+        self.strict = strict
+        self.report = report
+
+    def import_dir(self, directory: str | Path = DATA_DIR) -> dict[str, dict]:
+        """
+        Import every known CSV file found in directory in dependency order
+        Returns the statistics of import_file keyed by table name
+        """
+        directory = Path(directory)
+        stats = {}
+        for table in IMPORT_ORDER:
+            path = directory / CSV_FILES[table]
+            if path.is_file():
+                stats[table] = self.import_file(table, path)
+        return stats
+
+    def import_file(self, table_name: str, path: str | Path) -> dict:
+        start = time.perf_counter()
+        rows = rejected = 0
+
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            columns = [c.strip() for c in next(reader)]
+            query = self.__insert_query(table_name, columns)
+            fk_positions = [
+                (columns.index(col), ref)
+                for col, ref in self.db.get_schema(table_name).foreign_keys.items()
+                if col in columns
+            ]
+
+            while batch := list(islice(reader, self.batch_size)):
+                batch = [[v if v != "" else None for v in row] for row in batch]
+                valid = self.__check_foreign_keys(table_name, batch, fk_positions)
+                rejected += len(batch) - len(valid)
+
+                with self.db.db:
+                    self.db.cursor.executemany(query, valid)
+                rows += len(valid)
+
+        self.db.clear_cache()
+        elapsed = time.perf_counter() - start
+        stats = {
+            "rows": rows,
+            "rejected": rejected,
+            "seconds": elapsed,
+            "rows_per_sec": rows / elapsed if elapsed else float(rows),
+        }
+        if self.report:
+            self.report(f"IMPORTED: {table_name} {rows} rows ({rejected} rejected) "
+                        f"in {elapsed:.2f}s, {stats['rows_per_sec']:.0f} rows/s")
+        return stats
+
+    def __insert_query(self, table_name: str, columns: list[str]) -> str:
+        names = ", ".join(columns)
+        marks = ", ".join("?" * len(columns))
+        return f"INSERT INTO {table_name} ({names}) VALUES ({marks})"
+
+    def __check_foreign_keys(self, table_name: str, batch: list[list], fk_positions: list) -> list[list]:
+        if not fk_positions:
+            return batch
+
+        # Resolve all distinct references of the batch at once
+        existing = {}
+        for pos, ref in fk_positions:
+            wanted = {int(row[pos]) for row in batch if row[pos] is not None}
+            existing.setdefault(ref, set()).update(self.__existing_ids(ref, wanted))
+
+        valid = []
+        for row in batch:
+            if all(row[pos] is None or int(row[pos]) in existing[ref] for pos, ref in fk_positions):
+                valid.append(row)
+            elif self.strict:
+                raise ValueError(f"{table_name}: unresolved foreign key in row {row}")
+        return valid
+
+    def __existing_ids(self, ref: tuple[str, str], ids: set[int]) -> set[int]:
+        table, column = ref
+        ids = list(ids)
+        found = set()
+        for i in range(0, len(ids), LOOKUP_CHUNK):
+            chunk = ids[i:i + LOOKUP_CHUNK]
+            marks = ", ".join("?" * len(chunk))
+            rows = self.db.db.execute(
+                f"SELECT {column} FROM {table} WHERE {column} IN ({marks})", chunk).fetchall()
+            found.update(r[column] for r in rows)
+        return found
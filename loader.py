@@ -1,17 +1,185 @@
+import math
+import sqlite3 as sql
+import sys
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
 import tkintermapview as tmv
 from pathlib import Path
 
 MAP_DB_PATH = Path(__file__).parent / "database" / "map.db"
+TILE_SERVER = "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"  # OpenStreetMap tiles
+
+WORLD_TOP_LEFT = (85.05112878, -180.0)
+WORLD_BOTTOM_RIGHT = (-85.05112878, 180.0)
+
+# Tiles are written to map.db in batches of this size
+COMMIT_EVERY = 100
+# HTTP statuses of tiles the server does not have, they are not asked for again
+PERMANENT_ERRORS = (404, 410)
+
 
 class MapDownloader(tmv.OfflineLoader):
+    """
+    Fills map.db with tiles for offline use
+
+    Tiles already in the database are skipped, so an interrupted download
+    resumes where it stopped. Tiles the server answered with a permanent
+    error are kept in failed_tiles and skipped as well. start runs the
+    download on a background thread with a pool of workers, progress can be
+    read with progress().
+    """
 
-    def __init__(self) -> None:
-        if not MAP_DB_PATH.parent.is_dir():
-            MAP_DB_PATH.parent.mkdir(parents=True)
+    def __init__(self, path: Path = MAP_DB_PATH, tile_server: str = TILE_SERVER, workers: int = 8) -> None:
+        if not Path(path).parent.is_dir():
+            Path(path).parent.mkdir(parents=True)
         super().__init__(
-            path=MAP_DB_PATH,
-            tile_server="https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"  # OpenStreetMap tiles
+            path=path,
+            tile_server=tile_server
         )
+        self.workers = workers
+
+        self.done = 0
+        self.failed = 0
+        self.total = 0
+        self.thread: threading.Thread | None = None
+        self.stop_event = threading.Event()
+
+        self.__init_db()
+
+    def __init_db(self):
+        # Same layout as tkintermapview.OfflineLoader so TkinterMapView can read the tiles
+        db = sql.connect(self.db_path)
+        db.execute("""CREATE TABLE IF NOT EXISTS server (
+                            url VARCHAR(300) PRIMARY KEY NOT NULL,
+                            max_zoom INTEGER NOT NULL);""")
+        db.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                            zoom INTEGER NOT NULL,
+                            x INTEGER NOT NULL,
+                            y INTEGER NOT NULL,
+                            server VARCHAR(300) NOT NULL,
+                            tile_image BLOB NOT NULL,
+                            CONSTRAINT fk_server FOREIGN KEY (server) REFERENCES server (url),
+                            CONSTRAINT pk_tiles PRIMARY KEY (zoom, x, y, server));""")
+        db.execute("""CREATE TABLE IF NOT EXISTS failed_tiles (
+                            zoom INTEGER NOT NULL,
+                            x INTEGER NOT NULL,
+                            y INTEGER NOT NULL,
+                            server VARCHAR(300) NOT NULL,
+                            status INTEGER NOT NULL,
+                            PRIMARY KEY (zoom, x, y, server));""")
+        db.execute("INSERT OR IGNORE INTO server (url, max_zoom) VALUES (?, ?)",
+                   (self.tile_server, self.max_zoom))
+        db.commit()
+        db.close()
 
     def download_world(self):
-        self.save_offline_tiles((85.05112878, -180.0), (-85.05112878, 180.0), 3, 6)
+        self.fetch_tiles(self.world_tiles())
+
+    def world_tiles(self, zoom_a: int = 3, zoom_b: int = 6) -> list[tuple[int, int, int]]:
+        return self.tiles_in_box(WORLD_TOP_LEFT, WORLD_BOTTOM_RIGHT, zoom_a, zoom_b)
+
+    def tiles_in_box(self, position_a: tuple[float, float], position_b: tuple[float, float],
+                     zoom_a: int, zoom_b: int) -> list[tuple[int, int, int]]:
+        """
+        (zoom, x, y) of every tile between the top left position_a and
+        the bottom right position_b for the zoom levels zoom_a to zoom_b
+        """
+        tiles = []
+        for zoom in range(zoom_a, zoom_b + 1):
+            last = 2 ** zoom - 1
+            x_a, y_a = tmv.decimal_to_osm(*position_a, zoom)
+            x_b, y_b = tmv.decimal_to_osm(*position_b, zoom)
+            for x in range(max(math.floor(x_a), 0), min(math.floor(x_b), last) + 1):
+                for y in range(max(math.floor(y_a), 0), min(math.floor(y_b), last) + 1):
+                    tiles.append((zoom, x, y))
+        return tiles
+
+    def tiles_around(self, positions: list[tuple[float, float]], zoom_a: int, zoom_b: int,
+                     margin: float = 0.5) -> list[tuple[int, int, int]]:
+        """
+        Tiles of a box of +- margin degrees around every position, used to
+        prefetch the higher zoom levels only where ports and warehouses are
+        """
+        tiles = set()
+        for lat, lon in positions:
+            top_left = (min(lat + margin, WORLD_TOP_LEFT[0]), max(lon - margin, WORLD_TOP_LEFT[1]))
+            bottom_right = (max(lat - margin, WORLD_BOTTOM_RIGHT[0]), min(lon + margin, WORLD_BOTTOM_RIGHT[1]))
+            tiles.update(self.tiles_in_box(top_left, bottom_right, zoom_a, zoom_b))
+        return sorted(tiles)
+
+    def missing_tiles(self, tiles: list[tuple[int, int, int]]) -> list[tuple[int, int, int]]:
+        db = sql.connect(self.db_path)
+        stored = set(db.execute("SELECT zoom, x, y FROM tiles WHERE server = ?", (self.tile_server,)))
+        stored.update(db.execute("SELECT zoom, x, y FROM failed_tiles WHERE server = ?", (self.tile_server,)))
+        db.close()
+        return [t for t in tiles if t not in stored]
+
+    def fetch_tiles(self, tiles: list[tuple[int, int, int]]):
+        """
+        Download every tile not yet in the database, blocks until done
+        """
+        tiles = self.missing_tiles(tiles)
+        self.done = self.failed = 0
+        self.total = len(tiles)
+        self.stop_event.clear()
+
+        db = sql.connect(self.db_path, timeout=30)
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = pool.map(self.__download, tiles)
+            while not self.stop_event.is_set() and (batch := list(islice(results, COMMIT_EVERY))):
+                rows = [r for r in batch if r is not None and isinstance(r[4], bytes)]
+                gone = [r for r in batch if r is not None and isinstance(r[4], int)]
+                db.executemany("INSERT OR IGNORE INTO tiles (zoom, x, y, server, tile_image) VALUES (?, ?, ?, ?, ?)",
+                               rows)
+                db.executemany("INSERT OR IGNORE INTO failed_tiles (zoom, x, y, server, status) VALUES (?, ?, ?, ?, ?)",
+                               gone)
+                db.commit()
+                self.done += len(batch)
+                self.failed += len(batch) - len(rows)
+        db.close()
+
+    def start(self, tiles: list[tuple[int, int, int]]) -> threading.Thread:
+        """
+        Run fetch_tiles on a background thread
+        """
+        self.stop()
+        self.thread = threading.Thread(target=self.fetch_tiles, args=(tiles,), daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.stop_event.set()
+            self.thread.join()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def progress(self) -> tuple[int, int]:
+        return self.done, self.total
+
+    def __download(self, tile: tuple[int, int, int]):
+        """
+        (zoom, x, y, server, image), the HTTP status in place of the image
+        for a permanent error, None for an error worth another try
+        """
+        if self.stop_event.is_set():
+            return None
+
+        zoom, x, y = tile
+        url = self.tile_server.replace("{x}", str(x)).replace("{y}", str(y)).replace("{z}", str(zoom))
+        request = urllib.request.Request(url, headers={"User-Agent": "TkinterMapView"})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return (zoom, x, y, self.tile_server, response.read())
+        except urllib.error.HTTPError as err:
+            err.close()
+            sys.stderr.write(f"{url}: {err}\n")
+            return (zoom, x, y, self.tile_server, err.code) if err.code in PERMANENT_ERRORS else None
+        except OSError as err:
+            sys.stderr.write(f"{url}: {err}\n")
+            return None
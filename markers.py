@@ -0,0 +1,249 @@
+import math
+
+import tkintermapview as tmv
+
+from .db import DB, PRIMARY_KEYS, Tables
+
+MARKER_STYLES = {
+    Tables.PORTS: {},
+    Tables.WAREHOUSES: {
+        "marker_color_circle": "darkblue",
+        "marker_color_outside": "blue",
+    },
+}
+CLUSTER_STYLE = {
+    "marker_color_circle": "white",
+    "marker_color_outside": "gray40",
+}
+
+ID_COLUMNS = {table: PRIMARY_KEYS[table] for table in (Tables.PORTS, Tables.WAREHOUSES)}
+
+# Sites are bucketed in a grid of CELLS_PER_TILE x CELLS_PER_TILE cells per map tile.
+# The grid is built for every zoom level up to GRID_ZOOM, deeper zoom levels reuse it.
+GRID_ZOOM = 10
+CELLS_PER_TILE = 2
+# Up to this zoom level sites sharing a cell are drawn as one cluster marker
+CLUSTER_MAX_ZOOM = 8
+# Markers are created for the viewport plus this fraction of its size on every side
+VIEW_MARGIN = 0.25
+POLL_MS = 150
+
+
+def fetch_sites(db: DB) -> dict[str, list[tuple]]:
+    """
+    (id, name, latitude, longitude) of all ports and warehouses with a position,
+    safe to run on a worker thread
+    """
+    sites = {}
+    for table, id_column in ID_COLUMNS.items():
+        _, sites[table] = db.select_rows(f"""
+            SELECT {id_column}, name, latitude, longitude FROM {table}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL""")
+    return sites
+
+
+class GridCell:
+    __slots__ = ("keys", "lat_sum", "lon_sum")
+
+    def __init__(self):
+        self.keys = set()
+        self.lat_sum = 0.0
+        self.lon_sum = 0.0
+
+    def center(self) -> tuple[float, float]:
+        return self.lat_sum / len(self.keys), self.lon_sum / len(self.keys)
+
+
+class MarkerLayer:
+    """
+    Draws the port and warehouse markers of the map
+
+    Sites are kept in a grid per zoom level, keyed by (table, id). Only the
+    markers inside the current viewport (plus a margin) exist on the map and
+    at low zoom levels sites sharing a grid cell are merged into one cluster
+    marker showing their count. On pan or zoom only the markers that enter
+    or leave the viewport are created or deleted.
+    """
+
+    def __init__(self, map: tmv.TkinterMapView, on_click):
+        """
+        on_click(table, id) is called when a site marker is clicked
+        """
+        self.map = map
+        self.on_click = on_click
+
+        self.sites: dict[tuple[str, int], tuple] = {}
+        self.grids: list[dict[tuple[int, int], GridCell]] = [{} for _ in range(GRID_ZOOM + 1)]
+        self.drawn: dict[tuple, object] = {}
+        self.view = None
+
+        self.map.after(POLL_MS, self.__poll)
+
+    #
+    # Site registry
+    #
+    def load(self, sites: dict[str, list[tuple]]):
+        """
+        Replace all sites with the rows from fetch_sites
+        """
+        self.clear()
+        for table, rows in sites.items():
+            for id, name, latitude, longitude in rows:
+                self.__insert(table, id, latitude, longitude, name)
+        self.refresh()
+
+    def clear(self):
+        for marker in self.drawn.values():
+            marker.delete()
+        self.drawn.clear()
+        self.sites.clear()
+        for grid in self.grids:
+            grid.clear()
+
+    def add(self, table: str, id: int, latitude: float, longitude: float, name: str):
+        """
+        Add a site or replace the position and name of one already shown
+        """
+        self.__discard((table, id))
+        self.__insert(table, id, latitude, longitude, name)
+        self.__invalidate((table, id))
+        self.refresh()
+
+    def remove(self, table: str, id: int):
+        if (table, id) in self.sites:
+            self.__invalidate((table, id))
+            self.__discard((table, id))
+            self.refresh()
+
+    def __insert(self, table: str, id: int, latitude: float, longitude: float, name: str):
+        x, y = tmv.decimal_to_osm(latitude, longitude, GRID_ZOOM)
+        self.sites[(table, id)] = (latitude, longitude, name, x, y)
+        for zoom, cell in self.__cells_of(x, y):
+            grid_cell = self.grids[zoom].setdefault(cell, GridCell())
+            grid_cell.keys.add((table, id))
+            grid_cell.lat_sum += latitude
+            grid_cell.lon_sum += longitude
+
+    def __discard(self, key: tuple[str, int]):
+        site = self.sites.pop(key, None)
+        if site is None:
+            return
+        latitude, longitude, _, x, y = site
+        for zoom, cell in self.__cells_of(x, y):
+            grid_cell = self.grids[zoom][cell]
+            grid_cell.keys.discard(key)
+            grid_cell.lat_sum -= latitude
+            grid_cell.lon_sum -= longitude
+            if not grid_cell.keys:
+                del self.grids[zoom][cell]
+
+    def __cells_of(self, x: float, y: float):
+        cx = math.floor(x * CELLS_PER_TILE)
+        cy = math.floor(y * CELLS_PER_TILE)
+        for zoom in range(GRID_ZOOM + 1):
+            shift = GRID_ZOOM - zoom
+            yield zoom, (cx >> shift, cy >> shift)
+
+    def __invalidate(self, key: tuple[str, int]):
+        # Drop the drawn marker showing this site so refresh draws it again
+        if marker := self.drawn.pop(key, None):
+            marker.delete()
+        if key in self.sites and self.view is not None:
+            zoom = self.view[0]
+            if zoom <= CLUSTER_MAX_ZOOM:
+                _, _, _, x, y = self.sites[key]
+                cell = dict(self.__cells_of(x, y))[zoom]
+                if marker := self.drawn.pop(("cluster", zoom, cell), None):
+                    marker.delete()
+
+    #
+    # Viewport
+    #
+    def __poll(self):
+        view = self.__current_view()
+        if view != self.view:
+            self.refresh()
+        self.map.after(POLL_MS, self.__poll)
+
+    def __current_view(self):
+        return (round(self.map.zoom), self.map.upper_left_tile_pos, self.map.lower_right_tile_pos)
+
+    def __visible_cells(self, zoom: int, upper_left, lower_right):
+        """
+        Cells of the grid level min(zoom, GRID_ZOOM) that overlap the viewport plus margin
+        """
+        level = min(zoom, GRID_ZOOM)
+        scale = CELLS_PER_TILE / 2 ** (zoom - level)
+        margin_x = (lower_right[0] - upper_left[0]) * VIEW_MARGIN
+        margin_y = (lower_right[1] - upper_left[1]) * VIEW_MARGIN
+        last = 2 ** level * CELLS_PER_TILE - 1
+
+        x_a = max(math.floor((upper_left[0] - margin_x) * scale), 0)
+        x_b = min(math.floor((lower_right[0] + margin_x) * scale), last)
+        y_a = max(math.floor((upper_left[1] - margin_y) * scale), 0)
+        y_b = min(math.floor((lower_right[1] + margin_y) * scale), last)
+
+        grid = self.grids[level]
+        if (x_b - x_a + 1) * (y_b - y_a + 1) > len(grid):
+            return [(cell, c) for cell, c in grid.items()
+                    if x_a <= cell[0] <= x_b and y_a <= cell[1] <= y_b]
+        return [((x, y), grid[(x, y)])
+                for x in range(x_a, x_b + 1) for y in range(y_a, y_b + 1) if (x, y) in grid]
+
+    def __wanted_units(self, zoom: int, upper_left, lower_right) -> dict[tuple, GridCell | None]:
+        units = {}
+        cells = self.__visible_cells(zoom, upper_left, lower_right)
+        if zoom <= CLUSTER_MAX_ZOOM:
+            for cell, grid_cell in cells:
+                if len(grid_cell.keys) == 1:
+                    units[next(iter(grid_cell.keys))] = None
+                else:
+                    units[("cluster", zoom, cell)] = grid_cell
+            return units
+
+        scale = 2 ** (zoom - GRID_ZOOM)
+        margin_x = (lower_right[0] - upper_left[0]) * VIEW_MARGIN
+        margin_y = (lower_right[1] - upper_left[1]) * VIEW_MARGIN
+        for _, grid_cell in cells:
+            for key in grid_cell.keys:
+                x, y = self.sites[key][3] * scale, self.sites[key][4] * scale
+                if (upper_left[0] - margin_x <= x <= lower_right[0] + margin_x
+                        and upper_left[1] - margin_y <= y <= lower_right[1] + margin_y):
+                    units[key] = None
+        return units
+
+    def refresh(self):
+        """
+        Create the markers entering the viewport and delete the ones leaving it
+        """
+        self.view = self.__current_view()
+        units = self.__wanted_units(*self.view)
+
+        for unit in [u for u in self.drawn if u not in units]:
+            self.drawn.pop(unit).delete()
+
+        for unit, grid_cell in units.items():
+            if unit in self.drawn:
+                continue
+            if grid_cell is None:
+                self.drawn[unit] = self.__site_marker(*unit)
+            else:
+                self.drawn[unit] = self.__cluster_marker(unit[1], grid_cell)
+
+    def __site_marker(self, table: str, id: int):
+        latitude, longitude, name, _, _ = self.sites[(table, id)]
+        return self.map.set_marker(
+            latitude, longitude, text=name,
+            command=lambda _, table=table, id=id: self.on_click(table, id),
+            **MARKER_STYLES[table])
+
+    def __cluster_marker(self, zoom: int, grid_cell: GridCell):
+        latitude, longitude = grid_cell.center()
+        return self.map.set_marker(
+            latitude, longitude, text=f"{len(grid_cell.keys)} sites",
+            command=lambda _: self.__zoom_into(latitude, longitude, zoom),
+            **CLUSTER_STYLE)
+
+    def __zoom_into(self, latitude: float, longitude: float, zoom: int):
+        self.map.set_position(latitude, longitude)
+        self.map.set_zoom(zoom + 2)
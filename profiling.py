@@ -0,0 +1,158 @@
+"""
+Per-query timings of DB, cheap enough to leave on
+
+Every select and named statement is counted under its name: calls, rows
+returned, total and max time and a latency histogram with fixed buckets.
+Commits of the writer connection are counted the same way. A query slower
+than slow_ms is logged to the "pwms.queries" logger, with its query plan
+the first time a query of that name is slow.
+"""
+import bisect
+import json
+import logging
+import sqlite3 as sql
+import threading
+import time
+from pathlib import Path
+
+SLOW_QUERY_MS = 100.0
+# Upper bounds of the latency histogram buckets in ms, slower calls go into one last bucket
+BUCKETS_MS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0)
+COMMIT = "commit"
+
+log = logging.getLogger("pwms.queries")
+
+
+class QueryStats:
+    """
+    Counters of one query name
+    """
+    __slots__ = ("calls", "rows", "seconds", "max_seconds", "buckets")
+
+    def __init__(self):
+        self.calls = 0
+        self.rows = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, seconds: float, rows: int):
+        self.calls += 1
+        self.rows += rows
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.buckets[bisect.bisect_left(BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound in ms of the bucket holding the given fraction of the calls
+        """
+        wanted = fraction * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max_seconds * 1000)
+        return self.max_seconds * 1000
+
+    def to_dict(self) -> dict:
+        labels = [f"<={bound:g}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]:g}ms"]
+        return {
+            "calls": self.calls,
+            "rows": self.rows,
+            "total_ms": self.seconds * 1000,
+            "mean_ms": self.seconds * 1000 / self.calls if self.calls else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_seconds * 1000,
+            "histogram": {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Profiler:
+    """
+    Collects QueryStats by name, shared by every thread using one DB
+
+    explain(query, params) returns the query plan lines of a slow query, it
+    runs once per name so a query that is always slow does not pay for it
+    on every call.
+    """
+
+    def __init__(self, slow_ms: float | None = SLOW_QUERY_MS, explain=None):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.stats: dict[str, QueryStats] = {}
+        self.explained: set[str] = set()
+        self.slow = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, rows: int, query: str | None = None, params: tuple = None):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = QueryStats()
+            stats.add(seconds, rows)
+
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            self.__log_slow(name, seconds, rows, query, params)
+
+    def __log_slow(self, name: str, seconds: float, rows: int, query: str | None, params: tuple):
+        with self.lock:
+            self.slow += 1
+            first = name not in self.explained
+            self.explained.add(name)
+
+        message = f"SLOW: {name} {seconds * 1000:.1f} ms, {rows} rows"
+        if first and query is not None and self.explain is not None:
+            try:
+                plan = self.explain(query, params)
+            except sql.Error as e:
+                plan = [f"no plan: {e}"]
+            message += "".join(f"\n    {line}" for line in plan)
+        log.warning(message)
+
+    def snapshot(self) -> dict:
+        """
+        Every counter as plain values, slowest total time first
+        """
+        with self.lock:
+            queries = {name: stats.to_dict() for name, stats in self.stats.items()}
+            slow = self.slow
+        return {
+            "since": self.started,
+            "slow_ms": self.slow_ms,
+            "slow_queries": slow,
+            "queries": dict(sorted(queries.items(), key=lambda item: item[1]["total_ms"], reverse=True)),
+        }
+
+    def dump(self, path: str | Path):
+        Path(path).write_text(json.dumps(self.snapshot(), indent=2), encoding="utf-8")
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.explained.clear()
+            self.slow = 0
+            self.started = time.time()
+
+
+class ProfiledConnection(sql.Connection):
+    """
+    Writer connection timing its commits, explicit or at the end of a with block
+    """
+    profiler: Profiler | None = None
+
+    def commit(self):
+        start = time.perf_counter()
+        super().commit()
+        if self.profiler is not None:
+            self.profiler.record(COMMIT, time.perf_counter() - start, 0)
+
+    def __exit__(self, exc_type, exc, tb):
+        start = time.perf_counter()
+        result = super().__exit__(exc_type, exc, tb)
+        if self.profiler is not None and exc_type is None:
+            self.profiler.record(COMMIT, time.perf_counter() - start, 0)
+        return result
@@ -0,0 +1,511 @@
+import heapq
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("Sea routes need numpy, install it with: pip install numpy", name="numpy") from e
+
+from .db import DB, Tables
+from .geo import EARTH_RADIUS_KM
+
+KM_PER_NAUTICAL_MILE = 1.852
+SPEED_KNOTS = 14.0
+ROUTE_CACHE_SIZE = 4096
+# 8192 ports take 256 MB as float32
+MATRIX_MAX_PORTS = 8192
+MATRIX_BLOCK_ROWS = 256
+
+# Coarse sea lanes around India and on to the Gulf, East Africa, Europe and East Asia.
+# Ports join the graph at their nearest waypoint, lanes are sailed as great circles.
+WAYPOINTS = {
+    "Gulf of Kutch": (22.7, 69.6),
+    "Off Dwarka": (22.4, 68.6),
+    "Off Veraval": (20.5, 70.0),
+    "Off Mumbai": (18.9, 72.3),
+    "Off Goa": (15.4, 73.4),
+    "Off Mangalore": (12.9, 74.4),
+    "Off Kochi": (9.9, 75.8),
+    "Cape Comorin": (7.5, 77.5),
+    "Off Colombo": (6.9, 79.6),
+    "Dondra Head": (5.6, 80.6),
+    "Off Trincomalee": (8.8, 81.6),
+    "Off Chennai": (13.1, 80.7),
+    "Off Visakhapatnam": (17.5, 83.8),
+    "Off Paradip": (20.0, 87.2),
+    "Sandheads": (21.0, 88.2),
+    "North Bay of Bengal": (19.0, 89.8),
+    "Off Chittagong": (21.8, 91.2),
+    "Ten Degree Channel": (10.2, 92.5),
+    "Off Port Blair": (11.6, 93.0),
+    "Great Channel": (6.2, 94.8),
+    "Malacca Strait North": (5.8, 98.0),
+    "Malacca Strait": (3.0, 100.6),
+    "Malacca Strait South": (1.9, 102.5),
+    "Singapore Strait": (1.15, 104.1),
+    "South China Sea": (10.0, 112.0),
+    "Off Hong Kong": (21.8, 114.5),
+    "Taiwan Strait": (24.0, 119.3),
+    "East China Sea": (30.5, 123.5),
+    "Korea Strait": (34.2, 129.0),
+    "South of Kyushu": (30.0, 131.5),
+    "Off Tokyo": (34.7, 140.0),
+    "Arabian Sea": (15.0, 65.0),
+    "Off Karachi": (24.3, 66.6),
+    "Off Ras al Hadd": (22.7, 60.4),
+    "Gulf of Oman": (24.5, 58.8),
+    "Strait of Hormuz": (26.4, 56.6),
+    "Persian Gulf": (27.2, 51.5),
+    "Gulf of Aden": (12.5, 48.5),
+    "Bab-el-Mandeb": (12.6, 43.4),
+    "Red Sea": (20.0, 38.5),
+    "Gulf of Suez": (27.5, 34.0),
+    "Suez": (29.9, 32.55),
+    "Port Said": (31.35, 32.35),
+    "Eastern Mediterranean": (33.5, 27.0),
+    "South of Crete": (34.5, 24.0),
+    "Strait of Sicily": (37.0, 11.8),
+    "North of Tunisia": (37.6, 10.5),
+    "Off Algiers": (37.3, 3.0),
+    "Gibraltar": (35.95, -5.5),
+    "Cape St Vincent": (36.8, -9.3),
+    "Cape Finisterre": (43.3, -9.8),
+    "Ushant": (48.6, -5.6),
+    "Dover Strait": (51.0, 1.5),
+    "Off Rotterdam": (52.0, 3.8),
+    "Off Canary Islands": (29.0, -12.5),
+    "Off Dakar": (14.5, -18.0),
+    "Off Liberia": (4.0, -10.0),
+    "Gulf of Guinea": (0.0, 3.0),
+    "Off Namibia": (-22.0, 11.0),
+    "Cape of Good Hope": (-35.0, 18.5),
+    "Cape Agulhas": (-35.5, 20.0),
+    "Off Port Elizabeth": (-34.6, 26.5),
+    "Off Durban": (-30.0, 31.8),
+    "Mozambique Channel": (-20.0, 40.0),
+    "North Mozambique Channel": (-14.0, 42.5),
+    "Off Mombasa": (-4.2, 40.2),
+    "Off Somalia": (3.0, 49.0),
+    "Off Hafun": (10.4, 52.5),
+    "Off Cape Guardafui": (12.1, 51.6),
+}
+
+SEA_LANES = [
+    # West coast of India
+    ("Gulf of Kutch", "Off Dwarka"),
+    ("Off Dwarka", "Off Veraval"),
+    ("Off Dwarka", "Off Karachi"),
+    ("Off Veraval", "Off Mumbai"),
+    ("Off Mumbai", "Off Goa"),
+    ("Off Goa", "Off Mangalore"),
+    ("Off Mangalore", "Off Kochi"),
+    ("Off Kochi", "Cape Comorin"),
+    ("Cape Comorin", "Off Colombo"),
+    ("Off Colombo", "Dondra Head"),
+    # East coast and the Bay of Bengal
+    ("Dondra Head", "Off Trincomalee"),
+    ("Off Trincomalee", "Off Chennai"),
+    ("Off Chennai", "Off Visakhapatnam"),
+    ("Off Visakhapatnam", "Off Paradip"),
+    ("Off Paradip", "Sandheads"),
+    ("Sandheads", "North Bay of Bengal"),
+    ("North Bay of Bengal", "Off Chittagong"),
+    ("North Bay of Bengal", "Ten Degree Channel"),
+    ("Off Chennai", "Ten Degree Channel"),
+    ("Ten Degree Channel", "Off Port Blair"),
+    ("Ten Degree Channel", "Great Channel"),
+    ("Dondra Head", "Ten Degree Channel"),
+    ("Dondra Head", "Great Channel"),
+    ("Off Trincomalee", "Great Channel"),
+    # Malacca and East Asia
+    ("Great Channel", "Malacca Strait North"),
+    ("Malacca Strait North", "Malacca Strait"),
+    ("Malacca Strait", "Malacca Strait South"),
+    ("Malacca Strait South", "Singapore Strait"),
+    ("Singapore Strait", "South China Sea"),
+    ("South China Sea", "Off Hong Kong"),
+    ("Off Hong Kong", "Taiwan Strait"),
+    ("Taiwan Strait", "East China Sea"),
+    ("East China Sea", "Korea Strait"),
+    ("East China Sea", "South of Kyushu"),
+    ("South of Kyushu", "Off Tokyo"),
+    # Arabian Sea and the Gulf
+    ("Off Mumbai", "Arabian Sea"),
+    ("Off Goa", "Arabian Sea"),
+    ("Off Kochi", "Arabian Sea"),
+    ("Off Karachi", "Off Ras al Hadd"),
+    ("Arabian Sea", "Off Ras al Hadd"),
+    ("Off Ras al Hadd", "Gulf of Oman"),
+    ("Gulf of Oman", "Strait of Hormuz"),
+    ("Strait of Hormuz", "Persian Gulf"),
+    # Suez and Europe
+    ("Arabian Sea", "Gulf of Aden"),
+    ("Gulf of Aden", "Bab-el-Mandeb"),
+    ("Bab-el-Mandeb", "Red Sea"),
+    ("Red Sea", "Gulf of Suez"),
+    ("Gulf of Suez", "Suez"),
+    ("Suez", "Port Said"),
+    ("Port Said", "Eastern Mediterranean"),
+    ("Eastern Mediterranean", "South of Crete"),
+    ("South of Crete", "Strait of Sicily"),
+    ("Strait of Sicily", "North of Tunisia"),
+    ("North of Tunisia", "Off Algiers"),
+    ("Off Algiers", "Gibraltar"),
+    ("Gibraltar", "Cape St Vincent"),
+    ("Cape St Vincent", "Cape Finisterre"),
+    ("Cape Finisterre", "Ushant"),
+    ("Ushant", "Dover Strait"),
+    ("Dover Strait", "Off Rotterdam"),
+    # Around Africa
+    ("Cape St Vincent", "Off Canary Islands"),
+    ("Off Canary Islands", "Off Dakar"),
+    ("Off Dakar", "Off Liberia"),
+    ("Off Liberia", "Gulf of Guinea"),
+    ("Gulf of Guinea", "Off Namibia"),
+    ("Off Namibia", "Cape of Good Hope"),
+    ("Cape of Good Hope", "Cape Agulhas"),
+    ("Cape Agulhas", "Off Port Elizabeth"),
+    ("Off Port Elizabeth", "Off Durban"),
+    ("Off Durban", "Mozambique Channel"),
+    ("Mozambique Channel", "North Mozambique Channel"),
+    ("North Mozambique Channel", "Off Mombasa"),
+    ("Off Mombasa", "Off Somalia"),
+    ("Off Somalia", "Off Hafun"),
+    ("Off Hafun", "Off Cape Guardafui"),
+    ("Off Cape Guardafui", "Gulf of Aden"),
+    ("Arabian Sea", "Off Somalia"),
+]
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distances in kilometers between every position 1 (rows) and every position 2 (columns)
+    """
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))[:, None]
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))[None, :]
+    dlambda = np.radians(np.asarray(lon2, dtype=np.float64))[None, :] \
+        - np.radians(np.asarray(lon1, dtype=np.float64))[:, None]
+
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_pairs(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Great-circle distances in kilometers between position 1[i] and position 2[i]
+    """
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dlambda = np.radians(lon2) - np.radians(lon1)
+
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class DistanceMatrix:
+    """
+    Great-circle distances between all ports
+
+    The matrix is computed once and then updated incrementally, when ports
+    are added, moved or removed only their rows and columns are computed
+    again. Distances are stored as float32, plenty for kilometers and half
+    the memory. Above max_ports the matrix would not fit comfortably in
+    memory and distances are computed per pair instead.
+    """
+
+    def __init__(self, max_ports: int = MATRIX_MAX_PORTS):
+        self.max_ports = max_ports
+        self.ids = np.empty(0, dtype=np.int64)
+        self.latitudes = np.empty(0, dtype=np.float64)
+        self.longitudes = np.empty(0, dtype=np.float64)
+        self.km: np.ndarray | None = np.empty((0, 0), dtype=np.float32)
+        # port_id -> row of the matrix, -1 for unknown ids
+        self.slots = np.full(1, -1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def update(self, ids, latitudes, longitudes) -> np.ndarray:
+        """
+        Bring the matrix up to date with the current ports
+        Returns the ids of the ports which were added, moved or removed
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+
+        old = self.slot_of(ids)
+        known = old >= 0
+        unchanged = known.copy()
+        unchanged[known] = (self.latitudes[old[known]] == latitudes[known]) \
+            & (self.longitudes[old[known]] == longitudes[known])
+        removed = np.setdiff1d(self.ids, ids)
+        changed = np.concatenate([ids[~unchanged], removed])
+        if not len(changed):
+            return changed
+
+        # Unchanged ports first so their distances are copied over as one block
+        order = np.concatenate([np.flatnonzero(unchanged), np.flatnonzero(~unchanged)])
+        keep = old[order[:unchanged.sum()]]
+        self.ids, self.latitudes, self.longitudes = ids[order], latitudes[order], longitudes[order]
+        self.slots = np.full(int(ids.max(initial=0)) + 1, -1, dtype=np.int64)
+        self.slots[self.ids] = np.arange(len(self.ids))
+
+        if len(ids) > self.max_ports:
+            self.km = None
+            return changed
+
+        km = np.empty((len(ids), len(ids)), dtype=np.float32)
+        if self.km is None:
+            keep = keep[:0]
+        km[:len(keep), :len(keep)] = self.km[np.ix_(keep, keep)] if len(keep) else 0
+        # In blocks of rows, the float64 intermediates of a full matrix would be several times its size
+        for start in range(len(keep), len(ids), MATRIX_BLOCK_ROWS):
+            stop = min(start + MATRIX_BLOCK_ROWS, len(ids))
+            block = haversine_matrix(self.latitudes[start:stop], self.longitudes[start:stop],
+                                     self.latitudes, self.longitudes)
+            km[start:stop, :] = block
+            km[:, start:stop] = block.T
+        self.km = km
+        return changed
+
+    def slot_of(self, ids) -> np.ndarray:
+        """
+        Matrix rows of ids, -1 for ports that are not in the matrix
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < len(self.slots))
+        slots = np.full(ids.shape, -1, dtype=np.int64)
+        slots[inside] = self.slots[ids[inside]]
+        return slots
+
+    def distances(self, from_ids, into_ids) -> np.ndarray:
+        """
+        Distance of every (from_ids[i], into_ids[i]) pair, NaN where a port has no position
+        """
+        a, b = self.slot_of(from_ids), self.slot_of(into_ids)
+        missing = (a < 0) | (b < 0)
+        if not len(self.ids):
+            return np.full(a.shape, np.nan)
+
+        a, b = np.where(missing, 0, a), np.where(missing, 0, b)
+        if self.km is not None:
+            km = self.km[a, b].astype(np.float64)
+        else:
+            km = haversine_pairs(self.latitudes[a], self.longitudes[a], self.latitudes[b], self.longitudes[b])
+        km[missing] = np.nan
+        return km
+
+    def position(self, id: int) -> tuple[float, float] | None:
+        slot = self.slot_of([id])[0]
+        if slot < 0:
+            return None
+        return float(self.latitudes[slot]), float(self.longitudes[slot])
+
+
+class SeaLanes:
+    """
+    Waypoints connected by sea lanes, searched with Dijkstra
+    """
+
+    def __init__(self, waypoints: dict[str, tuple[float, float]] = WAYPOINTS,
+                 lanes: list[tuple[str, str]] = SEA_LANES):
+        self.names = list(waypoints)
+        index = {name: i for i, name in enumerate(self.names)}
+        self.latitudes = np.array([waypoints[name][0] for name in self.names], dtype=np.float64)
+        self.longitudes = np.array([waypoints[name][1] for name in self.names], dtype=np.float64)
+
+        a = np.array([index[a] for a, _ in lanes], dtype=np.int64)
+        b = np.array([index[b] for _, b in lanes], dtype=np.int64)
+        km = haversine_matrix(self.latitudes, self.longitudes, self.latitudes, self.longitudes)[a, b]
+
+        self.edges: list[list[tuple[int, float]]] = [[] for _ in self.names]
+        for i, j, d in zip(a.tolist(), b.tolist(), km.tolist()):
+            self.edges[i].append((j, d))
+            self.edges[j].append((i, d))
+
+    def nearest(self, latitude: float, longitude: float) -> tuple[int, float]:
+        """
+        (waypoint, km) closest to the position
+        """
+        km = haversine_matrix([latitude], [longitude], self.latitudes, self.longitudes)[0]
+        i = int(np.argmin(km))
+        return i, float(km[i])
+
+    def position(self, waypoint: int) -> tuple[float, float]:
+        return float(self.latitudes[waypoint]), float(self.longitudes[waypoint])
+
+    def shortest_path(self, start: int, goal: int) -> tuple[float, list[int]] | None:
+        """
+        (km, waypoints) of the shortest way from start to goal, None if goal cannot be reached
+        """
+        distances = {start: 0.0}
+        previous = {}
+        heap = [(0.0, start)]
+        while heap:
+            km, node = heapq.heappop(heap)
+            if node == goal:
+                path = [goal]
+                while path[-1] != start:
+                    path.append(previous[path[-1]])
+                return km, path[::-1]
+            if km > distances[node]:
+                continue
+            for neighbour, length in self.edges[node]:
+                total = km + length
+                if total < distances.get(neighbour, float("inf")):
+                    distances[neighbour] = total
+                    previous[neighbour] = node
+                    heapq.heappush(heap, (total, neighbour))
+        return None
+
+
+class RouteEngine:
+    """
+    Distances, sea routes and sailing times between ports
+
+    Port positions are read from the database by sync(), call it again after
+    ports were added, moved or removed. Routes are cached per port pair and
+    dropped when one of their ports changes. Safe to use from worker threads.
+    """
+
+    def __init__(self, db: DB, lanes: SeaLanes | None = None, speed_knots: float = SPEED_KNOTS,
+                 cache_size: int = ROUTE_CACHE_SIZE):
+        self.db = db
+        self.lanes = lanes or SeaLanes()
+        self.speed_kmh = speed_knots * KM_PER_NAUTICAL_MILE
+        self.cache_size = cache_size
+
+        self.matrix = DistanceMatrix()
+        self.routes: OrderedDict[tuple[int, int], dict] = OrderedDict()
+        self.lock = threading.RLock()
+        self.sync()
+
+    def sync(self) -> int:
+        """
+        Read the port positions again, returns the number of changed ports
+        """
+        _, rows = self.db.select_rows(f"""
+            SELECT port_id, latitude, longitude FROM {Tables.PORTS}
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+            ORDER BY port_id""")
+        ids, latitudes, longitudes = zip(*rows) if rows else ((), (), ())
+
+        with self.lock:
+            changed = set(self.matrix.update(ids, latitudes, longitudes).tolist())
+            if changed:
+                for key in [key for key in self.routes if key[0] in changed or key[1] in changed]:
+                    del self.routes[key]
+        return len(changed)
+
+    def distance(self, from_port: int, into_port: int) -> float:
+        """
+        Great-circle distance in kilometers, NaN if a port has no position
+        """
+        with self.lock:
+            return float(self.matrix.distances([from_port], [into_port])[0])
+
+    def route(self, from_port: int, into_port: int) -> dict | None:
+        """
+        Shortest sea route between two ports as
+        {"from_port", "into_port", "distance_km", "eta_hours", "path": [(lat, lon), ...]}
+        None if a port has no position
+        """
+        key = (from_port, into_port)
+        with self.lock:
+            route = self.routes.get(key)
+            if route is not None:
+                self.routes.move_to_end(key)
+                return route
+
+            start, goal = self.matrix.position(from_port), self.matrix.position(into_port)
+        if start is None or goal is None:
+            return None
+
+        route = self.__find_route(start, goal)
+        route = {
+            "from_port": from_port,
+            "into_port": into_port,
+            "distance_km": route[0],
+            "eta_hours": route[0] / self.speed_kmh,
+            "path": route[1],
+        }
+        with self.lock:
+            self.routes[key] = route
+            while len(self.routes) > self.cache_size:
+                self.routes.popitem(last=False)
+        return route
+
+    def __find_route(self, start: tuple[float, float],
+                     goal: tuple[float, float]) -> tuple[float, list[tuple[float, float]]]:
+        direct = float(haversine_matrix([start[0]], [start[1]], [goal[0]], [goal[1]])[0, 0])
+        a, a_km = self.lanes.nearest(*start)
+        b, b_km = self.lanes.nearest(*goal)
+        found = self.lanes.shortest_path(a, b) if a != b else None
+        if found is None:
+            # Same waypoint or no lane between them, sail straight
+            return direct, [start, goal]
+
+        km, waypoints = found
+        return a_km + km + b_km, [start, *(self.lanes.position(w) for w in waypoints), goal]
+
+    def shipping_routes(self, shipping_ids=None) -> tuple[list[str], list[tuple]]:
+        """
+        Direct and sea distance and sailing time of shippings, all of them by default
+        Returns (columns, rows) like DB.select_rows. The distances are looked up for
+        all rows at once and each distinct port pair is routed only once.
+        """
+        query = f"SELECT shipping_id, from_port, into_port FROM {Tables.SHIPPINGS}"
+        if shipping_ids is None:
+            _, rows = self.db.select_rows(query + " ORDER BY shipping_id")
+        else:
+            _, rows = self.db.select_rows(
+                query + " WHERE shipping_id IN (SELECT value FROM json_each(?)) ORDER BY shipping_id",
+                (json.dumps([int(id) for id in shipping_ids]),))
+
+        columns = ["shipping_id", "from_port", "into_port", "direct_km", "distance_km", "eta_hours"]
+        if not rows:
+            return columns, []
+
+        _, from_ports, into_ports = (np.array(col, dtype=np.float64) for col in zip(*rows))
+        return columns, [(*row, *values) for row, *values in zip(rows, *self.__columns(from_ports, into_ports))]
+
+    def annotate(self, columns: list[str], rows: list[tuple]) -> tuple[list[str], list[tuple]]:
+        """
+        Add distance_km and eta_hours to a page of Shippings rows
+        """
+        if not rows:
+            return [*columns, "distance_km", "eta_hours"], rows
+        from_ports = np.array([row[columns.index("from_port")] for row in rows], dtype=np.float64)
+        into_ports = np.array([row[columns.index("into_port")] for row in rows], dtype=np.float64)
+        _, distance, eta = self.__columns(from_ports, into_ports)
+        return [*columns, "distance_km", "eta_hours"], [(*row, *values) for row, *values in zip(rows, distance, eta)]
+
+    def __columns(self, from_ports: np.ndarray, into_ports: np.ndarray) -> tuple[list, list, list]:
+        """
+        (direct_km, distance_km, eta_hours) lists for port id arrays, None where unknown
+        """
+        valid = ~(np.isnan(from_ports) | np.isnan(into_ports))
+        from_ids = np.where(valid, from_ports, -1).astype(np.int64)
+        into_ids = np.where(valid, into_ports, -1).astype(np.int64)
+
+        with self.lock:
+            direct = self.matrix.distances(from_ids, into_ids)
+
+        # Each distinct pair is routed once, pairs are packed into one integer key for np.unique
+        width = int(into_ids.max(initial=0)) + 2
+        keys, inverse = np.unique((from_ids + 1) * width + into_ids + 1, return_inverse=True)
+        sea = np.array([
+            route["distance_km"] if (route := self.route(a, b)) is not None else np.nan
+            for a, b in zip((keys // width - 1).tolist(), (keys % width - 1).tolist())
+        ], dtype=np.float64)[inverse.reshape(-1)]
+        sea[np.isnan(direct)] = np.nan
+        eta = sea / self.speed_kmh
+
+        columns = []
+        for col in (direct, sea, eta):
+            values = np.round(col, 1).astype(object)
+            values[np.isnan(col)] = None
+            columns.append(values.tolist())
+        return tuple(columns)
@@ -0,0 +1,73 @@
+"""
+Catalog of the database schema read from PRAGMA table_info and foreign_key_list
+
+Looking a table up here costs a dict access instead of a query. The
+catalog is read once, on first use, and again after every refresh.
+DB refreshes it after migrating.
+"""
+
+
+class TableSchema:
+    """
+    Columns of one table in declaration order
+    """
+    __slots__ = ("name", "columns", "types", "not_null", "primary_key", "foreign_keys")
+
+    def __init__(self, name: str, columns: list[dict], foreign_keys: dict[str, tuple[str, str | None]]):
+        self.name = name
+        self.columns = [col["name"] for col in columns]
+        # Declared types as written in CREATE TABLE, lower case
+        self.types = {col["name"]: col["type"].lower() for col in columns}
+        self.not_null = {col["name"] for col in columns if col["notnull"]}
+        pk = sorted((col["pk"], col["name"]) for col in columns if col["pk"])
+        self.primary_key = pk[0][1] if len(pk) == 1 else None
+        # column -> (referenced table, referenced column)
+        self.foreign_keys = foreign_keys
+
+    def insert_columns(self) -> list[str]:
+        """
+        Columns given on insert, all but an integer primary key which SQLite assigns
+        """
+        if self.primary_key is not None and self.types[self.primary_key] == "integer":
+            return [col for col in self.columns if col != self.primary_key]
+        return list(self.columns)
+
+
+class SchemaCatalog:
+    """
+    TableSchema of every table, read through select(query) -> list[dict]
+    """
+
+    def __init__(self, select):
+        self.select = select
+        self.tables: dict[str, TableSchema] | None = None
+
+    def refresh(self):
+        """
+        Read the schema again, after the tables changed
+        """
+        tables = {}
+        names = self.select("SELECT name FROM sqlite_schema WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+        for row in names:
+            name = row["name"]
+            columns = self.select(f"PRAGMA table_info({name})")
+            foreign_keys = {fk["from"]: (fk["table"], fk["to"])
+                            for fk in self.select(f"PRAGMA foreign_key_list({name})")}
+            tables[name] = TableSchema(name, columns, foreign_keys)
+
+        # A foreign key without a column refers to the primary key of its table
+        for table in tables.values():
+            for col, (target, column) in table.foreign_keys.items():
+                if column is None and target in tables:
+                    table.foreign_keys[col] = (target, tables[target].primary_key)
+
+        # Swapped in whole, readers on other threads see the old or the new catalog
+        self.tables = tables
+
+    def table(self, name: str) -> TableSchema:
+        if self.tables is None:
+            self.refresh()
+        try:
+            return self.tables[name]
+        except KeyError:
+            raise ValueError(f"{name} is not a table") from None
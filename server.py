@@ -0,0 +1,436 @@
+"""
+Local HTTP/JSON API over the database, for several clients at once
+
+    python -m pwms cli serve --host 0.0.0.0 --port 8080
+
+    GET    /tables/{table}?after=&before=&limit=    keyset page, columns + rows
+    POST   /tables/{table}                          insert, body is the insert_*_data arguments
+    GET    /tables/{table}/{id}                     one row
+    PATCH  /tables/{table}/{id}                     update the given columns
+    DELETE /tables/{table}/{id}                     delete one row
+    GET    /info/{table}/{id}                       get_*_info
+    GET    /relations/{table}/{id}                  get_*_relations, the event history of a shipping
+    GET    /events?status=&since=&limit=            events of one status, oldest first
+    POST   /events                                  {"events": [{"shipping_id", "status", "ts"}, ...]}
+    GET    /search?q=&tables=&limit=&fuzzy=         ports, warehouses and items matching q, best first
+    GET    /metrics                                 request latencies, query profile and cache stats
+    GET    /health
+
+Every GET answers with an ETag and honours If-None-Match with 304 Not Modified.
+Writes run one at a time on a single writer thread, reads run on a pool of
+threads each using a read-only connection, so readers never wait for a write.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import sqlite3 as sql
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .connection import READERS
+from .db import CACHE_SIZE, DB, PAGE_SIZE, SEARCH_LIMIT, VIEWS, Tables
+
+HOST = "127.0.0.1"
+PORT = 8080
+MAX_PAGE = 5_000
+MAX_BODY = 1 << 20          # 1 MB
+IDLE_TIMEOUT = 30           # seconds a keep-alive connection may stay quiet
+LATENCY_SAMPLES = 1_000     # latest requests per route the percentiles are taken from
+
+log = logging.getLogger(__name__)
+
+# table -> DB method creating a row of it
+INSERTS = {
+    Tables.PORTS: "insert_port_data",
+    Tables.WAREHOUSES: "insert_warehouse_data",
+    Tables.ITEMS: "insert_item_data",
+    Tables.INVENTORY: "insert_inventory_data",
+    Tables.SHIPPINGS: "insert_shippings_data",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str | None = None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def table_name(value: str) -> str:
+    """
+    Table from a URL segment, its name (Ports) or Tables key (PORTS) in any case
+    """
+    try:
+        return Tables.lookup(value)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.NOT_FOUND, str(e)) from None
+
+
+def row_id(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"Invalid id {value!r}") from None
+
+
+def route_of(parts: list[str]) -> str:
+    """
+    Path template a request is counted under in the metrics, ids and tables left out
+    """
+    if not parts:
+        return "/"
+    if parts[0] not in ("tables", "info", "relations", "events", "search", "health", "metrics"):
+        return "/{unknown}"
+    return "/" + "/".join([parts[0], "{table}", "{id}"][:len(parts)])
+
+
+def int_param(query: dict, name: str, default: int | None = None) -> int | None:
+    values = query.get(name)
+    if not values:
+        return default
+    try:
+        return int(values[-1])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer") from None
+
+
+def present(rows: list[dict]) -> list[dict]:
+    """
+    Drop the placeholder row of None values DB.select returns for an empty result
+    """
+    return [row for row in rows if any(value is not None for value in row.values())]
+
+
+class Metrics:
+    """
+    Request count and latency percentiles per route
+    """
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self.samples = samples
+        self.routes: dict[str, dict] = {}
+        self.started = time.time()
+
+    def record(self, route: str, seconds: float, status: int):
+        entry = self.routes.get(route)
+        if entry is None:
+            entry = self.routes[route] = {"count": 0, "errors": 0, "latencies": deque(maxlen=self.samples)}
+        entry["count"] += 1
+        if status >= 400:
+            entry["errors"] += 1
+        entry["latencies"].append(seconds)
+
+    def snapshot(self) -> dict:
+        routes = {}
+        for route, entry in sorted(self.routes.items()):
+            latencies = sorted(entry["latencies"])
+            routes[route] = {
+                "count": entry["count"],
+                "errors": entry["errors"],
+                "mean_ms": 1000 * sum(latencies) / len(latencies),
+                "p50_ms": 1000 * latencies[len(latencies) // 2],
+                "p95_ms": 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                "max_ms": 1000 * latencies[-1],
+            }
+        return {"uptime_seconds": time.time() - self.started, "routes": routes}
+
+
+class APIServer:
+    """
+    asyncio HTTP/1.1 server answering JSON requests from one DB
+
+    The DB is created on the writer thread so that thread owns the writer
+    connection. Reads are handed to a pool of `readers` threads and DB sends
+    them to its read-only connection pool, which has the same size, so at most
+    `readers` queries run at once and none of them waits for a connection.
+    """
+
+    def __init__(self, path: str | None = None, host: str = HOST, port: int = PORT,
+                 readers: int = READERS, cache_size: int = CACHE_SIZE, report=print):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.readers = readers
+        self.cache_size = cache_size
+        self.report = report
+
+        self.metrics = Metrics()
+        self.db: DB | None = None
+        self.server: asyncio.Server | None = None
+        self.write_pool = ThreadPoolExecutor(1, thread_name_prefix="pwms-writer")
+        self.read_pool = ThreadPoolExecutor(readers, thread_name_prefix="pwms-reader")
+
+    async def start(self):
+        self.db = await self.write(self.__open_db)
+        self.server = await asyncio.start_server(self.__handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        if self.report:
+            self.report(f"SERVING: http://{self.host}:{self.port} ({self.db.path})")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.db is not None:
+            await self.write(self.db.close)
+            self.db = None
+        self.read_pool.shutdown()
+        self.write_pool.shutdown()
+
+    def __open_db(self) -> DB:
+        db = DB(self.path, cache_size=self.cache_size, readers=self.readers)
+        db.init_tables()
+        return db
+
+    async def read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, functools.partial(func, *args))
+
+    async def write(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.write_pool, functools.partial(func, *args))
+
+    #
+    # HTTP
+    #
+    async def __handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line.strip():
+                    break
+
+                start = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    self.__send(writer, HTTPStatus.BAD_REQUEST, self.__error("Malformed request line"), {}, False)
+                    break
+                headers = await self.__read_headers(reader)
+
+                length = int(headers.get("content-length", 0) or 0)
+                if length > MAX_BODY:
+                    self.__send(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                self.__error(f"Body is larger than {MAX_BODY} bytes"), {}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                route, status, payload, extra = await self.__dispatch(method, target, headers, body)
+                self.__send(writer, status, payload, extra, keep_alive)
+                await writer.drain()
+                self.metrics.record(route, time.perf_counter() - start, status)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def __read_headers(self, reader: asyncio.StreamReader) -> dict[str, str]:
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def __send(self, writer: asyncio.StreamWriter, status: HTTPStatus, payload: bytes,
+               extra: dict[str, str], keep_alive: bool):
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Length": str(len(payload)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **extra,
+        }
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+        writer.write(head.encode("latin-1") + b"\r\n" + payload)
+
+    def __error(self, message: str) -> bytes:
+        return json.dumps({"error": message}, separators=(",", ":")).encode()
+
+    async def __dispatch(self, method: str, target: str, headers: dict[str, str],
+                         body: bytes) -> tuple[str, HTTPStatus, bytes, dict[str, str]]:
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/") if part]
+        query = parse_qs(url.query)
+        route = f"{method} {route_of(parts)}"
+
+        try:
+            status, result, extra = await self.__route(method, parts, query, body)
+        except HTTPError as e:
+            return route, e.status, self.__error(str(e)), {}
+        except sql.IntegrityError as e:
+            return route, HTTPStatus.CONFLICT, self.__error(str(e)), {}
+        except (ValueError, TypeError) as e:
+            return route, HTTPStatus.BAD_REQUEST, self.__error(str(e)), {}
+        except Exception as e:
+            log.exception("%s %s failed", method, target)
+            return route, HTTPStatus.INTERNAL_SERVER_ERROR, self.__error("Internal server error"), {}
+
+        payload = json.dumps(result, separators=(",", ":")).encode() if result is not None else b""
+        if method == "GET" and status == HTTPStatus.OK:
+            etag = f'"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+            extra = {**extra, "ETag": etag, "Cache-Control": "no-cache"}
+            if etag in (tag.strip() for tag in headers.get("if-none-match", "").split(",")):
+                return route, HTTPStatus.NOT_MODIFIED, b"", extra
+        return route, status, payload, extra
+
+    #
+    # Endpoints, each returns (status, JSON result, extra headers)
+    #
+    async def __route(self, method: str, parts: list[str], query: dict, body: bytes):
+        match parts:
+            case ["health"] if method == "GET":
+                return HTTPStatus.OK, {"status": "ok"}, {}
+
+            case ["metrics"] if method == "GET":
+                return HTTPStatus.OK, self.__metrics(), {}
+
+            case ["tables", table] if method == "GET":
+                return HTTPStatus.OK, await self.__page(table_name(table), query), {}
+
+            case ["tables", table] if method == "POST":
+                table = table_name(table)
+                id = await self.write(self.__insert, table, self.__json(body))
+                return HTTPStatus.CREATED, {"id": id}, {"Location": f"/tables/{table}/{id}"}
+
+            case ["tables", table, id] if method == "GET":
+                return HTTPStatus.OK, await self.__row(table_name(table), row_id(id)), {}
+
+            case ["tables", table, id] if method == "PATCH":
+                table, id = table_name(table), row_id(id)
+                if not await self.write(self.db.update_row, table, id, self.__json(body)):
+                    raise HTTPError(HTTPStatus.NOT_FOUND, f"No {table} row {id}")
+                return HTTPStatus.OK, await self.__row(table, id), {}
+
+            case ["tables", table, id] if method == "DELETE":
+                table, id = table_name(table), row_id(id)
+                await self.write(self.__delete, table, id)
+                return HTTPStatus.OK, {"deleted": id}, {}
+
+            case ["events"] if method == "GET":
+                return HTTPStatus.OK, await self.__events(query), {}
+
+            case ["events"] if method == "POST":
+                events = self.__json(body).get("events")
+                if not isinstance(events, list) or not all(isinstance(e, dict) for e in events):
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, "events must be a list of objects")
+                try:
+                    params = [(e["shipping_id"], e["status"], e.get("ts")) for e in events]
+                except KeyError as e:
+                    raise HTTPError(HTTPStatus.BAD_REQUEST, f"Every event needs {e}") from None
+                result = await self.write(self.db.add_events, params)
+                return HTTPStatus.CREATED, {"rows": result["rows"]}, {}
+
+            case ["search"] if method == "GET":
+                return HTTPStatus.OK, await self.__search(query), {}
+
+            case [("info" | "relations") as view, table, id] if method == "GET":
+                table, id = table_name(table), row_id(id)
+                return HTTPStatus.OK, await self.__view(view, table, id), {}
+
+            case ["tables", *_] | ["info" | "relations", *_] | ["events" | "search" | "health" | "metrics"]:
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    def __json(self, body: bytes) -> dict:
+        try:
+            values = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON body: {e}") from None
+        if not isinstance(values, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+        return values
+
+    async def __page(self, table: str, query: dict) -> dict:
+        limit = int_param(query, "limit", PAGE_SIZE)
+        if limit < 1:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "limit must be at least 1")
+        after, before = int_param(query, "after"), int_param(query, "before")
+
+        columns, rows = await self.read(self.db.get_table_page_rows, table, after, before, min(limit, MAX_PAGE))
+        return {
+            "columns": columns,
+            "rows": rows,
+            "next_after": rows[-1][0] if rows else None,
+            "prev_before": rows[0][0] if rows else None,
+        }
+
+    async def __events(self, query: dict) -> list[dict]:
+        status = query.get("status", [None])[-1]
+        if status is None:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "status is required")
+        since = float(query.get("since", [0])[-1])
+        limit = min(int_param(query, "limit", PAGE_SIZE), MAX_PAGE)
+        return await self.read(self.db.get_events_by_status, status, since, limit)
+
+    async def __search(self, query: dict) -> list[dict]:
+        text = query.get("q", [""])[-1]
+        if not text.strip():
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "q is required")
+        tables = query.get("tables", [""])[-1]
+        tables = tuple(table_name(t) for t in tables.split(",") if t) or None
+        limit = min(int_param(query, "limit", SEARCH_LIMIT), MAX_PAGE)
+        fuzzy = query.get("fuzzy", ["1"])[-1].lower() not in ("0", "false", "no")
+        return await self.read(self.db.search, text, tables, limit, fuzzy)
+
+    async def __row(self, table: str, id: int) -> dict:
+        rows = await self.read(self.db.select_named, f"{table}.row", (id,), False)
+        if not rows:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No {table} row {id}")
+        return rows[0]
+
+    async def __view(self, view: str, table: str, id: int) -> list[dict]:
+        info, relations = VIEWS[table]
+        method = info if view == "info" else relations
+        if method is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"{table} has no {view} view")
+
+        # The views answer a missing id with an empty row, tell the two apart
+        await self.__row(table, id)
+        return present(await self.read(getattr(self.db, method), id))
+
+    def __insert(self, table: str, values: dict) -> int:
+        return getattr(self.db, INSERTS[table])(**values)
+
+    def __delete(self, table: str, id: int):
+        if not self.db.select_named(f"{table}.row", (id,), False):
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"No {table} row {id}")
+        self.db.delete_row(table, id)
+
+    def __metrics(self) -> dict:
+        metrics = self.metrics.snapshot()
+        metrics["readers"] = {"size": self.readers, "opened": len(self.db.connections.opened)}
+        if self.db.cache is not None:
+            metrics["cache"] = self.db.cache.stats()
+        metrics["queries"] = self.db.profiler.snapshot()
+        return metrics
+
+
+def serve(path: str | None = None, host: str = HOST, port: int = PORT,
+          readers: int = READERS, cache_size: int = CACHE_SIZE):
+    """
+    Run the server until interrupted
+    """
+    server = APIServer(path, host, port, readers, cache_size)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
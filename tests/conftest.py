@@ -0,0 +1,30 @@
+import importlib.util
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The repository root is the pwms package itself, import it under that name
+if "pwms" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "pwms", ROOT / "__init__.py", submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pwms"] = module
+    spec.loader.exec_module(module)
+
+from pwms.db import DB  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    DB over a copy of the bundled pwms.db, never the tracked file itself
+    """
+    shutil.copy(ROOT / "pwms.db", tmp_path / "pwms.db")
+    database = DB(tmp_path / "pwms.db", cache_size=4096)
+    database.init_tables()
+    yield database
+    database.close()
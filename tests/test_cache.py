@@ -0,0 +1,101 @@
+"""
+Cached info/relations views have to match a fresh read after every write API
+"""
+import pytest
+
+from pwms.cache import _MISSING, QueryCache
+from pwms.db import PRIMARY_KEYS, VIEWS, Tables
+
+# Cached views keyed by an id of table, besides the VIEWS pairs
+EXTRA_VIEWS = {Tables.INVENTORY: ["get_shipping_status"]}
+
+
+def views(db) -> list[tuple[str, int]]:
+    result = []
+    for table, names in VIEWS.items():
+        pk = PRIMARY_KEYS[table]
+        ids = [row[pk] for row in db.select(f"SELECT {pk} FROM {table}", empty_row=False)]
+        for name in [*names, *EXTRA_VIEWS.get(table, [])]:
+            if name:
+                result += [(name, id) for id in ids]
+    return result
+
+
+WRITES = {
+    "insert_port_data": lambda db, s: db.insert_port_data("Test Port", 10.0, 20.0),
+    "insert_warehouse_data": lambda db, s: db.insert_warehouse_data("Test Warehouse", 11.0, 21.0, 100, 2),
+    "insert_item_data": lambda db, s: db.insert_item_data("Test Item", "Test", 1.0),
+    "insert_inventory_data": lambda db, s: db.insert_inventory_data(2, 1, 5),
+    "insert_shippings_data": lambda db, s: db.insert_shippings_data(2, 3, 4, False, False),
+    "delete_row[Shippings]": lambda db, s: db.delete_row(Tables.SHIPPINGS, s),
+    "delete_row[WarehouseInventory]": lambda db, s: db.delete_row(Tables.INVENTORY, 12),
+    "update_row[quantity]": lambda db, s: db.update_row(Tables.INVENTORY, 3, {"quantity": 7}),
+    "update_row[warehouse_id]": lambda db, s: db.update_row(Tables.INVENTORY, 3, {"warehouse_id": 1}),
+    "update_row[Ports]": lambda db, s: db.update_row(Tables.PORTS, 2, {"name": "Renamed Port"}),
+    "update_row[Shippings]": lambda db, s: db.update_row(Tables.SHIPPINGS, s, {"inventory_id": 4}),
+    "delete_rows": lambda db, s: db.delete_rows(Tables.INVENTORY, [10, 12]),
+    "delete_warehouses_cascade": lambda db, s: db.delete_warehouses_cascade([2]),
+    "update_quantities": lambda db, s: db.update_quantities({3: 7, 4: 8}),
+    "update_prices": lambda db, s: db.update_prices({2: 9.5}),
+    "add_event": lambda db, s: db.add_event(s, "arrived"),
+    "add_events": lambda db, s: db.add_events([(s, "departed", 1.0), (s, "delivered", 2.0)]),
+}
+
+
+@pytest.mark.parametrize("write", WRITES)
+def test_cache_matches_fresh_reads(db, write):
+    # A shipping of inventory row 3, whose quantity and warehouse the writes change
+    shipping_id = db.insert_shippings_data(1, 2, 3, False, False)
+
+    for name, id in views(db):
+        getattr(db, name)(id)
+    WRITES[write](db, shipping_id)
+
+    cached = {(name, id): getattr(db, name)(id) for name, id in views(db)}
+    cache, db.cache = db.cache, None
+    try:
+        fresh = {key: getattr(db, key[0])(key[1]) for key in cached}
+    finally:
+        db.cache = cache
+
+    stale = [key for key in cached if cached[key] != fresh[key]]
+    assert not stale, f"stale after {write}: {stale}"
+
+
+def test_invalidation_during_read_is_not_cached(db, monkeypatch):
+    select = db.select
+
+    def select_then_invalidate(*args, **kwargs):
+        # Another thread writes the port after this read saw the old row
+        rows = select(*args, **kwargs)
+        db.cache.invalidate(Tables.PORTS, 1)
+        return rows
+
+    monkeypatch.setattr(db, "select", select_then_invalidate)
+    db.get_port_info(1)
+    assert db.cache.get((Tables.PORTS, 1), "get_port_info") is _MISSING
+
+    monkeypatch.setattr(db, "select", select)
+    db.get_port_info(1)
+    assert db.cache.get((Tables.PORTS, 1), "get_port_info") is not _MISSING
+
+
+def test_clear_during_read_is_not_cached():
+    cache = QueryCache()
+    generation = cache.generation((Tables.PORTS, 1))
+    cache.clear()
+    cache.put((Tables.PORTS, 1), "get_port_info", [], generation)
+    assert cache.get((Tables.PORTS, 1), "get_port_info") is _MISSING
+
+
+def test_generations_stay_bounded(monkeypatch):
+    monkeypatch.setattr("pwms.cache.MAX_GENERATIONS", 10)
+    cache = QueryCache()
+    generation = cache.generation((Tables.PORTS, 1))
+    for id in range(100):
+        cache.invalidate(Tables.ITEMS, id)
+    assert len(cache.generations) <= 10
+
+    # Dropping the counters must not let a read started before them store its value
+    cache.put((Tables.PORTS, 1), "get_port_info", [], generation)
+    assert cache.get((Tables.PORTS, 1), "get_port_info") is _MISSING
@@ -0,0 +1,43 @@
+from pwms.db import SHIPMENT_EVENTS
+
+
+def statuses(db, shipping_id: int) -> list[str]:
+    rows = db.select(f"SELECT status FROM {SHIPMENT_EVENTS} WHERE shipping_id = ? ORDER BY event_id",
+                     (shipping_id,), empty_row=False)
+    return [row["status"] for row in rows]
+
+
+def test_flagged_insert_has_events(db):
+    arrived = db.insert_shippings_data(1, 2, 3, True, False)
+    loaded = db.insert_shippings_data(1, 2, 4, "true", "true")
+    pending = db.insert_shippings_data(1, 2, 5, False, False)
+
+    assert db.get_shipping_info(arrived)[0]["status"] == "arrived"
+    assert db.get_shipping_info(loaded)[0]["status"] == "loaded_to_truck"
+    assert statuses(db, loaded) == ["arrived", "loaded_to_truck"]
+    assert db.get_shipping_info(pending)[0]["status"] is None
+    assert db.check_summaries() == []
+
+
+def test_backfill_flagged_shippings(db):
+    # A shipping inserted with its flags while only the event log existed
+    db.execute("DROP TRIGGER Shippings_flag_events", ())
+    id = db.insert_shippings_data(1, 2, 3, True, True)
+    assert statuses(db, id) == []
+
+    db.execute("PRAGMA user_version = 6", ())
+    db.migrate()
+    assert statuses(db, id) == ["arrived", "loaded_to_truck"]
+    # Shippings that already had their events are left alone
+    assert statuses(db, 1) == ["arrived"]
+
+
+def test_shipping_status_counts_legacy_flags(db):
+    # The bundled shipping of inventory row 11 has its flags as 'true'/'false' strings
+    db.execute("INSERT INTO Shippings (from_port, into_port, inventory_id, arrived_at_port, loaded_to_truck) "
+               "VALUES (2, 1, 11, 'false', 'false')", ())
+    db.insert_shippings_data(1, 2, 11, True, True)
+
+    status = db.get_shipping_status(11)[0]
+    assert status == {"inventory_id": 11, "shipments": 3, "arrived": 2, "loaded": 1, "in_transit": 1}
+    assert all(type(status[key]) is int for key in ("arrived", "loaded", "in_transit"))
@@ -0,0 +1,36 @@
+import pytest
+
+from pwms.db import Tables
+from pwms.export import Exporter
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_boolean_flags(db, tmp_path):
+    # The bundled shipping has its flags as 'true'/'false' strings
+    db.insert_shippings_data(1, 2, 3, True, False)
+    Exporter(db, report=None).export_table(Tables.SHIPPINGS, tmp_path / "shippings.parquet")
+
+    table = pq.read_table(tmp_path / "shippings.parquet").to_pydict()
+    assert table["arrived_at_port"] == [True, True]
+    assert table["loaded_to_truck"] == [False, False]
+
+
+def test_parquet_query_types_cover_every_batch(db, tmp_path):
+    # Only the last batch has a fractional value, the column has to be float for all of them
+    query = "SELECT 1 AS value, 'a' AS label UNION ALL SELECT 2, 3 UNION ALL SELECT 2.5, NULL"
+    Exporter(db, fetch_size=1, report=None).export_query(query, (), tmp_path / "query.parquet")
+
+    table = pq.read_table(tmp_path / "query.parquet")
+    assert str(table.schema.field("value").type) == "double"
+    assert table.column("value").to_pylist() == [1.0, 2.0, 2.5]
+    assert table.column("label").to_pylist() == ["a", "3", None]
+
+
+def test_parquet_view(db, tmp_path):
+    Exporter(db, report=None).export_view("get_warehouse_relations", 1, tmp_path / "view.parquet")
+
+    table = pq.read_table(tmp_path / "view.parquet")
+    assert str(table.schema.field("quantity").type) == "int64"
+    assert str(table.schema.field("unit_price").type) == "double"
+    assert table.num_rows == len(db.get_warehouse_relations(1))
@@ -0,0 +1,107 @@
+import http.server
+import sqlite3 as sql
+import threading
+
+import pytest
+
+pytest.importorskip("tkintermapview")
+
+from pwms.loader import MapDownloader  # noqa: E402
+
+MISSING_TILE = (2, 1, 1)
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /{z}/{x}/{y}.png with the tile coordinates as the image, 404 for MISSING_TILE
+    """
+    requested: list[tuple[int, int, int]]
+    on_request = None
+
+    def do_GET(self):
+        tile = tuple(int(part) for part in self.path.removesuffix(".png").strip("/").split("/"))
+        self.requested.append(tile)
+        on_request = type(self).on_request
+        if on_request is not None:
+            on_request(tile)
+
+        if tile == MISSING_TILE:
+            self.send_error(404)
+            return
+        body = ("%d/%d/%d" % tile).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    handler = type("Handler", (TileHandler,), {"requested": []})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{server.server_port}/{{z}}/{{x}}/{{y}}.png"
+    server.shutdown()
+    server.server_close()
+
+
+def stored(loader: MapDownloader, table: str) -> set[tuple]:
+    db = sql.connect(loader.db_path)
+    try:
+        return set(db.execute(f"SELECT zoom, x, y FROM {table}"))
+    finally:
+        db.close()
+
+
+def test_skips_stored_tiles(tile_server, tmp_path):
+    handler, url = tile_server
+    loader = MapDownloader(tmp_path / "map.db", url, workers=2)
+    tiles = loader.world_tiles(0, 1)
+
+    loader.fetch_tiles(tiles)
+    assert sorted(handler.requested) == sorted(tiles)
+    assert stored(loader, "tiles") == set(tiles)
+
+    handler.requested.clear()
+    loader.fetch_tiles(tiles)
+    assert handler.requested == []
+    assert loader.progress() == (0, 0)
+
+
+def test_resumes_interrupted_run(tile_server, tmp_path):
+    handler, url = tile_server
+    loader = MapDownloader(tmp_path / "map.db", url, workers=1)
+    tiles = loader.world_tiles(0, 2)
+    tiles.remove(MISSING_TILE)
+
+    # Stop once a few tiles were served, what was downloaded so far is kept
+    handler.on_request = lambda tile: len(handler.requested) == 5 and loader.stop_event.set()
+    loader.fetch_tiles(tiles)
+    kept = stored(loader, "tiles")
+    assert 0 < len(kept) < len(tiles)
+
+    handler.on_request = None
+    handler.requested.clear()
+    loader.fetch_tiles(tiles)
+    assert stored(loader, "tiles") == set(tiles)
+    assert not kept & set(handler.requested)
+
+
+def test_records_missing_tile(tile_server, tmp_path):
+    handler, url = tile_server
+    loader = MapDownloader(tmp_path / "map.db", url, workers=2)
+    tiles = loader.world_tiles(0, 2)
+
+    loader.fetch_tiles(tiles)
+    assert loader.failed == 1
+    assert stored(loader, "failed_tiles") == {MISSING_TILE}
+    assert stored(loader, "tiles") == set(tiles) - {MISSING_TILE}
+
+    # A resumed run does not ask for it again
+    handler.requested.clear()
+    loader.fetch_tiles(tiles)
+    assert MISSING_TILE not in handler.requested
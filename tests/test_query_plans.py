@@ -0,0 +1,14 @@
+import pytest
+
+from pwms.db import QueryPlanError
+
+
+def test_query_plans_use_indexes(db):
+    plans = db.check_query_plans()
+    assert all(plans.values())
+
+
+def test_scan_raises(db):
+    db.execute("DROP INDEX idx_warehouses_port", ())
+    with pytest.raises(QueryPlanError, match="get_port_relations"):
+        db.check_query_plans()
@@ -0,0 +1,45 @@
+import asyncio
+import http.client
+import json
+import logging
+import shutil
+
+from pwms.server import APIServer
+
+from conftest import ROOT
+
+
+def request(port: int, path: str) -> tuple[int, dict]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_errors(tmp_path, caplog):
+    shutil.copy(ROOT / "pwms.db", tmp_path / "pwms.db")
+    server = APIServer(tmp_path / "pwms.db", port=0, report=None)
+
+    def fail(*args):
+        raise RuntimeError("broken")
+
+    async def run():
+        await server.start()
+        server.db.select_named = fail
+        try:
+            loop = asyncio.get_running_loop()
+            return [await loop.run_in_executor(None, request, server.port, path)
+                    for path in ["/tables/bogus", "/tables/ports/1"]]
+        finally:
+            await server.close()
+
+    with caplog.at_level(logging.ERROR, logger="pwms.server"):
+        (unknown_status, unknown), (failed_status, failed) = asyncio.run(run())
+
+    assert unknown_status == 404 and "unknown table 'bogus'" in unknown["error"]
+    assert failed_status == 500 and failed == {"error": "Internal server error"}
+    record, = caplog.records
+    assert "GET /tables/ports/1" in record.getMessage() and record.exc_info[0] is RuntimeError